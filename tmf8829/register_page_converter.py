@@ -7,11 +7,116 @@
 """
 The Register Page converter. See below for a usage example.
 """
-import ctypes
-import copy
+
+class RegisterPageDescriptor:
+    """Compiled lookup tables of a register page class. The tables are built once per class and make
+       address and field lookups O(1), so a page can be converted in a single pass over its bytes.
+    Attributes:
+        base_addr: address of the first register of the page
+        last_addr: address of the last register of the page
+        size: number of bytes from base_addr to last_addr (including holes)
+        reg_names: dictionary address -> attribute name of the register in the page
+        fields: dictionary field name -> (offset, shift, mask), offset is relative to base_addr, mask is not shifted
+        field_regs: dictionary field name -> attribute name of the register holding the field
+        combined: list of (base-name, field names sorted LSB..MSB) for fields that can be combined
+        combined_names: set of the field names that are part of a combined field
+    """
+
+    def __init__(self, reg_page):
+        """Build the tables for the given register page
+        Args:
+            reg_page: a register page that shall be generated with the amsOSRAM RegGen
+        """
+        self.base_addr = 0xFFFFFFFF
+        self.last_addr = 0
+        self.reg_names = {}
+        self.fields = {}
+        self.field_regs = {}
+        for _v in vars(reg_page):
+            _reg = getattr(reg_page,_v)
+            _addr = getattr(_reg, "addr")
+            self.reg_names.setdefault(_addr, _v)
+            if _addr < self.base_addr:
+                self.base_addr = _addr
+            if self.last_addr < _addr:
+                self.last_addr = _addr
+        self.size = self.last_addr - self.base_addr + 1
+        for _addr, _v in self.reg_names.items():
+            _shift = 0
+            for _field in getattr(reg_page,_v)._fields_:    # ctypes allocates little-endian bit-fields from bit 0 upwards
+                _name = _field[0]
+                _width = _field[2] if len(_field) > 2 else 8
+                if _name not in self.fields:                # first register with this field name wins (same as a linear search)
+                    self.fields[_name] = (_addr - self.base_addr, _shift, (1 << _width) - 1)
+                    self.field_regs[_name] = _v
+                _shift += _width
+        # get a dictionary of base-names
+        _combine = {}
+        for _k in self.fields:
+            _combine.setdefault(RegisterPageConverter._baseName(_k), []).append(_k)
+        self.combined = []
+        self.combined_names = set()
+        for _k, _names in _combine.items():
+            if len(_names) > 1:                     # there is something to be combined
+                self.combined.append((_k, RegisterPageConverter._suffixSort(_names, reverse=False)))
+                self.combined_names.update(_names)
+
+    def image(self, reg_page) -> bytearray:
+        """Return the current register values of the given page as a bytestream (holes are filled with 0)
+        Args:
+            reg_page: a register page of the class this descriptor was built for
+        Returns:
+            bytearray of size bytes
+        """
+        _page = bytearray(self.size)
+        for _addr, _v in self.reg_names.items():
+            _page[_addr-self.base_addr] = bytes(getattr(reg_page,_v))[0]     # only 8-bit registers are supported here
+        return _page
+
+    def decode(self, page) -> dict:
+        """Decode all fields of a page bytestream
+        Args:
+            page: bytestream of size bytes
+        Returns:
+            dictionary field name -> value
+        """
+        return { _name: (page[_off] >> _shift) & _mask for _name, (_off, _shift, _mask) in self.fields.items() }
+
+    def encode(self, d_page, page:bytearray) -> bytearray:
+        """Write the fields of the dictionary into the page bytestream
+        Args:
+            d_page: dictionary field name -> value (no range check is done here, value is truncated automatically)
+            page: bytestream of size bytes, is modified in place
+        Returns:
+            the modified page
+        """
+        for _key, _value in d_page.items():
+            if _key not in self.fields:
+                raise Exception( "setFieldValueByName No field with name {} exists".format(_key))
+            _off, _shift, _mask = self.fields[_key]
+            page[_off] = (page[_off] & ~(_mask << _shift) & 0xFF) | ((_value & _mask) << _shift)
+        return page
+
 
 class RegisterPageConverter:
 
+    _descriptors = {}
+    """Cache of compiled RegisterPageDescriptor, one per register page class"""
+
+    @staticmethod
+    def pageDescriptor( reg_page ) -> RegisterPageDescriptor:
+        """Return the compiled descriptor for the class of the given register page (built on first use)
+        Args:
+            reg_page: a register page that shall be generated with the amsOSRAM RegGen
+        Returns:
+            RegisterPageDescriptor
+        """
+        _desc = RegisterPageConverter._descriptors.get(type(reg_page))
+        if _desc is None:
+            _desc = RegisterPageDescriptor(reg_page)
+            RegisterPageConverter._descriptors[type(reg_page)] = _desc
+        return _desc
+
     @staticmethod
     def generateDict( reg_page ):
         """Generate a dictionary for the specified register-page and return it and the base-address and the last-address 
@@ -20,20 +125,8 @@ class RegisterPageConverter:
         Returns:
             dictionary, base-addr, last-addr 
         """
-        _dict = {}
-        _base_addr = 0xFFFFFFFF
-        _last_addr = 0
-        # first find the base address of the page
-        for _v in vars(reg_page):
-            _reg = getattr(reg_page,_v)
-            _addr = getattr(_reg, "addr")
-            for _name, _t, _bits in _reg._fields_:
-                _dict[_name] = 0
-            if _addr < _base_addr:
-                _base_addr = _addr
-            if _last_addr < _addr:
-                _last_addr = _addr
-        return _dict, _base_addr, _last_addr
+        _desc = RegisterPageConverter.pageDescriptor( reg_page )
+        return dict.fromkeys(_desc.fields, 0), _desc.base_addr, _desc.last_addr
 
     @staticmethod
     def regByAddr(reg_page,addr):
@@ -44,11 +137,10 @@ class RegisterPageConverter:
         Returns:
             the register object for the given address, None if there is no register at the given address
         """
-        for _v in vars(reg_page):
-            _reg = getattr(reg_page,_v)
-            if getattr(_reg,"addr") == addr:
-                return _reg
-        return None                         # if there is a hole in the reg-map 
+        _v = RegisterPageConverter.pageDescriptor( reg_page ).reg_names.get(addr)
+        if _v is None:
+            return None                         # if there is a hole in the reg-map 
+        return getattr(reg_page,_v)
 
     @staticmethod
     def getFieldValueByName(reg_page,field_name):
@@ -59,12 +151,10 @@ class RegisterPageConverter:
         Returns:
             the value of the field (raises an exception of the field does not exist)
         """
-        for _v in vars(reg_page):
-            _reg = getattr(reg_page,_v)
-            for (_name,_,_) in _reg._fields_:
-                if _name == field_name:
-                    return getattr( _reg, _name )
-        raise Exception( "getFieldValueByName: No field with name {} exists".format(field_name))
+        _v = RegisterPageConverter.pageDescriptor( reg_page ).field_regs.get(field_name)
+        if _v is None:
+            raise Exception( "getFieldValueByName: No field with name {} exists".format(field_name))
+        return getattr( getattr(reg_page,_v), field_name )
 
     @staticmethod
     def setFieldValueByName(reg_page,field_name,value):
@@ -75,13 +165,10 @@ class RegisterPageConverter:
             value: the value to that the field shall be set (no range check is done here, value is trucated automatically)
         (raises an exception of the field does not exist)
         """
-        for _v in vars(reg_page):
-            _reg = getattr(reg_page,_v)
-            for (_name,_,_) in _reg._fields_:
-                if _name == field_name:
-                    setattr( _reg, _name, value )
-                    return
-        raise Exception( "setFieldValueByName No field with name {} exists".format(field_name))
+        _v = RegisterPageConverter.pageDescriptor( reg_page ).field_regs.get(field_name)
+        if _v is None:
+            raise Exception( "setFieldValueByName No field with name {} exists".format(field_name))
+        setattr( getattr(reg_page,_v), field_name, value )
 
     @staticmethod
     def fillDict( b_page, reg_page ):
@@ -89,56 +176,31 @@ class RegisterPageConverter:
         Args:
             b_page: a bytestream that shall be filled into the registers and ends up in the dictionary that
             represents the reg_page
-            reg_page: a register page that shall be generated with the amsOSRAM RegGen
+            reg_page: a register page that shall be generated with the amsOSRAM RegGen, its current register values
+            are used for the registers that are not covered by the bytestream. The page itself is not modified.
         Returns:
             dictionary representing the corresponding register page
         """
-        _dict, _base_addr, _last_addr = RegisterPageConverter.generateDict( reg_page )
-        _b = list(b_page)
-        if _last_addr+1-_base_addr < len(_b):
+        _desc = RegisterPageConverter.pageDescriptor( reg_page )
+        if _desc.size < len(b_page):
             print( "WARNING: number of bytes is more than the given register page has, cutting data off")
-            _b = _b[0:_last_addr+1]
-        assert len(_b) <= _last_addr+1-_base_addr, "ERROR internal program error"
-        # now do a byte fill of the registers each is 8-bits 
-        for _addr in range(_base_addr, _base_addr+len(_b)):
-            _reg = RegisterPageConverter.regByAddr(reg_page, _addr)
-            if _reg:                # else this is a hole in the reg-map
-                _dst = ctypes.byref(_reg)
-                _src = bytes(_b[_addr-_base_addr:_addr-_base_addr+1])
-                ctypes.memmove(_dst, _src, 1)        # only 8-bit registers are supported here
-            else:
-                #print( "fillDict: No reg at addr {} omitting".format(_addr))
-                pass
-        # now copy bit-fields values to the dictionary
-        for _key in _dict:
-            _dict[_key] = RegisterPageConverter.getFieldValueByName(reg_page, _key)
-        return _dict
+            b_page = b_page[0:_desc.size]
+        _page = _desc.image( reg_page )
+        _page[0:len(b_page)] = b_page
+        return _desc.decode( _page )
 
     @staticmethod
     def fillPage( d_page, reg_page ):
         """Fill the given dictionary into a bytestream for given page (holes are filled with 0) 
         Args:
             d_page: dictionary representing the corresponding register page
-            reg_page: a register page that shall be generated with the amsOSRAM RegGen
+            reg_page: a register page that shall be generated with the amsOSRAM RegGen, its current register values
+            are used for the fields that are not in the dictionary. The page itself is not modified.
         Returns:
             a bytestream that represents the registers values are taken from the dictionary
         """
-        _page = []
-        _, _base_addr, _last_addr = RegisterPageConverter.generateDict( reg_page ) # just want to have first and last reg addr
-        _b = [0]*(_last_addr-_base_addr+1)          # make an array of 0 and fill in the values later
-        # now copy bit-fields values from the the dictionary to the reg_page
-        for _key, _value in d_page.items():
-            RegisterPageConverter.setFieldValueByName(reg_page,_key,_value)             
-        # now convert the register page to a bytearray
-        for _addr in range(_base_addr, _base_addr+len(_b)):
-            _reg = RegisterPageConverter.regByAddr(reg_page, _addr)
-            if _reg:
-                _value = int.from_bytes(bytearray(_reg),byteorder='little',signed=False)
-            else:                               # no register at this location, write a 0
-                #print( "fillPage: No reg at addr {}, set to 0".format(_addr))
-                _value = 0
-            _page.append( _value )
-        return bytearray(_page)
+        _desc = RegisterPageConverter.pageDescriptor( reg_page )
+        return _desc.encode( d_page, _desc.image( reg_page ) )
 
     @staticmethod
     def _baseName( name ):
@@ -167,16 +229,10 @@ class RegisterPageConverter:
         Return:
             dictionary of possible combined names with original names
         """
-        _d, _ , _ = RegisterPageConverter.generateDict( reg_page ) # just want to have first and last reg addr
+        _desc = RegisterPageConverter.pageDescriptor( reg_page )
         _combine = {}
-        # get a dictionary of base-names
-        for _k in _d:
-            _base_name = RegisterPageConverter._baseName( _k )
-            if _base_name in _combine:
-                _combine[_base_name] = _combine[_base_name] + [ _k ]    # list of original names
-            else:
-                _combine[_base_name] = [ _k ]
-        #print( _combine )
+        for _k in _desc.fields:
+            _combine.setdefault(RegisterPageConverter._baseName( _k ), []).append(_k)    # list of original names
         return _combine
 
     def _suffixSort( a, reverse ):
@@ -218,22 +274,17 @@ class RegisterPageConverter:
         Returns:
            combined dictionary (values are shifted and summed up)
         """
-        _d2 = copy.deepcopy(d_page)                 # do not touch the input dictionary, user may get confused
-        # get a dictionary of base-names
-        _combine = RegisterPageConverter._combinedFieldsDict( reg_page )
-        # now reconstruct a dictionary of combined fields only
-        _d = {}         
-        for _k, _names in _combine.items():
-            if len(_names) > 1:                 # there is something to be combined:
-                _names = RegisterPageConverter._suffixSort(_names, reverse=True)       # do sort them from MSB to LSB, or 9..0
-                _value = 0
-                for _kk in _names:
-                    _value = _value * 256 + d_page[_kk] # construct bigger value from smaller ones
-                    del _d2[_kk]                   # remove this entry from the dictionary 
-                _d[_k] = _value
+        _desc = RegisterPageConverter.pageDescriptor( reg_page )
+        _d = {}                                 # do not touch the input dictionary, user may get confused
+        for _k, _names in _desc.combined:
+            _value = 0
+            for _kk in reversed(_names):        # from MSB to LSB, or 9..0
+                _value = _value * 256 + d_page[_kk] # construct bigger value from smaller ones
+            _d[_k] = _value
         # now copy over the others where there were no combinations needed
-        for _k, _v in _d2.items():
-            _d[_k] = _v     
+        for _k, _v in d_page.items():
+            if _k not in _desc.combined_names:
+                _d[_k] = _v     
         return _d
 
     @staticmethod
@@ -245,22 +296,19 @@ class RegisterPageConverter:
         Returns:
             a split-up dictionary where each value is a single byte
         """
-        # get a dictionary of base-names
-        _split = RegisterPageConverter._combinedFieldsDict( reg_page )
-        # now reconstruct a dictionary of split fields only
-        _d2 = copy.deepcopy(d_page)                  # do not touch the input dictionary, user may get confused
-        _d = {}        
-        for _k, _names in _split.items():
-            if len(_names) > 1:                 # there is something to be split:
-                _names = RegisterPageConverter._suffixSort(_names, reverse=False)  # do sort them from LSB to MSB, 0..9
-                _value = _d2[_k]                # combined value needs to be split
-                for _k2 in _names:
-                    _d[_k2] = _value % 256      # use lower 8-bits only
-                    _value = _value // 256      # remove one byte
-                del _d2[_k]                     # remove this entry from the dictionary
+        _desc = RegisterPageConverter.pageDescriptor( reg_page )
+        _d = {}                                 # do not touch the input dictionary, user may get confused
+        _bases = set()
+        for _k, _names in _desc.combined:
+            _value = d_page[_k]                 # combined value needs to be split
+            for _k2 in _names:                  # from LSB to MSB, 0..9
+                _d[_k2] = _value % 256          # use lower 8-bits only
+                _value = _value // 256          # remove one byte
+            _bases.add(_k)
         # now copy over the others where there were no combinations needed
-        for _k, _v in _d2.items():
-            _d[_k] = _v     
+        for _k, _v in d_page.items():
+            if _k not in _bases:
+                _d[_k] = _v     
         return _d
 
     @staticmethod
@@ -273,8 +321,7 @@ class RegisterPageConverter:
             dictionary for specified register page (values are filled in from the bytestream)
         """
         _dict = RegisterPageConverter.fillDict( b_page, reg_page )
-        _dict = RegisterPageConverter._combineFields( _dict, reg_page ) 
-        return _dict
+        return RegisterPageConverter._combineFields( _dict, reg_page ) 
 
     @staticmethod
     def readDictToPage( d_page, reg_page ):
@@ -286,9 +333,7 @@ class RegisterPageConverter:
            bytestream for the specified register page (values are taken from dictionary)
         """
         _dict = RegisterPageConverter._splitFields( d_page, reg_page )
-        _page = RegisterPageConverter.fillPage( _dict, reg_page )
-        return _page
-
+        return RegisterPageConverter.fillPage( _dict, reg_page )
 
 if __name__ == "__main__":
 
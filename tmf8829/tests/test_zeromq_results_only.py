@@ -0,0 +1,70 @@
+# *****************************************************************************
+# * Copyright by ams OSRAM AG                                                 *
+# * All rights are reserved.                                                  *
+# *                                                                           *
+# *FOR FULL LICENSE TEXT SEE LICENSES-MIT.TXT                                 *
+# *****************************************************************************
+
+""" The histograms that the server publishes on their own (ReassemblyPolicy.RESULTS_ONLY) are combined by the client
+with the results of the same result set.
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert( 0, os.path.join( os.path.dirname(__file__), "..", "zeromq" ) )
+sys.path.insert( 0, os.path.join( os.path.dirname(__file__), ".." ) )
+
+from tmf8829_application_defines import *
+from tmf8829_application_common import Tmf8829AppCommon
+from zeromq.tmf8829_zeromq_common import *
+from zeromq.tmf8829_zeromq_reassembly import ReassemblyPolicy
+from zeromq.tmf8829_zeromq_server_core import ZeroMqServer
+from zeromq.tmf8829_zeromq_client import ZeroMqClient
+from zeromq.tmf8829_zeromq_shm import SharedMemoryRing
+
+
+def _frame( fid:int, fnumber:int ) -> bytearray:
+    """ Returns: a frame with pre-header, frame id and frame number, the rest is not decoded"""
+    return bytearray( Tmf8829AppCommon.PRE_HEADER_SIZE ) + bytearray( [fid, 0, 0, 0] ) + fnumber.to_bytes( 4, "little" )
+
+def _resultsOnly( shared_memory:bool ):
+    server = ZeroMqServer( use_spi=False )
+    server.set_reassembly_policy( ReassemblyPolicy.RESULTS_ONLY )
+    server._assembler.configure( Tmf8829AppCommon.FP_MODE_8x8A, 1 )
+    server._result_socket.bind( "inproc://results_only" )
+    client = ZeroMqClient( server._context )
+    if shared_memory:
+        server.set_shared_memory( 4 )
+        client._shm = SharedMemoryRing.attach( server._shm.name )
+        client.subscribe( [ TMF8829_ZEROMQ_TOPIC_SHM ] )
+    else:
+        client.subscribe( [ TMF8829_ZEROMQ_TOPIC_RESULTS, TMF8829_ZEROMQ_TOPIC_HISTOGRAMS ] )
+    client._result_socket.connect( "inproc://results_only" )
+    time.sleep( 0.2 )                                       # subscriptions reach the publisher
+    try:
+        for _set in range( 3 ):
+            _hists = [ _frame( TMF8829_FID_HISTOGRAMS, _set*3 ), _frame( TMF8829_FID_HISTOGRAMS, _set*3+1 ) ]
+            for _layout, _hist in enumerate( _hists ):
+                server._assembleResult( [ _hist ], TMF8829_FID_HISTOGRAMS, _layout, _set*3+_layout )
+            _result = _frame( TMF8829_FID_RESULTS, _set*3+2 )
+            server._assembleResult( [ _result ], TMF8829_FID_RESULTS, 0, _set*3+2 )
+            _parts = client.get_result_parts( timeout=1.0 )
+            assert b"".join( _parts[1:] ) == b"".join( _hists + [ _result ] )      # shared memory: all frames in one part
+            assert client.timing["sequence"] == _set + 1
+        assert client.lost_sets == 0
+    finally:
+        if shared_memory:
+            client._shm.close()
+            server.set_shared_memory( 0 )
+        client._result_socket.close( linger=0 )
+        client._cmd_socket.close( linger=0 )
+        server._result_socket.close( linger=0 )
+        server._cmd_socket.close( linger=0 )
+
+def test_results_only_with_histograms():
+    _resultsOnly( shared_memory=False )
+
+def test_results_only_shared_memory():
+    _resultsOnly( shared_memory=True )
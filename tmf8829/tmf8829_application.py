@@ -15,6 +15,7 @@ from tmf8829_application_common import *
 from tmf8829_bootloader import Tmf8829Bootloader
 from aos_com.hal_register_io import HalRegisterIo
 from register_page_converter import RegisterPageConverter
+from tmf8829_config_codec import Tmf8829ConfigCodec
 
 # additional interrupt bits 
 TMF8829_INT_MOTION      = 0x02  # motion interrupt bit
@@ -24,7 +25,7 @@ class Tmf8829Application(Tmf8829Bootloader, Tmf8829AppCommon):
     """The TMF8829 application class for the Shield Evm Board.
     """
     
-    VERSION = 1.13
+    VERSION = 1.14
     """Version log
     - 1.0 First  version
     - 1.1 add FP mode 48x32
@@ -40,6 +41,7 @@ class Tmf8829Application(Tmf8829Bootloader, Tmf8829AppCommon):
     - 1.11 splitted up tmf8829_application to tmf8829_application_common and tmf8829_application
     - 1.12 support for motion detection and proximity 
     - 1.13 check in stop Measurement if device is wakeup; for standby timed mode
+    - 1.14 configuration page is decoded with Tmf8829ConfigCodec
     """
 
     def __init__(self, hal:HalRegisterIo, gpio_hal:HalRegisterIo=None ):
@@ -553,17 +555,21 @@ class Tmf8829Application(Tmf8829Bootloader, Tmf8829AppCommon):
         number_regs =  Tmf8829ConfigRegs.TMF8829_CFG_LAST_AVAILABLE.addr - Tmf8829ConfigRegs.TMF8829_CFG_PERIOD_MS_LSB.addr + 1 # whole until HW regs start
         val = self.hal.txRx([Tmf8829ConfigRegs.TMF8829_CFG_PERIOD_MS_LSB.addr], number_regs)  # Now read the data via I2C.
 
-        self.cfg_fpMode = (val[Tmf8829ConfigRegs.TMF8829_CFG_FP_MODE.addr-Tmf8829ConfigRegs.TMF8829_CFG_PERIOD_MS_LSB.addr]
-                          & Tmf8829ConfigRegs.TMF8829_CFG_FP_MODE._fp_mode.mask) >> Tmf8829ConfigRegs.TMF8829_CFG_FP_MODE._fp_mode.shift
-        self.cfg_resultFormat = val[Tmf8829ConfigRegs.TMF8829_CFG_RESULT_FORMAT.addr - Tmf8829ConfigRegs.TMF8829_CFG_PERIOD_MS_LSB.addr]
-        self.cfg_histograms = (val[Tmf8829ConfigRegs.TMF8829_CFG_DUMP_HISTOGRAMS.addr-Tmf8829ConfigRegs.TMF8829_CFG_PERIOD_MS_LSB.addr] \
-                              & Tmf8829ConfigRegs.TMF8829_CFG_DUMP_HISTOGRAMS._histograms.mask) >> Tmf8829ConfigRegs.TMF8829_CFG_DUMP_HISTOGRAMS._histograms.shift
-        self.cfg_refFrame = (val[Tmf8829ConfigRegs.TMF8829_CFG_REF_SPAD_FRAME.addr-Tmf8829ConfigRegs.TMF8829_CFG_PERIOD_MS_LSB.addr]
-                            & Tmf8829ConfigRegs.TMF8829_CFG_REF_SPAD_FRAME._publish.mask) >> Tmf8829ConfigRegs.TMF8829_CFG_REF_SPAD_FRAME._publish.shift
-        self.cfg_dualMode = (val[Tmf8829ConfigRegs.TMF8829_CFG_ENABLE_DUAL_MODE.addr-Tmf8829ConfigRegs.TMF8829_CFG_PERIOD_MS_LSB.addr]
-                            & Tmf8829ConfigRegs.TMF8829_CFG_ENABLE_DUAL_MODE._dual_mode.mask) >> Tmf8829ConfigRegs.TMF8829_CFG_ENABLE_DUAL_MODE._dual_mode.shift
+        self.updateCfgFromPage( val )
         return val
 
+    def updateCfgFromPage(self, page ):
+        """Update the cached configuration (fp mode, result format, histograms, ref frame, dual mode) from a
+           configuration page bytestream that starts at TMF8829_CFG_PERIOD_MS_LSB.
+        Args:
+            page: configuration page as read from or written to the device
+        """
+        self.cfg_fpMode = Tmf8829ConfigCodec.fieldValue( page, "fp_mode" )
+        self.cfg_resultFormat = page[Tmf8829ConfigRegs.TMF8829_CFG_RESULT_FORMAT.addr - Tmf8829ConfigRegs.TMF8829_CFG_PERIOD_MS_LSB.addr]
+        self.cfg_histograms = Tmf8829ConfigCodec.fieldValue( page, "histograms" )
+        self.cfg_refFrame = Tmf8829ConfigCodec.fieldValue( page, "publish" )
+        self.cfg_dualMode = Tmf8829ConfigCodec.fieldValue( page, "dual_mode" )
+
     def readApplicationRegisters(self) -> bytes:
         """Function to read the Application Registers.
         Return:
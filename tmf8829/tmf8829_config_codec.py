@@ -0,0 +1,159 @@
+# *****************************************************************************
+# * Copyright by ams OSRAM AG                                                 *
+# * All rights are reserved.                                                  *
+# *                                                                           *
+# *FOR FULL LICENSE TEXT SEE LICENSES-MIT.TXT                                 *
+# *****************************************************************************
+"""
+Bulk codec for the TMF8829 configuration page.
+The whole page (TMF8829_CFG_PERIOD_MS_LSB .. TMF8829_CFG_LAST_AVAILABLE) is decoded into a
+combined dictionary and encoded back into a single bytestream without creating register objects.
+The dictionaries are the same as the ones of RegisterPageConverter.readPageToDict/readDictToPage.
+"""
+
+import __init__
+
+from tmf8829_config_page import Tmf8829_config_page as Tmf8829ConfigRegs
+from register_page_converter import RegisterPageConverter
+
+class Tmf8829ConfigCodec:
+    """Encode and decode complete configuration pages. The tables are compiled once at import."""
+
+    PAGE_START = Tmf8829ConfigRegs.TMF8829_CFG_PERIOD_MS_LSB.addr
+    PAGE_SIZE  = Tmf8829ConfigRegs.TMF8829_CFG_LAST_AVAILABLE.addr - PAGE_START + 1
+
+    _desc = None                # RegisterPageDescriptor of the configuration page
+    _reset_page = b''           # page with the register reset values
+    _combined = []              # (name, offset, number of bytes, mask of the most significant byte) of combined fields
+    _singles = []               # (name, offset, shift, mask) of all other fields
+    _lookup = {}                # name -> (offset, number of bytes, mask of the most significant byte) of combined fields
+
+    @classmethod
+    def _compile(cls):
+        """Build the codec tables from the register definition, called once at import"""
+        cls._desc = RegisterPageConverter.pageDescriptor( Tmf8829ConfigRegs() )
+        cls._reset_page = bytes( cls._desc.image( Tmf8829ConfigRegs() ) )
+        for _name, _parts in cls._desc.combined:
+            _offsets = [ cls._desc.fields[_p][0] for _p in _parts ]
+            assert _offsets == list(range(_offsets[0], _offsets[0]+len(_offsets))), "combined field {} is not contiguous".format(_name)
+            for _p in _parts[:-1]:
+                assert cls._desc.fields[_p][1:] == (0, 0xFF), "combined field {} has partial bytes".format(_name)
+            _shift, _mask = cls._desc.fields[_parts[-1]][1:]
+            assert _shift == 0, "combined field {} is shifted".format(_name)
+            cls._combined.append( (_name, _offsets[0], len(_offsets), _mask) )
+            cls._lookup[_name] = (_offsets[0], len(_offsets), _mask)
+        for _name, _field in cls._desc.fields.items():
+            if _name not in cls._desc.combined_names:
+                cls._singles.append( (_name,) + _field )
+
+    @staticmethod
+    def _combinedValue( page, off:int, size:int, mask:int ) -> int:
+        """Little endian value of a combined field, the most significant byte is masked"""
+        return int.from_bytes( page[off:off+size-1], byteorder='little', signed=False ) + ((page[off+size-1] & mask) << (8*(size-1)))
+
+    @staticmethod
+    def defaultPage() -> bytes:
+        """Return the configuration page with the reset values of the register definition
+        Returns:
+            bytes of PAGE_SIZE
+        """
+        return Tmf8829ConfigCodec._reset_page
+
+    @staticmethod
+    def decode( page ) -> dict:
+        """Decode a configuration page into a combined dictionary. Bytes missing at the end of the page are
+           taken from the reset values.
+        Args:
+            page: bytestream starting at TMF8829_CFG_PERIOD_MS_LSB
+        Returns:
+            dictionary, multi-byte fields like period, iterations, histogram_bins are combined
+        """
+        if len(page) < Tmf8829ConfigCodec.PAGE_SIZE:
+            page = bytes(page) + Tmf8829ConfigCodec._reset_page[len(page):]
+        _d = {}
+        for _name, _off, _size, _mask in Tmf8829ConfigCodec._combined:
+            _d[_name] = Tmf8829ConfigCodec._combinedValue( page, _off, _size, _mask )
+        for _name, _off, _shift, _mask in Tmf8829ConfigCodec._singles:
+            _d[_name] = (page[_off] >> _shift) & _mask
+        return _d
+
+    @staticmethod
+    def encode( cfg:dict, page=None ) -> bytes:
+        """Encode a combined dictionary into a configuration page
+        Args:
+            cfg: dictionary with (some of) the combined fields, no range check is done, values are truncated
+            page: page that provides the values of fields that are not in the dictionary. Defaults (and is padded) to the reset values.
+        Returns:
+            bytes of PAGE_SIZE
+        """
+        _page = bytearray( Tmf8829ConfigCodec._reset_page if page is None else page )
+        if len(_page) < Tmf8829ConfigCodec.PAGE_SIZE:
+            _page += Tmf8829ConfigCodec._reset_page[len(_page):]
+        _fields = Tmf8829ConfigCodec._desc.fields
+        for _key, _value in cfg.items():
+            if _key in Tmf8829ConfigCodec._lookup:
+                _off, _size, _mask = Tmf8829ConfigCodec._lookup[_key]
+                _top = _off + _size - 1
+                _page[_off:_top] = (_value % (1 << (8*(_size-1)))).to_bytes( _size-1, byteorder='little', signed=False )
+                _page[_top] = (_page[_top] & ~_mask & 0xFF) | ((_value >> (8*(_size-1))) & _mask)
+            elif _key in _fields:
+                _off, _shift, _mask = _fields[_key]
+                _page[_off] = (_page[_off] & ~(_mask << _shift) & 0xFF) | ((_value & _mask) << _shift)
+            else:
+                raise Exception( "Tmf8829ConfigCodec.encode: No field with name {} exists".format(_key))
+        return bytes(_page)
+
+    @staticmethod
+    def fieldValue( page, name:str ) -> int:
+        """Return the value of a single (combined) field of a configuration page
+        Args:
+            page: bytestream starting at TMF8829_CFG_PERIOD_MS_LSB
+            name: name of the field
+        Returns:
+            value of the field
+        """
+        if name in Tmf8829ConfigCodec._lookup:
+            return Tmf8829ConfigCodec._combinedValue( page, *Tmf8829ConfigCodec._lookup[name] )
+        _off, _shift, _mask = Tmf8829ConfigCodec._desc.fields[name]
+        return (page[_off] >> _shift) & _mask
+
+    @staticmethod
+    def writeDiff( old_page, new_page ) -> list:
+        """Return the minimal register writes to change a device from old_page to new_page
+        Args:
+            old_page: configuration page currently in the device
+            new_page: configuration page that shall be in the device
+        Returns:
+            list of (register address, bytes) of consecutive changed registers
+        """
+        assert len(old_page) == len(new_page), "Pages differ in len"
+        _writes = []
+        _start = None
+        for _idx in range(len(new_page)):
+            if old_page[_idx] != new_page[_idx]:
+                if _start is None:
+                    _start = _idx
+            elif _start is not None:
+                _writes.append( (Tmf8829ConfigCodec.PAGE_START+_start, bytes(new_page[_start:_idx])) )
+                _start = None
+        if _start is not None:
+            _writes.append( (Tmf8829ConfigCodec.PAGE_START+_start, bytes(new_page[_start:])) )
+        return _writes
+
+Tmf8829ConfigCodec._compile()
+
+
+if __name__ == "__main__":
+
+    from register_page_converter import RegisterPageConverter as RegConv
+
+    _dict0 = RegConv.readPageToDict( bytearray(), Tmf8829ConfigRegs() )
+    _dict1 = Tmf8829ConfigCodec.decode( bytearray() )
+    assert list(_dict0.items()) == list(_dict1.items()), "decode differs from RegisterPageConverter"
+    _page0 = RegConv.readDictToPage( _dict0, Tmf8829ConfigRegs() )
+    _page1 = Tmf8829ConfigCodec.encode( _dict1 )
+    assert bytes(_page0) == _page1, "encode differs from RegisterPageConverter"
+
+    _dict1["period"] = 100
+    _dict1["histograms"] = 1
+    print( Tmf8829ConfigCodec.writeDiff( _page1, Tmf8829ConfigCodec.encode( _dict1 ) ) )
@@ -0,0 +1,375 @@
+# *****************************************************************************
+# * Copyright by ams OSRAM AG                                                 *
+# * All rights are reserved.                                                  *
+# *                                                                           *
+# *FOR FULL LICENSE TEXT SEE LICENSES-MIT.TXT                                 *
+# *****************************************************************************
+
+""" Binary capture format for the TMF8829. The frames are stored exactly as they are read from the device
+(pre-header + frame), the reader maps the file and decodes a measurement set only when it is accessed.
+JSON (and with tmf8829_json_2_csv.py CSV) is made from a capture with captureToJson.
+
+File layout:
+    tmf8829CaptureFileHeader
+    configuration page (configSize bytes) and device info in json format (infoSize bytes)
+    records: tmf8829CaptureRecordHeader followed by the frame, the frames of a measurement set follow each other
+    index: one tmf8829CaptureIndexEntry per record, then one tmf8829CaptureSetEntry per measurement set
+The index is written by close. A capture that was not closed is read by scanning the records.
+"""
+
+import __init__
+import ctypes
+import json
+import mmap
+import sys
+import time
+from threading import Lock
+
+from tmf8829_application_common import *
+from tmf8829_config_codec import Tmf8829ConfigCodec
+from utilities.tmf8829_logger_service import TMF8829Logger
+
+TMF8829_CAPTURE_MAGIC_NUMBER = 0x43384D54       # "TM8C"
+TMF8829_CAPTURE_VERSION = 1
+
+
+class tmf8829CaptureFileHeader(ctypes.LittleEndianStructure):
+    """Header at the start of a capture file"""
+    _pack_ = 1
+    _fields_ = [
+        ('magicNumber', ctypes.c_uint32),
+        ('version', ctypes.c_uint16),
+        ('headerSize', ctypes.c_uint16),
+        ('configSize', ctypes.c_uint32),    # bytes of the configuration page
+        ('infoSize', ctypes.c_uint32),      # bytes of the device info (json)
+        ('indexOffset', ctypes.c_uint64),   # offset of the index, 0 if the capture was not closed
+        ('records', ctypes.c_uint32),       # number of index entries
+        ('sets', ctypes.c_uint32),          # number of set entries
+    ]
+
+class tmf8829CaptureRecordHeader(ctypes.LittleEndianStructure):
+    """Header in front of every frame"""
+    _pack_ = 1
+    _fields_ = [
+        ('length', ctypes.c_uint32),        # bytes of the frame
+        ('set', ctypes.c_uint32),           # measurement set number
+        ('kind', ctypes.c_uint8),           # frame id, e.g. TMF8829_FID_RESULTS
+        ('reserved', ctypes.c_uint8 * 3),
+        ('timestamp', ctypes.c_double),     # host time the set was received
+    ]
+
+class tmf8829CaptureIndexEntry(ctypes.LittleEndianStructure):
+    """Index entry of a record"""
+    _pack_ = 1
+    _fields_ = [
+        ('offset', ctypes.c_uint64),        # offset of the frame in the file
+        ('length', ctypes.c_uint32),
+        ('set', ctypes.c_uint32),
+        ('fNumber', ctypes.c_uint32),       # frame number, 0 for reference spad frames
+        ('kind', ctypes.c_uint8),
+        ('reserved', ctypes.c_uint8 * 3),
+        ('timestamp', ctypes.c_double),
+    ]
+
+class tmf8829CaptureSetEntry(ctypes.LittleEndianStructure):
+    """Index entry of a measurement set"""
+    _pack_ = 1
+    _fields_ = [
+        ('firstRecord', ctypes.c_uint32),
+        ('records', ctypes.c_uint32),
+    ]
+
+_FILE_HEADER_SIZE = ctypes.sizeof(tmf8829CaptureFileHeader)
+_RECORD_HEADER_SIZE = ctypes.sizeof(tmf8829CaptureRecordHeader)
+
+
+def frameKind(frame) -> tuple:
+    """ Return the frame id and the frame number of a frame.
+    Args:
+        frame (bytes): pre-header + frame
+    Returns:
+        tuple(int,int): frame id (e.g. TMF8829_FID_RESULTS) and frame number (0 for reference spad frames)
+    """
+    _kind = frame[Tmf8829AppCommon.PRE_HEADER_SIZE] & TMF8829_FID_MASK
+    if _kind == TMF8829_FID_REF_SPAD_SCAN:
+        return _kind, 0
+    _header = tmf8829FrameHeader.from_buffer_copy( frame, Tmf8829AppCommon.PRE_HEADER_SIZE )
+    return _kind, _header.fNumber
+
+def frameSize(data, offset:int = 0) -> int:
+    """ Return the size of the frame (pre-header + frame) that starts at offset of data.
+    Args:
+        data (bytes): one or more frames
+        offset (int, optional): start of the frame. Defaults to 0.
+    Returns:
+        int: bytes of the frame
+    """
+    if ( data[offset+Tmf8829AppCommon.PRE_HEADER_SIZE] & TMF8829_FID_MASK ) == TMF8829_FID_REF_SPAD_SCAN:
+        return Tmf8829AppCommon.PRE_HEADER_SIZE + ctypes.sizeof(struct__tmf8829RefSpadFrame)
+    _header = tmf8829FrameHeader.from_buffer_copy( data, offset+Tmf8829AppCommon.PRE_HEADER_SIZE )
+    return Tmf8829AppCommon.PRE_HEADER_SIZE + 4 + _header.payload    # 4 for the HEADER 4-bytes that are not part of the payload
+
+
+class TMF8829CaptureWriter:
+    """Writes measurement sets to a capture file. Writing and closing may be called from different threads."""
+
+    def __init__(self, file_name:str, config:bytes = b"", device_info:dict = None, buffer_size:int = 1024*1024) -> None:
+        """Create the capture file and write the file header.
+
+        Args:
+            file_name (str): path with file name of the capture
+            config (bytes, optional): configuration page of the device. Defaults to b"".
+            device_info (dict, optional): device information, e.g. serial number and firmware version. Defaults to None.
+            buffer_size (int, optional): size of the file buffer in bytes. Defaults to 1MB.
+        """
+        _info = json.dumps( device_info or {} ).encode("utf-8")
+        self.file_name = file_name
+        self.records = 0
+        self.sets = 0
+        self._file = open( file_name, "wb", buffering=buffer_size )
+        self._header = tmf8829CaptureFileHeader( magicNumber=TMF8829_CAPTURE_MAGIC_NUMBER, version=TMF8829_CAPTURE_VERSION,
+                                                 headerSize=_FILE_HEADER_SIZE, configSize=len(config), infoSize=len(_info) )
+        self._file.write( bytes(self._header) )
+        self._file.write( bytes(config) )
+        self._file.write( _info )
+        self._offset = _FILE_HEADER_SIZE + len(config) + len(_info)
+        self._index = bytearray()
+        self._set_index = bytearray()
+        self._lock = Lock()                     # close must not rewrite the header while a set is written
+
+    def writeSet(self, frames:list, timestamp:float = None) -> int:
+        """ Write the frames of one measurement set.
+
+        Args:
+            frames (list): frames (pre-header + frame) in the order they were read
+            timestamp (float, optional): host time of the set, None for now. Defaults to None.
+        Returns:
+            int: number of the measurement set
+        Raises:
+            ValueError: the capture is closed
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            return self._writeSet( frames, timestamp )
+
+    def _writeSet(self, frames:list, timestamp:float) -> int:
+        """ Write the frames of one measurement set, the lock is held by the caller."""
+        if self._file is None:
+            raise ValueError("{} is closed".format(self.file_name))
+        _first = self.records
+        for _frame in frames:
+            _kind, _fnumber = frameKind( _frame )
+            self._file.write( bytes( tmf8829CaptureRecordHeader( length=len(_frame), set=self.sets, kind=_kind, timestamp=timestamp ) ) )
+            self._file.write( _frame )
+            self._offset += _RECORD_HEADER_SIZE
+            self._index += bytes( tmf8829CaptureIndexEntry( offset=self._offset, length=len(_frame), set=self.sets, fNumber=_fnumber,
+                                                            kind=_kind, timestamp=timestamp ) )
+            self._offset += len(_frame)
+            self.records += 1
+        self._set_index += bytes( tmf8829CaptureSetEntry( firstRecord=_first, records=self.records-_first ) )
+        self.sets += 1
+        return self.sets - 1
+
+    def writeResultData(self, data, timestamp:float = None) -> int:
+        """ Write a measurement set given as frames that follow each other, e.g. the result of a measurement.
+
+        Args:
+            data (bytes): frames (pre-header + frame)
+            timestamp (float, optional): host time of the set, None for now. Defaults to None.
+        Returns:
+            int: number of the measurement set
+        """
+        _frames = []
+        _offset = 0
+        while _offset < len(data):
+            _size = frameSize( data, _offset )
+            _frames.append( data[_offset:_offset+_size] )
+            _offset += _size
+        return self.writeSet( _frames, timestamp )
+
+    def close(self) -> None:
+        """ Write the index and close the file, waits for a set that is written by another thread."""
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write( self._index )
+            self._file.write( self._set_index )
+            self._header.indexOffset = self._offset
+            self._header.records = self.records
+            self._header.sets = self.sets
+            self._file.seek( 0 )
+            self._file.write( bytes(self._header) )
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class TMF8829CaptureReader:
+    """Random access to the measurement sets of a capture file, the file is memory mapped."""
+
+    def __init__(self, file_name:str) -> None:
+        """Map the capture file and read its index.
+
+        Args:
+            file_name (str): path with file name of the capture
+        Raises:
+            ValueError: the file is no capture
+        """
+        self.file_name = file_name
+        self._file = open( file_name, "rb" )
+        self._mmap = mmap.mmap( self._file.fileno(), 0, access=mmap.ACCESS_READ )
+        self._view = memoryview( self._mmap )
+        if len(self._mmap) < _FILE_HEADER_SIZE or \
+           tmf8829CaptureFileHeader.from_buffer_copy( self._mmap ).magicNumber != TMF8829_CAPTURE_MAGIC_NUMBER:
+            self.close()
+            raise ValueError("{} is no tmf8829 capture".format(file_name))
+        self.header = tmf8829CaptureFileHeader.from_buffer_copy( self._mmap )
+        _offset = self.header.headerSize
+        self.config = bytes( self._mmap[_offset:_offset+self.header.configSize] )
+        _offset += self.header.configSize
+        self.device_info = json.loads( bytes( self._mmap[_offset:_offset+self.header.infoSize] ) or b"{}" )
+        _offset += self.header.infoSize
+        if self.header.indexOffset:
+            _sets_offset = self.header.indexOffset + self.header.records * ctypes.sizeof(tmf8829CaptureIndexEntry)
+            self.index = ( tmf8829CaptureIndexEntry * self.header.records ).from_buffer_copy( self._mmap, self.header.indexOffset )
+            self._sets = ( tmf8829CaptureSetEntry * self.header.sets ).from_buffer_copy( self._mmap, _sets_offset )
+        else:
+            self._scan( _offset )
+
+    def _scan(self, offset:int) -> None:
+        """ Build the index of a capture that was not closed, a truncated last record is ignored."""
+        self.index = []
+        self._sets = []
+        _end = len(self._mmap)
+        while offset + _RECORD_HEADER_SIZE <= _end:
+            _record = tmf8829CaptureRecordHeader.from_buffer_copy( self._mmap, offset )
+            offset += _RECORD_HEADER_SIZE
+            if offset + _record.length > _end:
+                break
+            _kind, _fnumber = frameKind( self._view[offset:offset+_record.length] )
+            if not self._sets or _record.set != self.index[-1].set:
+                self._sets.append( tmf8829CaptureSetEntry( firstRecord=len(self.index), records=0 ) )
+            self._sets[-1].records += 1
+            self.index.append( tmf8829CaptureIndexEntry( offset=offset, length=_record.length, set=_record.set, fNumber=_fnumber,
+                                                         kind=_record.kind, timestamp=_record.timestamp ) )
+            offset += _record.length
+
+    def __len__(self) -> int:
+        return len(self._sets)
+
+    def configuration(self) -> dict:
+        """ Returns:
+            dict: the configuration page decoded to a dictionary, empty if the capture has no configuration
+        """
+        return Tmf8829ConfigCodec.decode( self.config ) if self.config else {}
+
+    def records(self, n:int) -> list:
+        """ Return the index entries of measurement set n.
+
+        Args:
+            n (int): measurement set, negative values count from the end
+        Returns:
+            list: tmf8829CaptureIndexEntry of the frames
+        """
+        _set = self._sets[n]
+        return [ self.index[_i] for _i in range( _set.firstRecord, _set.firstRecord + _set.records ) ]
+
+    def frames(self, n:int) -> list:
+        """ Return the frames of measurement set n without copying them. The memoryviews must be released before close.
+
+        Args:
+            n (int): measurement set, negative values count from the end
+        Returns:
+            list: memoryview of every frame (pre-header + frame) in the order they were read
+        """
+        return [ self._view[_entry.offset:_entry.offset+_entry.length] for _entry in self.records(n) ]
+
+    def measurement(self, n:int, cfg:dict = None) -> dict:
+        """ Decode measurement set n.
+
+        Args:
+            n (int): measurement set, negative values count from the end
+            cfg (dict, optional): configuration, None (or empty) for the configuration of the capture,
+                the reset values of the configuration page if the capture has none. Defaults to None.
+        Returns:
+            dict: keyword arguments of TMF8829Logger.dumpMeasurement
+        """
+        cfg = cfg or self.configuration() or Tmf8829ConfigCodec.decode( Tmf8829ConfigCodec.defaultPage() )
+        _results, _histograms, _ref_spad = [], [], []
+        for _entry in self.records(n):
+            _frame = bytearray( self._view[_entry.offset:_entry.offset+_entry.length] )
+            if _entry.kind == TMF8829_FID_RESULTS:
+                _results.append( _frame )
+            elif _entry.kind == TMF8829_FID_HISTOGRAMS:
+                _histograms.append( _frame )
+            elif _entry.kind == TMF8829_FID_REF_SPAD_SCAN:
+                _ref_spad.append( _frame )
+        return TMF8829Logger.measurementFromFrames( _results, _histograms, _ref_spad, cfg )
+
+    def __iter__(self):
+        """ Iterate over the frames of the measurement sets, see frames. The memoryviews are released at the next step."""
+        for _n in range( len(self) ):
+            _frames = self.frames(_n)
+            try:
+                yield _frames
+            finally:
+                for _frame in _frames:
+                    _frame.release()
+
+    def close(self) -> None:
+        """ Unmap and close the file. If memoryviews of frames are still used, the mapping is freed with the last of them."""
+        if self._file is None:
+            return
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def captureToJson(capture_name:str, output_name:str = None, combined:bool = True, compressed:bool = False) -> None:
+    """ Convert a capture to the json format of TMF8829Logger.dumpToJsonFile.
+
+    Args:
+        capture_name (str): path with file name of the capture
+        output_name (str, optional): Name of the json file. Defaults to None.
+        combined (bool, optional): True for decoded measurements, False for single frames. Defaults to True.
+        compressed (bool, optional): False for uncompressed, True for compressed in gz format. Defaults to False.
+    """
+    with TMF8829CaptureReader( capture_name ) as reader:
+        logger = TMF8829Logger()
+        cfg = reader.configuration()
+        logger.dumpConfiguration( cfg, save_prev_data=False )
+        if reader.device_info:
+            logger.dumpInfo( reader.device_info )
+        for n in range( len(reader) ):
+            if combined:
+                logger.dumpMeasurement( **reader.measurement( n, cfg ) )
+            else:
+                for frame in reader.frames( n ):
+                    logger.dumpFrame( bytearray(frame) )
+                    frame.release()
+        logger.dumpToJsonFile( output_name=output_name, compressed=compressed )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: tmf8829_capture.py <capture file> [<json file>] [--frames] [--gz]")
+        exit(0)
+    _names = [ _arg for _arg in sys.argv[1:] if not _arg.startswith("--") ]
+    captureToJson( _names[0], output_name=_names[1] if len(_names) > 1 else None,
+                   combined="--frames" not in sys.argv, compressed="--gz" in sys.argv )
@@ -8,29 +8,47 @@
 # Revision log 
 # 0.1 Initial revision
 # 1.0 Updatae to newer json file format logger VERSION = 0x0003
+# 1.1 Streaming conversion with constant memory (json, json.gz, ndjson, manifest, capture), rows written in blocks,
+#     several files converted in parallel processes
 
 ''' Convert a json file to csv'''
 
+import __init__
+import collections
+import os
 import sys
 import time
-import json
 import csv
-import gzip
-from tkinter import filedialog as tk_fd
+from concurrent.futures import ProcessPoolExecutor
 
-histogram_counter = 0
+from utilities.tmf8829_log_reader import histogramBins, iterLogItems
 
-def writeFrameData(data:dict) -> None:
+ROWS_PER_BLOCK = 10000
+"""Rows collected before they are written with one writerows"""
 
-    global histogram_counter
 
-    if not "Result_Set" in data:
-        return
+class CsvRows:
+    """Rows of the csv file, the histogram counter continues over the result sets like the row names."""
+
+    def __init__(self, csvout, rows_per_block:int = ROWS_PER_BLOCK) -> None:
+        self._csvout = csvout
+        self._rows_per_block = rows_per_block
+        self._rows = []
+        self.histogram_counter = 0
+
+    def add(self, row:list) -> None:
+        self._rows.append(row)
+        if len(self._rows) >= self._rows_per_block:
+            self.flush()
+
+    def flush(self) -> None:
+        self._csvout.writerows(self._rows)
+        self._rows = []
+
+    def writeResultSet(self, frame:dict) -> None:
 
-    for frame in data["Result_Set"]:
-            
         if "results" in frame:
-            histogram_counter = 0
+            self.histogram_counter = 0
             pixel = 0
 
             row_key = []
@@ -51,7 +69,7 @@ def writeFrameData(data:dict) -> None:
                                 row_key.append(f"snr{i}")
                             if pixelpeakkey == 'signal':
                                 row_key.append(f"signal{i}")
-            csvout.writerow(row_key)
+            self.add(row_key)
             
             # log the results
 
@@ -71,7 +89,7 @@ def writeFrameData(data:dict) -> None:
                                 row_val.append(peak["snr"])
                             if 'signal' in peak:
                                 row_val.append(peak["signal"])
-                    csvout.writerow(row_val)
+                    self.add(row_val)
                     pixel += 1
 
         
@@ -80,103 +98,119 @@ def writeFrameData(data:dict) -> None:
             row_key.append("#RAWBIN")
             for i in range(64):
                 row_key.append(i)
-            csvout.writerow(row_key)
+            self.add(row_key)
 
             for mp_data in frame["mp_histo"]:
                 for histogram in mp_data:
                     row_val = []
-                    row_val.append(f"#RAW{histogram_counter:03}")
-                    histogram_counter +=1 
-                    for value in histogram["bin"]:
-                        row_val.append(value)
-                    csvout.writerow(row_val)
+                    row_val.append(f"#RAW{self.histogram_counter:03}")
+                    self.histogram_counter +=1 
+                    row_val.extend(histogramBins(histogram))
+                    self.add(row_val)
                     
-        histogram_counter = 0
+        self.histogram_counter = 0
         if "mp_histo_LR" in frame:
             row_key = []
             row_key.append("#RAWBIN")
             for i in range(64):
                 row_key.append(i)
-            csvout.writerow(row_key)
+            self.add(row_key)
 
             for mp_data in frame["mp_histo_LR"]:
                 for histogram in mp_data:
                     row_val = []
-                    row_val.append(f"#RAWLR{histogram_counter:03}")
-                    histogram_counter +=1 
-                    for value in histogram["bin"]:
-                        row_val.append(value)
-                    csvout.writerow(row_val)
-
-def dumpSection( data:dict, section_name:str, section_tag:str ) -> None:
-    if section_name in data.keys():
+                    row_val.append(f"#RAWLR{self.histogram_counter:03}")
+                    self.histogram_counter +=1 
+                    row_val.extend(histogramBins(histogram))
+                    self.add(row_val)
+
+    def writeSection(self, section:dict, section_tag:str ) -> None:
         row_key = []
         row_value = []
         row_key.append(section_tag)
         row_value.append(section_tag)
-        for key, value in data[section_name].items():
+        for key, value in section.items():
             row_key.append(key)
             row_value.append(value)
-        csvout.writerow(row_key)
-        csvout.writerow(row_value)
+        self.add(row_key)
+        self.add(row_value)
+
+def csvFileName( file:str ) -> str:
+    """ Returns the csv file name of a log file, the extension is replaced."""
+    for extension in ("_manifest.json", ".json.gz", ".ndjson.gz", ".ndjson", ".json", ".cap"):
+        if file.endswith(extension):
+            return file[:-len(extension)] + ".csv"
+    return file + ".csv"
+
+def csvFileNames( files:list ) -> list:
+    """ Returns the csv file names of several log files. Logs whose names differ only in the extension (run.json
+    and run.ndjson, x_manifest.json and x.json) keep the extension in the csv file name, so no csv is written twice."""
+    names = [ csvFileName(file) for file in files ]
+    clashes = collections.Counter( os.path.abspath(name) for name in names )
+    return [ file + ".csv" if clashes[os.path.abspath(name)] > 1 else name for file, name in zip(files, names) ]
+
+def convertFile( file:str, csv_file_name:str = None ) -> str:
+    """ Convert a log file to csv, the log is read item by item so the memory does not grow with the file.
+
+    Args:
+        file (str): json, json.gz, ndjson, manifest of a rotation or capture file
+        csv_file_name (str, optional): name of the csv file, None to replace the extension of file. Defaults to None.
+    Returns:
+        str: name of the csv file
+    """
+    if csv_file_name is None:
+        csv_file_name = csvFileName(file)
+
+    with open(csv_file_name,'w', encoding='UTF8', newline='' ) as f:
+        f.write( "sep=,\n")
+        rows = CsvRows( csv.writer( f, delimiter=',') )
+        configuration = None
+        for key, value in iterLogItems(file):
+            if key == "configuration" and value != configuration:   # chunks of a rotation repeat the configuration
+                configuration = value
+                rows.writeSection(value, "#CONFIG")
+            elif key == "Result_Set":
+                rows.writeResultSet(value)
+        rows.flush()
+    return csv_file_name
 
 if __name__ == "__main__":
 
-    if len(sys.argv) == 1:
-        filenames = tk_fd.askopenfilenames(title='Open files', initialdir='./', filetypes=[('Json File', '.json .gz')])
+    filenames = [ arg for arg in sys.argv[1:] if not arg.startswith("--") ]
+    jobs = 0
+    for arg in sys.argv[1:]:
+        if arg.startswith("--jobs="):                       # parallel conversions, 0 for the number of CPUs
+            jobs = int(arg.split("=")[1])
+    csv_file_names = None
+
+    if len(filenames) == 0:
+        from tkinter import filedialog as tk_fd
+        filenames = tk_fd.askopenfilenames(title='Open files', initialdir='./', filetypes=[('Log File', '.json .gz .ndjson .cap')])
 
         if len(filenames) == 0:
             print("Aborted by user.")
             sys.exit()
-    else:                                  
-        if len(sys.argv) < 3:
-            print("Missing argument!")
-            print("Usage : tmf8830_json_2_csv.py inputfile.json/json.gz outputfile.csv")
-            sys.exit()
-        filenames = []
-        filenames.append(sys.argv[1])
+    elif len(filenames) == 2 and filenames[1].endswith(".csv"):
+        csv_file_names = [ filenames[1] ]
+        filenames = [ filenames[0] ]
+    elif any( name.endswith(".csv") for name in filenames ):
+        print("Usage : tmf8829_json_2_csv.py inputfile.json/json.gz/ndjson/cap outputfile.csv")
+        print("        tmf8829_json_2_csv.py inputfile [inputfile ...] [--jobs=<n>]")
+        sys.exit()
+    filenames = list( { os.path.abspath(name): name for name in filenames }.values() )   # a file given twice is converted once
+    if csv_file_names is None:
+        csv_file_names = csvFileNames( filenames )
 
     # record start time
     start = time.time()
 
-    for file in filenames:
-
-        if file[-2:] == "gz":                      # Check if we have a gzip compressed file or an uncompressed json file    
-            with gzip.open(file,"r") as gzip_data: # Open the gzip archive
-                json_data = gzip_data.read()               # Read the gzip data into json_data ( byte array )
-            json_str = json_data.decode("utf-8")           # Decode the byte array -> string
-            measurement_data = json.loads(json_str)        # Read the json data
-
-        elif file[-4:] == "json":
-            with open(file) as json_file:
-                measurement_data = json.load(json_file)
-
-        # open CSV writer
-        if len(sys.argv) == 1:    
-            if (file[-2:] == "gz"):
-                csv_file_name = file.replace("json.gz","csv")
-            elif (file[-4:] == "json"):
-                csv_file_name = file.replace("json","csv")
-
-            f = open(csv_file_name,'w', encoding='UTF8', newline='' )
-        else:
-            f = open(sys.argv[2],'w', encoding='UTF8', newline='' )
-
-        f.write( "sep=,\n")
-        csvout = csv.writer( f, delimiter=',')
-
-        if 'configuration' in measurement_data:
-            dumpSection(measurement_data, "configuration", "#CONFIG")
-        writeFrameData(measurement_data)
-
-        if len(sys.argv) == 1:
-            print("Data written to {}".format(csv_file_name))
-        else:
-            print("Data written to {}".format(sys.argv[2]))
-
-        # csv file close
-        f.close()
+    if len(filenames) == 1:
+        print("Data written to {}".format(convertFile(filenames[0], csv_file_names[0])))
+    else:
+        with ProcessPoolExecutor( max_workers=jobs or None ) as executor:
+            for csv_file_name in executor.map( convertFile, filenames, csv_file_names ):
+                print("Data written to {}".format(csv_file_name))
 
     # record end time
     end = time.time()
-    print("Conversion finished in {:.3f}".format(end-start), "s")
\ No newline at end of file
+    print("Conversion finished in {:.3f}".format(end-start), "s")
@@ -0,0 +1,164 @@
+# *****************************************************************************
+# * Copyright by ams OSRAM AG                                                 *
+# * All rights are reserved.                                                  *
+# *                                                                           *
+# *FOR FULL LICENSE TEXT SEE LICENSES-MIT.TXT                                 *
+# *****************************************************************************
+
+""" Index sidecar of the NDJSON log files (log file name + ".idx") for random access into large logs.
+The writer of the log (TMF8829NdjsonWriter) adds one entry per record: byte offset and length of the line,
+frame number, kind and host time. For gzip logs the writer makes a full flush point at every flush, an entry
+also holds the compressed offset of the last flush point, decompression starts there.
+
+File layout: tmf8829LogIndexHeader, then one tmf8829LogIndexEntry per record.
+"""
+
+import __init__
+import bisect
+import ctypes
+import json
+import zlib
+
+TMF8829_LOG_INDEX_MAGIC_NUMBER = 0x49384D54     # "TM8I"
+TMF8829_LOG_INDEX_VERSION = 1
+
+TMF8829_LOG_KIND_OTHER = 0x00                   # configuration, info, device, ...
+TMF8829_LOG_KIND_RESULT_SET = 0x01              # result set of dumpMeasurement
+"""Kinds of the records, frames of dumpFrame have their frame id (TMF8829_FID_RESULTS, ...)"""
+
+
+class tmf8829LogIndexHeader(ctypes.LittleEndianStructure):
+    """Header of the index file"""
+    _pack_ = 1
+    _fields_ = [
+        ('magicNumber', ctypes.c_uint32),
+        ('version', ctypes.c_uint16),
+        ('compressed', ctypes.c_uint8),     # 1 if the log is a gzip file
+        ('reserved', ctypes.c_uint8),
+    ]
+
+class tmf8829LogIndexEntry(ctypes.LittleEndianStructure):
+    """Index entry of a record"""
+    _pack_ = 1
+    _fields_ = [
+        ('offset', ctypes.c_uint64),        # offset of the line in the (uncompressed) log
+        ('length', ctypes.c_uint32),        # bytes of the line including the line break
+        ('fNumber', ctypes.c_uint32),       # frame number, 0 if not known
+        ('kind', ctypes.c_uint8),           # TMF8829_LOG_KIND_* or frame id
+        ('reserved', ctypes.c_uint8 * 7),
+        ('timestamp', ctypes.c_double),     # host time the record was logged
+        ('flushPoint', ctypes.c_uint64),    # gzip: compressed offset of the last full flush point
+        ('flushOffset', ctypes.c_uint64),   # gzip: uncompressed offset of the last full flush point
+    ]
+
+_HEADER_SIZE = ctypes.sizeof(tmf8829LogIndexHeader)
+_ENTRY_SIZE = ctypes.sizeof(tmf8829LogIndexEntry)
+
+
+def indexHeader( compressed:bool ) -> bytes:
+    """ Returns: the header of a new index file"""
+    return bytes( tmf8829LogIndexHeader( magicNumber=TMF8829_LOG_INDEX_MAGIC_NUMBER, version=TMF8829_LOG_INDEX_VERSION,
+                                         compressed=1 if compressed else 0 ) )
+
+
+class TMF8829IndexedLog:
+    """Random access to the records of an NDJSON log (plain or gzip) with its index."""
+
+    def __init__(self, log_name:str, index_name:str = None) -> None:
+        """Read the index.
+
+        Args:
+            log_name (str): path with file name of the log (.ndjson or .ndjson.gz)
+            index_name (str, optional): path with file name of the index, None for log_name + ".idx". Defaults to None.
+        Raises:
+            ValueError: the index file is no tmf8829 log index
+        """
+        self.log_name = log_name
+        with open( index_name or log_name + ".idx", "rb" ) as f:
+            _data = f.read()
+        if len(_data) < _HEADER_SIZE or tmf8829LogIndexHeader.from_buffer_copy( _data ).magicNumber != TMF8829_LOG_INDEX_MAGIC_NUMBER:
+            raise ValueError("{} has no tmf8829 log index".format(log_name))
+        self.compressed = tmf8829LogIndexHeader.from_buffer_copy( _data ).compressed == 1
+        _entries = ( len(_data) - _HEADER_SIZE ) // _ENTRY_SIZE        # an entry written partly is ignored
+        self.index = ( tmf8829LogIndexEntry * _entries ).from_buffer_copy( _data, _HEADER_SIZE )
+        self._timestamps = None
+        self._frames = None                                             # kind -> sorted (frame number, record), see find
+        self._file = open( log_name, "rb" )
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def _readLine(self, entry:tmf8829LogIndexEntry) -> bytes:
+        """ Read the line of an entry, gzip logs are decompressed from the flush point before it."""
+        if not self.compressed:
+            self._file.seek( entry.offset )
+            return self._file.read( entry.length )
+        self._file.seek( entry.flushPoint )
+        _inflate = zlib.decompressobj( -zlib.MAX_WBITS )                # raw deflate, no gzip header at a flush point
+        _skip = entry.offset - entry.flushOffset
+        _data = bytearray()
+        while len(_data) < _skip + entry.length:
+            _chunk = self._file.read( 64*1024 )
+            if not _chunk:
+                break
+            _data += _inflate.decompress( _chunk )
+        return bytes( _data[_skip:_skip+entry.length] )
+
+    def record(self, n:int) -> dict:
+        """ Read record n.
+
+        Args:
+            n (int): number of the record, negative values count from the end
+        Returns:
+            dict: the record, e.g. {"Result_Set": {...}} or {"frame": {...}}
+        """
+        return json.loads( self._readLine( self.index[n] ) )
+
+    def find(self, fnumber:int, kind:int = None) -> int:
+        """ Search the record of a frame number, the frame numbers of each kind are searched with bisection.
+
+        Args:
+            fnumber (int): frame number
+            kind (int, optional): only records of this kind, e.g. TMF8829_LOG_KIND_RESULT_SET. Defaults to None.
+        Returns:
+            int: number of the first matching record, -1 if there is none
+        """
+        if self._frames is None:
+            self._frames = {}
+            for _n, _entry in enumerate( self.index ):
+                if _entry.kind != TMF8829_LOG_KIND_OTHER:
+                    self._frames.setdefault( _entry.kind, [] ).append( ( _entry.fNumber, _n ) )
+            for _frames in self._frames.values():
+                _frames.sort()
+        _found = []
+        for _kind in ( self._frames if kind is None else [ kind ] ):
+            _frames = self._frames.get( _kind, [] )
+            _i = bisect.bisect_left( _frames, ( fnumber, -1 ) )
+            if _i < len(_frames) and _frames[_i][0] == fnumber:
+                _found.append( _frames[_i][1] )
+        return min( _found, default=-1 )
+
+    def timeRange(self, start:float, end:float, kind:int = None):
+        """ Generator of the records logged from start to end (host time), the index is searched with bisection.
+
+        Args:
+            start (float): first time in seconds since the epoch
+            end (float): last time in seconds since the epoch
+            kind (int, optional): only records of this kind. Defaults to None.
+        Yields:
+            dict: record
+        """
+        if self._timestamps is None:
+            self._timestamps = [ _entry.timestamp for _entry in self.index ]
+        for _n in range( bisect.bisect_left( self._timestamps, start ), bisect.bisect_right( self._timestamps, end ) ):
+            if kind is None or self.index[_n].kind == kind:
+                yield self.record( _n )
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
@@ -0,0 +1,187 @@
+# *****************************************************************************
+# * Copyright by ams OSRAM AG                                                 *
+# * All rights are reserved.                                                  *
+# *                                                                           *
+# *FOR FULL LICENSE TEXT SEE LICENSES-MIT.TXT                                 *
+# *****************************************************************************
+
+""" Read the result sets of the different TMF8829 log formats one after the other:
+json files of TMF8829Logger.dumpToJsonFile (.json, .json.gz), NDJSON log files (.ndjson),
+the manifest of a rotation (_manifest.json) and binary captures (.cap).
+"""
+
+import __init__
+import gzip
+import json
+import os
+
+MEASUREMENT_KEYS = { "pixel_results": "results", "pixel_histograms": "mp_histo", "reference_pixel_histograms": "ref_histo",
+                     "pixel_histograms_HA": "mp_histo_HA", "reference_pixel_histograms_HA": "ref_histo_HA",
+                     "measurement_info": "info" }
+"""Arguments of TMF8829Logger.dumpMeasurement and the keys of a result set in the json formats"""
+
+
+def openLogFile( file_name:str, mode:str = "rt" ):
+    """ Open a log file, gz files are decompressed.
+
+    Args:
+        file_name (str): path with file name
+        mode (str, optional): "rt" or "rb". Defaults to "rt".
+    Returns:
+        file object
+    """
+    if file_name.endswith(".gz"):
+        return gzip.open( file_name, mode, encoding="UTF-8" if "t" in mode else None )
+    return open( file_name, mode, encoding="UTF-8" if "t" in mode else None )
+
+def histogramBins( histogram ) -> list:
+    """ Returns the bins of a histogram, a dictionary of the json formats or a ctypes structure of a capture."""
+    if isinstance( histogram, dict ):
+        return histogram["bin"]
+    return histogram.bin if histogram else []
+
+def chunkFiles( manifest_name:str ) -> list:
+    """ Return the chunk files of a rotation in their order.
+
+    Args:
+        manifest_name (str): path with file name of the manifest
+    Returns:
+        list: paths with file names of the chunks
+    """
+    with open( manifest_name, "r" ) as f:
+        manifest = json.load( f )
+    return [ os.path.join( os.path.dirname(manifest_name), chunk["file"] ) for chunk in manifest["chunks"] ]
+
+
+class _JsonStream:
+    """Incremental reader of the top level object of a json file, the values are decoded one after the other."""
+
+    def __init__(self, f, chunk_size:int) -> None:
+        self._f = f
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, size:int) -> bool:
+        """ Read size more characters, the consumed part of the buffer is dropped. Returns False at the end of the file."""
+        if self._eof:
+            return False
+        _data = self._f.read( size )
+        self._buf = self._buf[self._pos:] + _data
+        self._pos = 0
+        self._eof = len(_data) == 0
+        return not self._eof
+
+    def peek(self) -> str:
+        """ Skip white space and return the next character, "" at the end of the file."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in " \t\r\n":
+                self._pos += 1
+            if self._pos < len(self._buf) or not self._fill( self._chunk_size ):
+                return self._buf[self._pos:self._pos+1]
+
+    def expect(self, chars:str) -> str:
+        """ Consume the next character, it must be one of chars."""
+        _char = self.peek()
+        if not _char or _char not in chars:
+            raise ValueError("Expected {!r} in the json file instead of {!r}".format(chars, _char))
+        self._pos += 1
+        return _char
+
+    def value(self):
+        """ Decode the next value, the buffer grows until it holds the complete value."""
+        self.peek()
+        _size = self._chunk_size
+        while True:
+            try:
+                _value, _end = self._decoder.raw_decode( self._buf, self._pos )
+                # a number is complete if a delimiter follows, it might continue in the next chunk (1 -> 1.5)
+                if self._eof or ( _end < len(self._buf) and self._buf[_end] in ",:]} \t\r\n" ):
+                    self._pos = _end
+                    return _value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill( _size )
+            _size *= 2
+
+def iterJsonItems( file_name:str, chunk_size:int = 1024*1024 ):
+    """ Generator of the top level items of a json file without loading the whole file.
+    The elements of a list value (e.g. Result_Set, frames, info) are returned one by one with the key of the list.
+
+    Args:
+        file_name (str): path with file name, .json or .json.gz
+        chunk_size (int, optional): characters read at once. Defaults to 1M.
+    Yields:
+        tuple(str, value): key and value, or key and list element
+    """
+    with openLogFile( file_name ) as f:
+        stream = _JsonStream( f, chunk_size )
+        stream.expect( "{" )
+        if stream.peek() == "}":
+            return
+        while True:
+            key = stream.value()
+            stream.expect( ":" )
+            if stream.peek() == "[":
+                stream.expect( "[" )
+                if stream.peek() == "]":
+                    stream.expect( "]" )
+                else:
+                    while True:
+                        yield key, stream.value()
+                        if stream.expect( ",]" ) == "]":
+                            break
+            else:
+                yield key, stream.value()
+            if stream.expect( ",}" ) == "}":
+                return
+
+_NDJSON_KEYS = { "frame": "frames" }
+"""Keys of the NDJSON records that differ from the json file"""
+
+def iterLogItems( file_name:str ):
+    """ Generator of the items of a log file in the order they were logged, only one chunk or record is in memory.
+    The result sets of a capture are decoded with its configuration, the histograms stay ctypes structures (see histogramBins).
+
+    Args:
+        file_name (str): json, json.gz, ndjson, manifest or capture file
+    Yields:
+        tuple(str, value): key of the json file (configuration, info, device, Result_Set, frames, ...) and the value,
+            list elements are returned one by one
+    """
+    if file_name.endswith(".cap"):
+        from utilities.tmf8829_capture import TMF8829CaptureReader
+        with TMF8829CaptureReader( file_name ) as reader:
+            cfg = reader.configuration()
+            yield "configuration", cfg
+            if reader.device_info:
+                yield "info", reader.device_info
+            for n in range( len(reader) ):
+                measurement = reader.measurement( n, cfg )
+                yield "Result_Set", { MEASUREMENT_KEYS[key]: value for key, value in measurement.items() if key in MEASUREMENT_KEYS and value }
+    elif file_name.endswith(".ndjson") or file_name.endswith(".ndjson.gz"):
+        with openLogFile( file_name ) as f:
+            for line in f:
+                if line.strip():
+                    for key, value in json.loads( line ).items():
+                        yield _NDJSON_KEYS.get( key, key ), value
+    elif file_name.endswith("_manifest.json"):
+        for chunk in chunkFiles( file_name ):
+            yield from iterJsonItems( chunk )
+    else:
+        yield from iterJsonItems( file_name )
+
+def iterResultSets( file_name:str ):
+    """ Generator of the result sets of a log file, see iterLogItems.
+
+    Args:
+        file_name (str): json, json.gz, ndjson, manifest or capture file
+    Yields:
+        dict: result set in the format of the json files (keys results, mp_histo, ref_histo, ..., info)
+    """
+    for key, value in iterLogItems( file_name ):
+        if key == "Result_Set":
+            yield value
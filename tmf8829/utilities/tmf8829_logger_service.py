@@ -17,16 +17,22 @@ import copy
 import sys
 
 from tmf8829_application_common import *
+from utilities.tmf8829_ndjson_writer import TMF8829NdjsonWriter
+from utilities.tmf8829_log_index import TMF8829_LOG_KIND_OTHER, TMF8829_LOG_KIND_RESULT_SET
 
 class TMF8829Logger:
 
     _output_file =""
     _json_dump = {}
     _serial_number = 0
+    _stream = None
+    _rotation = None
 
     def __init__(self) -> None:
         self._output_file =""
         self._json_dump = {}
+        self._stream = None
+        self._rotation = None                       # chunk limits, manifest and state of the rotation mode
     
     @staticmethod
     def readCfgFile( filePathName:str, in_config:dict = None ) -> dict:
@@ -51,17 +57,27 @@ class TMF8829Logger:
                 else:
                     return patch
 
-    def createLogFile(self, prefix:str, serial_number:list, fw_version:list) -> str:
+    def createLogFile(self, prefix:str, serial_number:list, fw_version:list, stream:bool = False, \
+                      flush_interval:float = 1.0, flush_size:int = 256*1024, compressed:bool = False, index:bool = False) -> str:
         """Create a filename with a Prefix, UID and FW version.
            This file will appended all log and dump data.
+           In stream mode the file stays open, every record is one compact JSON line (.ndjson) with the key of the
+           json file (configuration, info, ...; frame for the frames) and the records are written by a background thread, see closeLogFile.
         Args:
             prefix (str): output file name prefix
             serial_number (list): device serial number
             fw_version (list): firmware version numbers
+            stream (bool, optional): True for the NDJSON stream mode. Defaults to False.
+            flush_interval (float, optional): stream mode, maximum time in seconds until a record is flushed. Defaults to 1.0.
+            flush_size (int, optional): stream mode, the file is flushed after so many bytes. Defaults to 256kB.
+            compressed (bool, optional): stream mode, gzip compressed log file (.ndjson.gz). Defaults to False.
+            index (bool, optional): stream mode, write the index sidecar (log file name + ".idx") with the offset,
+                frame number, kind and time of every record, read with TMF8829IndexedLog. Defaults to False.
 
         Returns:
             str: output log filename
         """
+        self.closeLogFile()
         # Assemble the filename in the following format : prefix_UIDserial_number_FWfw_version_YYYY_MM_DD_HH_MM_SS.json
         time_now = time.localtime()
         time_sep = "-"
@@ -69,10 +85,25 @@ class TMF8829Logger:
                                                           fw_version[0],fw_version[1],fw_version[2])
         timestemp =  str(time_now.tm_year)+time_sep+str(time_now.tm_mon)+time_sep+str(time_now.tm_mday)
         timestemp =  self._output_file + time_sep+str(time_now.tm_hour)+time_sep+str(time_now.tm_min)+time_sep+str(time_now.tm_sec)
-        self._output_file += timestemp +".txt"
-        self._writeToFile(self._output_file, {"time":timestemp} , mode="w")
+        if stream:
+            self._output_file += timestemp +".ndjson" + (".gz" if compressed else "")
+            filepathname = os.path.join(os.path.join(os.path.dirname(sys.argv[0]), self._output_file))
+            self._stream = TMF8829NdjsonWriter(filepathname, flush_interval=flush_interval, flush_size=flush_size,
+                                               compressed=compressed, index=index)
+            self._stream.write({"time":timestemp})
+        else:
+            self._output_file += timestemp +".txt"
+            self._writeToFile(self._output_file, {"time":timestemp} , mode="w")
         return self._output_file
 
+    def closeLogFile(self):
+        """Close the log file. In stream mode all queued records are written before."""
+        if self._stream is not None:
+            _stream = self._stream
+            self._stream = None
+            _stream.close()
+        self._output_file = ""
+
     def dumpConfiguration( self, cfg, save_prev_data = True, save_compressed = True ):
         """Dump the configuration. Dumped data is stored to a file after calling dumpToJsonFile().
         The configuration is added to the log file if it was created.
@@ -85,12 +116,16 @@ class TMF8829Logger:
         """
         if save_prev_data:
             self.dumpToJsonFile(compressed=save_compressed)
+        elif self._rotation:
+            self._writeChunk()      # the records of the previous configuration are not dropped in rotation mode
 
         self._json_dump = {} # Note a new config will clear the old data
         self._json_dump["configuration"] = cfg
+        if self._rotation:
+            self._startChunk()
 
         if ( self._output_file != ""):
-          self._writeToFile(self._output_file, cfg)
+          self._logRecord({"configuration": cfg} if self._stream else cfg)
 
     def dumpLabSettings( self, settings):
         """Dump the labSettings. Dumped data is stored to a file after calling dumpToJsonFile().
@@ -103,7 +138,7 @@ class TMF8829Logger:
         self._json_dump["lab_cfg"] = settings
 
         if ( self._output_file != ""):
-          self._writeToFile(self._output_file, settings)
+          self._logRecord({"lab_cfg": settings} if self._stream else settings)
                
     def dumpInfo( self, info: dict):
         """ Dump the Info. Dumped data is stored to a file after calling dumpToJsonFile().
@@ -120,8 +155,8 @@ class TMF8829Logger:
         self._json_dump["info"].append(info_to_append)
 
         if ( self._output_file != ""):
-          out = {"info": info}
-          self._writeToFile(self._output_file, out)
+          out = {"info": info_to_append}
+          self._logRecord(out)
 
     def dumpDevice(self, fw_version, serial_number):
         """ Dump the firmware version and the serial number.
@@ -140,7 +175,7 @@ class TMF8829Logger:
 
         if ( self._output_file != ""):
             out = {"device":device}
-            self._writeToFile(self._output_file, out)
+            self._logRecord(out)
 
 
     def dumpFrame(self, frame, measurement_info:dict=None ):
@@ -204,7 +239,10 @@ class TMF8829Logger:
 
         if ( self._output_file != ""):
             out = {"frame":frame_data}
-            self._writeToFile(self._output_file, out)
+            self._logRecord(out, kind=fheader.id&TMF8829_FID_MASK, fnumber=fheader.fNumber)
+
+        if self._rotation:
+            self._countRecord(frame_data, fheader.fNumber)
  
     def dumpMeasurement(self, pixel_results:list=None, reference_pixel_histograms_HA:list=None, pixel_histograms_HA:list=None, \
                          reference_pixel_histograms:list=None, pixel_histograms:list=None, \
@@ -275,18 +313,158 @@ class TMF8829Logger:
 
         if ( self._output_file != ""):
             out = {"Result_Set":frame_data}
-            self._writeToFile(self._output_file, out)
+            self._logRecord(out, kind=TMF8829_LOG_KIND_RESULT_SET,
+                            fnumber=measurement_info.get("frame_number", 0) if measurement_info else 0)
 
-    def dumpToJsonFile(self, output_name = None, compressed:bool = True):
-        """ The dumped data is written to a json file.
+        if self._rotation:
+            self._countRecord(frame_data, measurement_info.get("frame_number") if measurement_info else None)
+
+    @staticmethod
+    def measurementFromFrames(result_frames:list, histo_frames:list, ref_frames:list, cfg:dict) -> dict:
+        """ Decode the frames of one measurement into the arguments of dumpMeasurement.
 
         Args:
-            output_name (str, optional): Name of the json file. Defaults to None.
-            compressed (bool, optional): False for uncompressed, True for compressed in gz format. Defaults to True.
+            result_frames (list): result frames (pre-header + frame)
+            histo_frames (list): histogram frames (pre-header + frame)
+            ref_frames (list): reference spad frames (pre-header + frame)
+            cfg (dict): configuration of the device (select, histograms, dual_mode are used)
+        Returns:
+            dict: keyword arguments of dumpMeasurement
         """
-        if len(self._json_dump) == 0:
-          return
-        
+        pixelResults = Tmf8829AppCommon.getFullPixelResult(frames=result_frames, toMM=cfg["select"] >= 1, pointCloud=False, distanceToXYZ=True)
+
+        # log the header of the first result frame
+        fheader = tmf8829FrameHeader.from_buffer_copy( bytearray(result_frames[0])[Tmf8829AppCommon.PRE_HEADER_SIZE: \
+                  Tmf8829AppCommon.PRE_HEADER_SIZE+ctypes.sizeof(struct__tmf8829FrameHeader)])
+        ffooter = tmf8829FrameFooter.from_buffer_copy( bytearray(result_frames[0])[-ctypes.sizeof(struct__tmf8829FrameFooter):])
+
+        res_info = {}
+        res_info["frame_number"] = fheader.fNumber
+        res_info["temperature"] = fheader.temperature[2]
+        res_info["systick_t0"] = ffooter.t0Integration
+        res_info["systick_t1"] = ffooter.t1Integration
+        res_info["read_time"] = int.from_bytes( result_frames[0][1:5],byteorder='little',signed=False )
+
+        allframeStatus = 0
+        for frame in list(histo_frames) + list(result_frames):
+            ffooter = tmf8829FrameFooter.from_buffer_copy( bytearray(frame)[-ctypes.sizeof(struct__tmf8829FrameFooter):])
+            allframeStatus |= ffooter.frameStatus
+        res_info["warnings"] = allframeStatus & ~TMF8829_FRAME_VALID
+
+        histogramResults = []
+        refhistogramResults = []
+        histogramResultsHA = []
+        refhistogramResultsHA = []
+        if cfg["histograms"] == 1:
+            if cfg["dual_mode"] == 1:
+                refhistogramResultsHA, histogramResultsHA, \
+                refhistogramResults, histogramResults = Tmf8829AppCommon.getAllHistogramResultsDualMode(histo_frames)
+            else:
+                refhistogramResults, histogramResults = Tmf8829AppCommon.getAllHistogramResults(histo_frames)
+
+        return dict( pixel_results=pixelResults,
+            pixel_histograms=histogramResults, reference_pixel_histograms=refhistogramResults,
+            pixel_histograms_HA=histogramResultsHA, reference_pixel_histograms_HA=refhistogramResultsHA,
+            reference_spad_frames=ref_frames, measurement_info=res_info )
+
+    def startRotation(self, output_name:str = None, max_records:int = 1000, max_bytes:int = 0, max_seconds:float = 0, \
+                      compressed:bool = False) -> str:
+        """ Start the rotation mode. The dumped frames and result sets are written to numbered chunk files
+        (output_name_0000.json, output_name_0001.json, ...) as soon as a limit is reached, so at most one chunk is kept in memory.
+        Every chunk has the same format as the file of dumpToJsonFile and also holds the configuration, device and lab settings.
+        The manifest output_name_manifest.json lists the chunks with their frame number ranges, it is updated with every chunk.
+        dumpToJsonFile writes the current chunk, stopRotation the last one.
+
+        Args:
+            output_name (str, optional): Name of the json file the chunk names are derived from. Defaults to None.
+            max_records (int, optional): frames and result sets per chunk, 0 for no limit. Defaults to 1000.
+            max_bytes (int, optional): bytes per chunk (compact json of the records), 0 for no limit. Defaults to 0.
+            max_seconds (float, optional): time in seconds per chunk, 0 for no limit. Defaults to 0.
+            compressed (bool, optional): False for uncompressed, True for compressed chunks in gz format. Defaults to False.
+        Returns:
+            str: path with file name of the manifest
+        """
+        self.stopRotation()
+        _base = os.path.abspath(self._freeFileName(output_name, rotation=True))[:-len(".json")]
+        self._rotation = { "base": _base, "max_records": max_records, "max_bytes": max_bytes, "max_seconds": max_seconds,
+                           "compressed": compressed, "manifest": {"chunks": [], "complete": False} }
+        self._startChunk()
+        self._writeManifest()
+        return _base + "_manifest.json"
+
+    def stopRotation(self):
+        """ Write the last chunk and the final manifest and end the rotation mode."""
+        if self._rotation:
+            self._writeChunk()
+            self._rotation["manifest"]["complete"] = True
+            self._writeManifest()
+            self._rotation = None
+
+    def _startChunk(self):
+        """ Reset the counters of the chunk in memory."""
+        self._rotation.update( records=0, bytes=0, first_frame=None, last_frame=None, start=time.time(), started=time.monotonic() )
+
+    def _countRecord(self, record:dict, frame_number):
+        """ Count a frame or result set of the chunk and write the chunk if a limit is reached.
+
+        Args:
+            record (dict): the dumped record
+            frame_number (int): frame number of the record, None if not known
+        """
+        _rot = self._rotation
+        _rot["records"] += 1
+        if _rot["max_bytes"]:
+            _rot["bytes"] += len(json.dumps(record, separators=(",", ":")))
+        if frame_number is not None:
+            if _rot["first_frame"] is None:
+                _rot["first_frame"] = frame_number
+            _rot["last_frame"] = frame_number
+        if ( _rot["max_records"] and _rot["records"] >= _rot["max_records"] ) or \
+           ( _rot["max_bytes"] and _rot["bytes"] >= _rot["max_bytes"] ) or \
+           ( _rot["max_seconds"] and time.monotonic() - _rot["started"] >= _rot["max_seconds"] ):
+            self._writeChunk()
+
+    def _writeChunk(self):
+        """ Write the chunk in memory to the next chunk file, add it to the manifest and remove its records from memory."""
+        _rot = self._rotation
+        if _rot["records"] == 0:
+            return
+        _chunk_name = "{}_{:04d}.json".format(_rot["base"], len(_rot["manifest"]["chunks"]))
+        if _rot["compressed"]:
+            TMF8829Logger._writeToFileCompressed(_chunk_name, self._json_dump)
+            _chunk_name += ".gz"
+        else:
+            TMF8829Logger._writeToFile(_chunk_name, self._json_dump, mode="w")
+        _rot["manifest"]["chunks"].append( {"file": os.path.basename(_chunk_name), "records": _rot["records"],
+                                            "first_frame": _rot["first_frame"], "last_frame": _rot["last_frame"],
+                                            "start_time": _rot["start"], "end_time": time.time(),
+                                            "bytes": os.path.getsize(_chunk_name)} )
+        for key in ("frames", "Result_Set", "info"):
+            self._json_dump.pop(key, None)
+        self._startChunk()
+        self._writeManifest()
+
+    def _writeManifest(self):
+        """ Write the manifest of the rotation mode, replaced in one step so a reader never sees a partial file."""
+        _manifest_name = self._rotation["base"] + "_manifest.json"
+        TMF8829Logger._writeToFile(_manifest_name + ".tmp", self._rotation["manifest"], mode="w")
+        os.replace(_manifest_name + ".tmp", _manifest_name)
+
+    def _freeFileName(self, output_name = None, rotation:bool = False) -> str:
+        """ Return the path with file name of a json file that does not exist yet, also not as gz file.
+
+        Args:
+            output_name (str, optional): Name of the json file. Defaults to None for TMF8829_UID<serial>-<date and time>.json.
+            rotation (bool, optional): also the first chunk and the manifest of a rotation must not exist. Defaults to False.
+        Returns:
+            str: path with file name
+        """
+        def _exists(name:str) -> bool:
+            _names = [ name, name + ".gz" ]
+            if rotation:
+                _names += [ name[:-len(".json")] + _suffix for _suffix in ( "_0000.json", "_0000.json.gz", "_manifest.json" ) ]
+            return any( os.path.isfile(_name) for _name in _names )
+
         if (output_name == None):
             time_now = time.localtime()
             time_sep = "-"
@@ -297,24 +475,51 @@ class TMF8829Logger:
         
         same_file_name = 100
         save_output_name = os.path.join(os.path.join(os.path.dirname(sys.argv[0]),output_name))
-        save_output_name_gz = os.path.join(os.path.join(os.path.dirname(sys.argv[0]),output_name + ".gz"))
         i = 0
-        while (os.path.isfile(save_output_name) or os.path.isfile(save_output_name_gz)):
+        while _exists(save_output_name):
             index = output_name.find('.json')
             save_output_name = output_name[:index] + "_{}".format(i)+ output_name[index:]
-            save_output_name_gz = save_output_name + ".gz"
             save_output_name = os.path.join(os.path.join(os.path.dirname(sys.argv[0]),save_output_name))
-            save_output_name_gz = os.path.join(os.path.join(os.path.dirname(sys.argv[0]),save_output_name_gz))
             i=i+1
             if i >=  same_file_name:
                 print("could not save file")
                 break
+        return save_output_name
+
+    def dumpToJsonFile(self, output_name = None, compressed:bool = True):
+        """ The dumped data is written to a json file. In rotation mode the current chunk is written instead, see startRotation.
+
+        Args:
+            output_name (str, optional): Name of the json file. Defaults to None.
+            compressed (bool, optional): False for uncompressed, True for compressed in gz format. Defaults to True.
+        """
+        if len(self._json_dump) == 0:
+          return
+
+        if self._rotation:
+            self._writeChunk()
+            return
+
+        save_output_name = self._freeFileName(output_name)
 
         if compressed:
             TMF8829Logger._writeToFileCompressed(save_output_name, self._json_dump)
         else:
             TMF8829Logger._writeToFile(save_output_name, self._json_dump)
 
+    def _logRecord(self, data:dict, kind:int = TMF8829_LOG_KIND_OTHER, fnumber:int = 0):
+        """ Append a record to the log file, queued to the writer thread in stream mode.
+
+        Args:
+            data (dict): data in dictionary format, must not be modified afterwards
+            kind (int, optional): stream mode, kind of the record for the index. Defaults to TMF8829_LOG_KIND_OTHER.
+            fnumber (int, optional): stream mode, frame number for the index. Defaults to 0.
+        """
+        if self._stream is not None:
+            self._stream.write(data, kind=kind, fnumber=fnumber)
+        else:
+            self._writeToFile(self._output_file, data)
+
     @staticmethod
     def _writeToFile( output_file : str, data, mode = "a"):
         """ Write dictionary to the log File
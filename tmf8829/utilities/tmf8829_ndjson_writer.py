@@ -0,0 +1,150 @@
+# *****************************************************************************
+# * Copyright by ams OSRAM AG                                                 *
+# * All rights are reserved.                                                  *
+# *                                                                           *
+# *FOR FULL LICENSE TEXT SEE LICENSES-MIT.TXT                                 *
+# *****************************************************************************
+
+""" Streaming writer for the TMF8829 logger. Every record is written as one compact JSON line (NDJSON) to a file
+that stays open. Encoding and writing run in a background thread, the caller only queues the records.
+Optionally the file is gzip compressed and an index sidecar is written, see tmf8829_log_index.py.
+"""
+
+import __init__
+import gzip
+import json
+import os
+import time
+import zlib
+from queue import Empty, Queue
+from threading import Thread
+
+from utilities.tmf8829_log_index import TMF8829_LOG_KIND_OTHER, indexHeader, tmf8829LogIndexEntry
+
+_FLUSH = object()                                   # queue marker, flush the file now
+
+
+class TMF8829NdjsonWriter:
+    """Writes dictionaries as NDJSON lines, the file is flushed when flush_size bytes are pending or
+    flush_interval seconds passed since the last flush."""
+
+    def __init__(self, file_name:str, mode:str = "w", buffer_size:int = 1024*1024, flush_interval:float = 1.0, \
+                 flush_size:int = 256*1024, max_queued:int = 0, compressed:bool = False, index:bool = False) -> None:
+        """Open the file and start the writer thread.
+
+        Args:
+            file_name (str): path with file name of the log file
+            mode (str, optional): file open mode, "w" or "a" (not for compressed files). Defaults to "w".
+            buffer_size (int, optional): size of the file buffer in bytes. Defaults to 1MB.
+            flush_interval (float, optional): maximum time in seconds a record stays in the file buffer. Defaults to 1.0.
+            flush_size (int, optional): bytes written after which the file is flushed. Defaults to 256kB.
+            max_queued (int, optional): records queued for the writer thread, write blocks if there are more. 0 for no limit.
+            compressed (bool, optional): gzip file, every flush is a full flush point for the index. Defaults to False.
+            index (bool, optional): write the index sidecar file_name + ".idx". Defaults to False.
+        """
+        if compressed and mode != "w":
+            raise ValueError("A compressed log file can only be written new")
+        self.file_name = file_name
+        self.records = 0                            # records written
+        self.bytes = 0                              # bytes written (uncompressed), offset of the next line
+        self.error = None                           # exception of the writer thread
+        self._flush_interval = flush_interval
+        self._flush_size = flush_size
+        self._encoder = json.JSONEncoder( separators=(",", ":") )
+        if mode == "a" and os.path.isfile( file_name ):
+            self.bytes = os.path.getsize( file_name )
+        self._raw = open( file_name, mode + "b", buffering=buffer_size )
+        self._file = gzip.GzipFile( fileobj=self._raw, mode="wb" ) if compressed else self._raw
+        self._flush_point = ( self._raw.tell(), self.bytes ) if compressed else ( 0, 0 )   # compressed, uncompressed offset
+        self._index = None
+        if index:
+            _append = mode == "a" and os.path.isfile( file_name + ".idx" )
+            self._index = open( file_name + ".idx", mode + "b", buffering=buffer_size )
+            if not _append:
+                self._index.write( indexHeader( compressed ) )
+        self._queue = Queue( maxsize=max_queued )
+        self._thread = Thread( target=self._writerThread, name="tmf8829-ndjson-writer", daemon=True )
+        self._thread.start()
+
+    def _flush(self) -> None:
+        """Flush the log and then the index, so the index never points behind the written data."""
+        if self._file is not self._raw:
+            self._file.flush( zlib.Z_FULL_FLUSH )   # decompression can start here
+            self._flush_point = ( self._raw.tell(), self.bytes )
+        self._raw.flush()
+        if self._index:
+            self._index.flush()
+
+    def _writerThread(self) -> None:
+        """Thread encodes and writes the queued records until None is queued."""
+        _last_flush = time.monotonic()
+        _unflushed = 0
+        while True:
+            try:
+                _item = self._queue.get( timeout=self._flush_interval )
+                _queued = True
+            except Empty:
+                _item = _FLUSH                      # nothing to write for flush_interval, flush the rest
+                _queued = False
+            try:
+                if _item is None:
+                    self._flush()
+                    return
+                if _item is not _FLUSH and self.error is None:
+                    _record, _kind, _fnumber, _timestamp = _item
+                    _line = ( self._encoder.encode( _record ) + "\n" ).encode( "utf-8" )
+                    self._file.write( _line )
+                    if self._index:
+                        self._index.write( bytes( tmf8829LogIndexEntry( offset=self.bytes, length=len(_line), fNumber=_fnumber,
+                                                                        kind=_kind, timestamp=_timestamp, flushPoint=self._flush_point[0],
+                                                                        flushOffset=self._flush_point[1] ) ) )
+                    self.records += 1
+                    self.bytes += len(_line)
+                    _unflushed += len(_line)
+                if _unflushed and ( _item is _FLUSH or _unflushed >= self._flush_size or \
+                                    time.monotonic() - _last_flush >= self._flush_interval ):
+                    self._flush()
+                    _unflushed = 0
+                    _last_flush = time.monotonic()
+            except Exception as exc:                # e.g. disk full, the records that follow are dropped
+                self.error = exc
+            finally:
+                if _queued:
+                    self._queue.task_done()
+
+    def _checkError(self) -> None:
+        if self.error is not None:
+            raise self.error
+
+    def write(self, record:dict, kind:int = TMF8829_LOG_KIND_OTHER, fnumber:int = 0) -> None:
+        """Queue a record, it is encoded and written by the writer thread. The record must not be modified afterwards.
+
+        Args:
+            record (dict): data in dictionary format
+            kind (int, optional): kind of the record for the index, TMF8829_LOG_KIND_* or frame id. Defaults to TMF8829_LOG_KIND_OTHER.
+            fnumber (int, optional): frame number for the index. Defaults to 0.
+        Raises:
+            exception of the writer thread, e.g. OSError
+        """
+        self._checkError()
+        self._queue.put( ( record, kind, fnumber, time.time() ) )
+
+    def flush(self) -> None:
+        """Wait until all queued records are written and flush the file."""
+        self._queue.put( _FLUSH )
+        self._queue.join()
+        self._checkError()
+
+    def close(self) -> None:
+        """Write all queued records, stop the writer thread and close the file."""
+        if self._thread is None:
+            return
+        self._queue.put( None )
+        self._thread.join()
+        self._thread = None
+        if self._file is not self._raw:
+            self._file.close()                      # gzip trailer, the raw file stays open
+        self._raw.close()
+        if self._index:
+            self._index.close()
+        self._checkError()
@@ -0,0 +1,194 @@
+# *****************************************************************************
+# * Copyright by ams OSRAM AG                                                 *
+# * All rights are reserved.                                                  *
+# *                                                                           *
+# *FOR FULL LICENSE TEXT SEE LICENSES-MIT.TXT                                 *
+# *****************************************************************************
+
+""" Export the result sets of a log (json, ndjson, manifest of a rotation or capture) to columnar NumPy arrays.
+Every column is a .npy file in the output directory, so it is opened with numpy.load(name, mmap_mode='r')
+without reading the whole recording:
+    distance, snr, signal, x, y, z      float32 (N, rows, cols, peaks), NaN for no peak
+    noise, xtalk                        float32 (N, rows, cols)
+    mp_histo, mp_histo_HA               uint32  (N, rows, cols, bins)
+    ref_histo, ref_histo_HA             uint32  (N, reference histograms, 64)
+    frame_number, temperature, ...      int64   (N,) from the measurement info
+The arrays are written while the result sets are read, only one result set is in memory.
+Result sets without a column (e.g. no peak at all) get a row of NaN or 0.
+"""
+
+import __init__
+import os
+import sys
+
+import numpy as np
+
+from utilities.tmf8829_log_reader import histogramBins, iterLogItems
+
+_NPY_HEADER_SIZE = 128          # fixed, so the header can be rewritten with the final number of result sets
+
+
+class NpyColumnWriter:
+    """Appends rows of a fixed shape to a .npy file, the number of rows is written by close."""
+
+    def __init__(self, file_name:str, dtype, shape:tuple) -> None:
+        """
+        Args:
+            file_name (str): path with file name of the .npy file
+            dtype: numpy data type
+            shape (tuple): shape of one row
+        """
+        self.file_name = file_name
+        self.dtype = np.dtype( dtype )
+        self.shape = tuple( shape )
+        self.rows = 0
+        self._file = open( file_name, "wb" )
+        self._writeHeader()
+
+    def _writeHeader(self) -> None:
+        _header = "{{'descr': {!r}, 'fortran_order': False, 'shape': {!r}, }}".format( self.dtype.str, (self.rows,) + self.shape )
+        _prefix = b"\x93NUMPY\x01\x00" + ( _NPY_HEADER_SIZE - 10 ).to_bytes( 2, "little" )
+        self._file.write( _prefix + _header.ljust( _NPY_HEADER_SIZE - 11 ).encode("latin1") + b"\n" )
+
+    def append(self, row) -> None:
+        """ Append one row.
+        Args:
+            row: array like with the shape of a row
+        Raises:
+            ValueError: the row has another shape
+        """
+        _row = np.asarray( row, dtype=self.dtype )
+        if _row.shape != self.shape:
+            raise ValueError("{}: row shape {} instead of {}".format(self.file_name, _row.shape, self.shape))
+        self._file.write( _row.tobytes() )
+        self.rows += 1
+
+    def appendFill(self, rows:int = 1) -> None:
+        """ Append rows for result sets without this column, NaN for float columns, else 0.
+        Args:
+            rows (int, optional): number of rows. Defaults to 1.
+        """
+        _row = np.full( self.shape, np.nan if self.dtype.kind == "f" else 0, dtype=self.dtype )
+        for _ in range( rows ):
+            self.append( _row )
+
+    def close(self) -> None:
+        """ Write the final header and close the file."""
+        self._file.seek( 0 )
+        self._writeHeader()
+        self._file.close()
+
+
+def resultColumns(result_set:dict, peaks:int) -> dict:
+    """ Convert one result set to the rows of the columns.
+
+    Args:
+        result_set (dict): result set in the format of the json files
+        peaks (int): number of peaks per pixel in the columns
+    Returns:
+        dict: column name -> numpy array of one row
+    Raises:
+        ValueError: a pixel has more than peaks peaks
+    """
+    columns = {}
+    results = result_set.get( "results" )
+    if results:
+        _rows, _cols = len(results), len(results[0])
+        for key in ( "noise", "xtalk" ):
+            if key in results[0][0]:
+                columns[key] = np.array( [ [ pixel.get( key, np.nan ) for pixel in row ] for row in results ], dtype=np.float32 )
+        for key in ( "distance", "snr", "signal", "x", "y", "z" ):
+            _column = np.full( (_rows, _cols, peaks), np.nan, dtype=np.float32 )
+            _used = False
+            for y, row in enumerate( results ):
+                for x, pixel in enumerate( row ):
+                    if len( pixel.get( "peaks", [] ) ) > peaks:
+                        raise ValueError("Pixel ({},{}) has {} peaks, the columns have {}".format(y, x, len(pixel["peaks"]), peaks))
+                    for p, peak in enumerate( pixel.get( "peaks", [] ) ):
+                        if key in peak:
+                            _column[y, x, p] = peak[key]
+                            _used = True
+            if _used:
+                columns[key] = _column
+    for key in ( "mp_histo", "mp_histo_HA" ):
+        if result_set.get( key ):
+            _bins_per_histo = max( len(histogramBins(histogram)) for row in result_set[key] for histogram in row )
+            _column = np.zeros( (len(result_set[key]), len(result_set[key][0]), _bins_per_histo), dtype=np.uint32 )
+            for y, row in enumerate( result_set[key] ):
+                for x, histogram in enumerate( row ):
+                    _b = histogramBins( histogram )
+                    _column[y, x, :len(_b)] = _b
+            columns[key] = _column
+    for key in ( "ref_histo", "ref_histo_HA" ):
+        if result_set.get( key ):
+            columns[key] = np.array( [ list(histogramBins(histogram)) for histogram in result_set[key] ], dtype=np.uint32 )
+    for key, value in result_set.get( "info", {} ).items():
+        if isinstance( value, (int, float) ):
+            columns[key] = np.array( value, dtype=np.int64 )
+    return columns
+
+def maxPeaks(result_set:dict) -> int:
+    """ Returns the highest number of peaks of a pixel in the result set, at least 1."""
+    return max( [1] + [ len(pixel.get("peaks", [])) for row in result_set.get("results", []) for pixel in row ] )
+
+def configuredPeaks(cfg:dict) -> int:
+    """ Returns the number of peaks per pixel of the result format of a configuration, 0 if it is not in the configuration."""
+    if "nr_peaks" not in cfg and isinstance( cfg.get( "measure_cfg" ), dict ):
+        cfg = cfg["measure_cfg"]
+    _peaks = cfg.get( "nr_peaks", 0 )
+    return _peaks if isinstance( _peaks, int ) else 0
+
+def exportNpy(file_name:str, output_dir:str, peaks:int = 0, npz:bool = False) -> dict:
+    """ Export a log to one .npy file per column.
+
+    Args:
+        file_name (str): json, json.gz, ndjson, manifest of a rotation or capture file
+        output_dir (str): directory of the .npy files, created if needed
+        peaks (int, optional): peaks per pixel, 0 for nr_peaks of the configuration in the log
+            (or the peaks of the first result set if the log has none). Defaults to 0.
+        npz (bool, optional): also write all columns into output_dir.npz (not memory mappable). Defaults to False.
+    Returns:
+        dict: column name -> path with file name of the .npy file
+    Raises:
+        ValueError: the shape of a column changed within the log, e.g. another configuration,
+            or a pixel has more peaks than the columns
+    """
+    os.makedirs( output_dir, exist_ok=True )
+    writers = {}
+    count = 0
+    try:
+        for key, result_set in iterLogItems( file_name ):
+            if key == "configuration" and not writers and isinstance( result_set, dict ):
+                peaks = peaks or configuredPeaks( result_set )
+            if key != "Result_Set":
+                continue
+            if not peaks:
+                peaks = maxPeaks( result_set )
+            for name, row in resultColumns( result_set, peaks ).items():
+                if name not in writers:
+                    writers[name] = NpyColumnWriter( os.path.join( output_dir, name + ".npy" ), row.dtype, row.shape )
+                    writers[name].appendFill( count )                   # column first seen now, e.g. first peak
+                writers[name].append( row )
+            for writer in writers.values():
+                if writer.rows == count:                                # column not in this result set
+                    writer.appendFill()
+            count += 1
+    finally:
+        for writer in writers.values():
+            writer.close()
+    files = { name: writer.file_name for name, writer in writers.items() }
+    if npz:
+        np.savez( output_dir.rstrip("/\\") + ".npz", **{ name: np.load( path, mmap_mode="r" ) for name, path in files.items() } )
+    return files
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: tmf8829_npy_export.py <json/ndjson/manifest/capture file> <output directory> [--npz] [--peaks=<n>]")
+        exit(0)
+    _peaks = 0
+    for _arg in sys.argv:
+        if _arg.startswith("--peaks="):
+            _peaks = int(_arg.split("=")[1])
+    for _name, _path in exportNpy( sys.argv[1], sys.argv[2], peaks=_peaks, npz="--npz" in sys.argv ).items():
+        print( "{}: {} {}".format( _name, _path, np.load( _path, mmap_mode="r" ).shape ) )
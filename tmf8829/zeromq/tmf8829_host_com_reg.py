@@ -120,7 +120,7 @@ class Union(ctypes.Union, AsDictMixin):
 
 
 TMF8829_ZEROMQ_HOST_COM_REG_H = True # macro
-TMF8829_ZEROMQ_PROTOCOL_VERSION = 2 # macro
+TMF8829_ZEROMQ_PROTOCOL_VERSION = 3 # macro
 TMF8829_ZEROMQ_PROTOCOL_MAGIC_NUMBER = 0xFE5E1234 # macro
 TMF8829_ZEROMQ_CMD_SERVER_ADDR = "tcp://127.0.0.1:5557" # macro
 TMF8829_ZEROMQ_RESULT_SERVER_ADDR = "tcp://127.0.0.1:5558" # macro
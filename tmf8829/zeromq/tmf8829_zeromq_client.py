@@ -20,6 +20,7 @@ import __init__
 
 import zmq
 import ctypes
+import json
 import time
 
 from zeromq.tmf8829_zeromq_common import *
@@ -31,7 +32,7 @@ from aos_com.register_io import ctypes2Dict
 class ZeroMqClient:
     """ZeroMQ client"""
    
-    VERSION = 0x0004
+    VERSION = 0x0007
     """Version 
     - 1 First zeromq client release version
     - 2 Second logger versions
@@ -44,43 +45,180 @@ class ZeroMqClient:
         fix, check if filename exists also for gz files
         for storage use os pathname
         store 3d point cloud values and distance
+    - 5 result sets are received as multipart messages, get_result_parts gives the parts without copying
+    - 6 topic subscription, results, histograms and reference SPAD frames can be selected
+        decoded point cloud stream of the server
+        compressed topics are decompressed, set_compression
+        get_stats
+        protocol version 3: timing and lost_sets from the container header of the received messages
+        get_replay
+        select_device for multi device servers, the topics of the device are subscribed
+        use_shared_memory, result sets are read from the shared memory of a server on the same host
+        identify switches to the endpoint with the lowest overhead that the server advertises (inproc, ipc)
+        set_receive_options (receive high water mark, latest only), get_result_sets drains all queued result sets
+    - 7 the logger decodes the result sets in parallel processes (configuration decode_workers), written in receive order
+        logging stream: records are also streamed to an NDJSON log file by a background writer
+        logging chunk: rotation to chunk files with a manifest, bounded memory for long captures
+        logging capture: raw frames are also written to a binary capture file
+        the NDJSON log file has an index sidecar (.idx) for random access
     """
 
-    def __init__(self) -> None:
+    def __init__(self, context = None) -> None:
+        """
+        Args:
+            context: zmq context, give the context of a server in the same process to use its inproc endpoints
+        """
         self._client_id = TMF8829_ZEROMQ_CLIENT_NOT_IDENTIFIED
-        self._context = zmq.Context()
+        self._context = context if context is not None else zmq.Context()
         self._cmd_socket = self._context.socket(zmq.REQ)
         self._result_socket = self._context.socket(zmq.SUB)
         self._is_measuring = False
         self._is_cfg_client = False
+        self._topics = set()
+        self._topic_prefix = b""         # topic prefix of the selected device of a multi device server
+        self._shm = None                 # SharedMemoryRing of the server, see use_shared_memory
+        self._cmd_addr = None            # connected endpoints
+        self._result_addr = None
+        self.prefer_local = True         # identify switches to inproc/ipc endpoints of the server
+        self.latest_only = False         # get_result_parts returns only the newest queued result set
+        self.skipped_sets = 0            # result sets dropped by latest_only
+        self._pending = {}               # topic -> (header, frames) published before the results of a set
+        self._last_sequence = None
+        self.timing = {}                # latencies of the last received frame message, see _updateTiming
+        self.lost_sets = 0              # result sets missed, from the gaps of the set sequence numbers
         self._cmd_socket.setsockopt(zmq.LINGER, 100) # after zmq close the Buffer should be cleared
 
+    def connect(self, cmd_addr: str, result_addr: str):
+        """
+        Connect to a server.
+        Args:
+            cmd_addr: address of the command socket
+            result_addr: address of the result socket
+        """
+        self._cmd_socket.connect(cmd_addr)
+        self._result_socket.connect(result_addr)
+        self._cmd_addr = cmd_addr
+        self._result_addr = result_addr
+        if not self._topics:
+            self.subscribe()
+
+    def disconnect(self):
+        """Disconnect from the server."""
+        if self._cmd_addr is not None:
+            self._cmd_socket.disconnect(self._cmd_addr)
+            self._result_socket.disconnect(self._result_addr)
+            self._cmd_addr = None
+            self._result_addr = None
+
     def connect_local(self):
         """Connect to local host server."""
-        self._cmd_socket.connect(TMF8829_ZEROMQ_CMD_SERVER_ADDR)
-        self._result_socket.connect(TMF8829_ZEROMQ_RESULT_SERVER_ADDR)
-        self._result_socket.setsockopt(zmq.SUBSCRIBE, b'')
+        self.connect(TMF8829_ZEROMQ_CMD_SERVER_ADDR, TMF8829_ZEROMQ_RESULT_SERVER_ADDR)
         logger.info("Connect to local host server")
 
     def disconnect_local(self):
         """Disconnect from local host server."""
-        self._cmd_socket.disconnect(TMF8829_ZEROMQ_CMD_SERVER_ADDR)
-        self._result_socket.disconnect(TMF8829_ZEROMQ_RESULT_SERVER_ADDR)
+        self.disconnect()
         logger.info("Disconnect from local host server")
 
     def connect_linux(self):
         """Connect to linux server."""
-        self._cmd_socket.connect(TMF8829_ZEROMQ_CMD_LINUX_SERVER_ADDR)
-        self._result_socket.connect(TMF8829_ZEROMQ_RESULT_LINUX_SERVER_ADDR)
-        self._result_socket.setsockopt(zmq.SUBSCRIBE, b'')
+        self.connect(TMF8829_ZEROMQ_CMD_LINUX_SERVER_ADDR, TMF8829_ZEROMQ_RESULT_LINUX_SERVER_ADDR)
         logger.info("Connect to linux server")
 
     def disconnect_linux(self):
         """Disconnect from linux server."""
-        self._cmd_socket.disconnect(TMF8829_ZEROMQ_CMD_LINUX_SERVER_ADDR)
-        self._result_socket.disconnect(TMF8829_ZEROMQ_RESULT_LINUX_SERVER_ADDR)
+        self.disconnect()
         logger.info("Disconnect from linux server")
 
+    def _useBestEndpoints(self, endpoints: dict) -> None:
+        """
+        Reconnect to the endpoints of the server with the lowest overhead, if they are better than the connected ones.
+        Args:
+            endpoints: endpoint information of the IDENTIFY response, see endpointInfo
+        """
+        if not self.prefer_local or self._cmd_addr is None:
+            return
+        _cmd = bestEndpoint(endpoints.get("cmd", []), endpoints, self._context)
+        _result = bestEndpoint(endpoints.get("result", []), endpoints, self._context)
+        if _cmd is None or _result is None:
+            return
+        _rank = endpointRank(_cmd, endpoints, self._context)
+        _current = endpointRank(self._cmd_addr, endpoints, self._context)
+        if _current is not None and _rank >= _current:
+            return
+        logger.info("Switch from {} to {} and {}".format(self._cmd_addr, _cmd, _result))
+        self.disconnect()
+        self.connect(_cmd, _result)
+
+    def subscribe(self, topics = TMF8829_ZEROMQ_TOPICS_FRAMES):
+        """
+        Subscribe to topics of the publisher port, the server sends only messages of subscribed topics.
+        If no topic is subscribed before connecting, all frame topics are subscribed.
+        Args:
+            topics: list of TMF8829_ZEROMQ_TOPIC_RESULTS, TMF8829_ZEROMQ_TOPIC_HISTOGRAMS,
+                TMF8829_ZEROMQ_TOPIC_REF_SPAD, TMF8829_ZEROMQ_TOPIC_DECODED
+        """
+        for _topic in topics:
+            if _topic not in self._topics:
+                self._result_socket.setsockopt(zmq.SUBSCRIBE, self._topic_prefix + _topic)
+                self._topics.add(_topic)
+
+    def unsubscribe(self, topics = TMF8829_ZEROMQ_TOPICS_FRAMES):
+        """
+        Unsubscribe from topics of the publisher port.
+        Args:
+            topics: list of topics, see subscribe
+        """
+        for _topic in list(topics):
+            if _topic in self._topics:
+                self._result_socket.setsockopt(zmq.UNSUBSCRIBE, self._topic_prefix + _topic)
+                self._topics.discard(_topic)
+
+    def select_device(self, index: int) -> int:
+        """
+        Select the device of a multi device server that the following requests are for, the subscribed topics
+        are changed to the ones of the device. Call identify afterwards to become the configuration client of the device.
+        A single device server has only device 0.
+        Args:
+            index: device index
+        Returns:
+            number of devices of the server
+        """
+        resp = self.send_request(Tmf8829zeroMQRequestMessage(client_id=self._client_id,request_id=Tmf8829zeroMQRequestId.SELECT_DEVICE,payload=bytes([index])))
+        _topics = set(self._topics)
+        self.unsubscribe(_topics)
+        self._topic_prefix = bytes(resp.payload[1:])
+        self.subscribe(_topics)
+        self._last_sequence = None          # every device has its own sequence numbers
+        return resp.payload[0]
+
+    def use_shared_memory(self) -> bool:
+        """
+        Read the result sets from the shared memory ring of the server if the server runs on the same host and has
+        the ring enabled. The frame topics are unsubscribed and TMF8829_ZEROMQ_TOPIC_SHM is subscribed, then
+        get_result_parts returns the result sets copied from the shared memory (all frames of a set in one slot).
+        Returns:
+            True: result sets are read from shared memory
+            False: the server has no ring or runs on another host, nothing changed
+        """
+        resp = self.send_request(Tmf8829zeroMQRequestMessage(client_id=self._client_id,request_id=Tmf8829zeroMQRequestId.GET_SHARED_MEMORY))
+        _payload = bytes(resp.payload)
+        if len(_payload) <= 16:
+            return False
+        from zeromq.tmf8829_zeromq_shm import SharedMemoryRing
+        try:
+            _shm = SharedMemoryRing.attach(_payload[16:].decode())
+        except (FileNotFoundError, ValueError):
+            return False
+        if _shm.token != int.from_bytes(_payload[0:8], 'little'):  # same name, but another host
+            _shm.close()
+            return False
+        self._shm = _shm
+        self.unsubscribe(TMF8829_ZEROMQ_TOPICS_FRAMES)
+        self.subscribe([TMF8829_ZEROMQ_TOPIC_SHM])
+        logger.info("Result sets from shared memory {}".format(_shm.name))
+        return True
+
     def send_request(
             self,
             request: Tmf8829zeroMQRequestMessage,
@@ -121,6 +259,7 @@ class ZeroMqClient:
     def identify(self) -> tmf8829ZmqDeviceInfo:
         """
         Identify the EVM controller and the target sensor. Get a new client_id if don't have one yet.
+        If the server advertises endpoints with less overhead (inproc, ipc) the client reconnects to them, see prefer_local.
         Returns:
             Device information
         Raises:
@@ -133,6 +272,9 @@ class ZeroMqClient:
             if self._client_id != resp.client_id:
                 raise Tmf8829zeroMQRequestError("Identify, client-id={} differs from response itself={}".format(self._client_id,resp.client_id) )
         _device_info = tmf8829ZmqDeviceInfo.from_buffer_copy( resp.payload )
+        _endpoints = bytes(resp.payload[ctypes.sizeof(tmf8829ZmqDeviceInfo):])     # appended by servers with several endpoints
+        if _endpoints:
+            self._useBestEndpoints(json.loads(_endpoints))
         if resp.error_code == Tmf8829zeroMQErrorCodes.NOT_CFG_CLIENT:
             self._is_cfg_client = False
             logger.info("ClientId={} Identify, LOGGER-ONLY client".format(self._client_id))
@@ -216,12 +358,230 @@ class ZeroMqClient:
         Raises:
             TimeoutError: When no result data is received before the timeout elapsed.
         """
+        result_data = b''.join( self.get_result_parts(timeout=timeout) )     # one copy for header + all frames
+
+        return result_data
+
+    def set_receive_options(self, rcv_hwm: int = None, latest_only: bool = None) -> None:
+        """
+        Tune the result socket for slow consumers.
+        Args:
+            rcv_hwm: maximum number of messages queued by zeroMQ (RCVHWM), further messages are dropped. A result set
+                is up to three messages (histograms, reference SPAD, results). None keeps the setting.
+            latest_only: True to get only the newest queued result set from get_result_parts, older ones are dropped
+                and counted in skipped_sets. Unlike ZMQ_CONFLATE this keeps the multipart messages and result sets
+                complete. None keeps the setting.
+        """
+        if rcv_hwm is not None:
+            self._result_socket.setsockopt(zmq.RCVHWM, rcv_hwm)
+            if self._result_addr is not None:               # the high water mark applies to new connections
+                self._result_socket.disconnect(self._result_addr)
+                self._result_socket.connect(self._result_addr)
+        if latest_only is not None:
+            self.latest_only = latest_only
+
+    def get_result_parts(self, timeout: float = 5.0) -> list:
+        """
+        Read result data as the list of message parts without copying them.
+        If the results topic is subscribed, the histogram and reference SPAD frames that the server published
+        before the results are combined with them into one result set. Else every message is returned on its own.
+        Messages of other topics (decoded streams) are skipped, use get_topic_parts for them.
+        With latest_only all queued result sets are read and only the newest one is returned.
+        Args:
+            timeout: Timeout in seconds.
+        Returns:
+            List of memoryviews, the container header followed by the frames of one result set.
+        Raises:
+            TimeoutError: When no result data is received before the timeout elapsed.
+        """
+        if not self.latest_only:
+            return self._nextResultSet(timeout)
+        _sets = self.get_result_sets(timeout=timeout)
+        self.skipped_sets += len(_sets) - 1
+        return _sets[-1]
+
+    def get_result_sets(self, timeout: float = 0.0, max_sets: int = 0) -> list:
+        """
+        Read all result sets that are queued, without blocking after the first one.
+        Args:
+            timeout: Timeout in seconds for the first result set.
+            max_sets: maximum number of result sets, 0 for all queued ones
+        Returns:
+            List of result sets as returned by get_result_parts, the oldest first.
+        Raises:
+            TimeoutError: When no result data is received before the timeout elapsed.
+        """
+        _sets = [ self._nextResultSet(timeout) ]
+        while (max_sets == 0 or len(_sets) < max_sets) and self._result_socket.poll(0, zmq.POLLIN):
+            try:
+                _sets.append( self._nextResultSet(0.0) )
+            except TimeoutError:                            # the rest of a set is not received yet, it stays pending
+                break
+        return _sets
+
+    def _nextResultSet(self, timeout: float) -> list:
+        """
+        Read the next result set, see get_result_parts. Frames published before the results stay pending
+        between calls and are only combined with the results of the same set sequence number.
+        """
+        _end = time.time() + timeout
+        _seq = slice(TMF8829_ZEROMQ_CONTAINER_INFO_OFFSET + tmf8829ContainerInfo.sequence.offset,
+                     TMF8829_ZEROMQ_CONTAINER_INFO_OFFSET + tmf8829ContainerInfo.sequence.offset + 4)
+        while True:
+            _topic, _parts = self.get_topic_parts(timeout=max(0.0, _end - time.time()))
+            if _topic not in TMF8829_ZEROMQ_TOPICS_FRAMES:
+                logger.debug("Skip message of topic {}".format(_topic))
+            elif TMF8829_ZEROMQ_TOPIC_RESULTS not in self._topics:
+                return _parts
+            elif _topic != TMF8829_ZEROMQ_TOPIC_RESULTS:
+                self._pending[_topic] = _parts              # a second message of a topic replaces one without results
+            else:
+                _pending, self._pending = self._pending, {}
+                _frames = [ _frame for _t in TMF8829_ZEROMQ_TOPICS_FRAMES if _t in _pending
+                            and _pending[_t][0][_seq] == _parts[0][_seq] for _frame in _pending[_t][1:] ]
+                if not _frames:
+                    return _parts
+                _header = tmf8829ContainerFrameHeader.from_buffer_copy(_parts[0])
+                _header.payload += sum( len(_frame) for _frame in _frames )
+                return [ memoryview(bytes(_header)) ] + _frames + _parts[1:]
+
+    def get_point_cloud(self, timeout: float = 5.0) -> tuple:
+        """
+        Read one point cloud of the decoded stream of the server (topic TMF8829_ZEROMQ_TOPIC_POINT_CLOUD has to be
+        subscribed). Messages of other topics are skipped. Needs numpy.
+        Args:
+            timeout: Timeout in seconds.
+        Returns:
+            Tuple of tmf8829PointCloudHeader and a numpy array of POINT_DTYPE (x, y, z, snr, signal)
+        Raises:
+            TimeoutError: When no point cloud is received before the timeout elapsed.
+        """
+        from zeromq.tmf8829_zeromq_point_cloud import Tmf8829PointCloudDecoder
+        _end = time.time() + timeout
+        while True:
+            _topic, _parts = self.get_topic_parts(timeout=max(0.0, _end - time.time()))
+            if _topic == TMF8829_ZEROMQ_TOPIC_POINT_CLOUD:
+                return Tmf8829PointCloudDecoder.fromParts(_parts)
+
+    def get_topic_parts(self, timeout: float = 5.0) -> tuple:
+        """
+        Read one message of any subscribed topic without copying it. Compressed frames are decompressed,
+        they are returned as one part after the container header. A result set in shared memory is returned with
+        the topic TMF8829_ZEROMQ_TOPIC_RESULTS as container header and one part with all frames, copied from the slot.
+        Args:
+            timeout: Timeout in seconds.
+        Returns:
+            Tuple of the topic and the list of memoryviews of the remaining message parts.
+        Raises:
+            TimeoutError: When no message is received before the timeout elapsed.
+        """
         timeout_ms = int(timeout * 1000.0)
         if not self._result_socket.poll(timeout_ms, zmq.POLLIN):
             raise TimeoutError("No result data received")
-        result_data = self._result_socket.recv()
+        _parts = self._result_socket.recv_multipart(copy=False)
+        _received = time.time_ns()
+        _topic = _parts[0].bytes[len(self._topic_prefix):]
+        _parts = [ _part.buffer for _part in _parts[1:] ]
+        if _topic == TMF8829_ZEROMQ_TOPIC_SHM and self._shm is not None:
+            _topic, _parts = self._readSharedMemory(_parts)
+        if _topic in TMF8829_ZEROMQ_TOPICS_FRAMES:
+            self._updateTiming(_parts[0], _received)
+        if _topic in TMF8829_ZEROMQ_TOPICS_FRAMES and _parts[0][5] != Tmf8829zeroMQCompression.NONE:   # reserved[0] of the container header
+            _header = tmf8829ContainerFrameHeader.from_buffer_copy(_parts[0])
+            _frames = decompressFrames(_parts[1], _header.reserved[0])
+            _header.reserved[0] = Tmf8829zeroMQCompression.NONE
+            _parts = [ memoryview(bytes(_header)), memoryview(_frames) ]
+        return _topic, _parts
+
+    def _readSharedMemory(self, parts) -> tuple:
+        """
+        Read the result set of a shared memory notification.
+        Args:
+            parts: message parts after the topic TMF8829_ZEROMQ_TOPIC_SHM
+        Returns:
+            Tuple of TMF8829_ZEROMQ_TOPIC_RESULTS and the container header and the frames,
+            or of TMF8829_ZEROMQ_TOPIC_SHM and no parts if the slot was overwritten (counted in lost_sets by the next set)
+        """
+        from zeromq.tmf8829_zeromq_shm import tmf8829ShmNotification
+        _notification = tmf8829ShmNotification.from_buffer_copy(parts[0])
+        if _notification.length == 0:                   # did not fit into a slot, sent inline
+            return TMF8829_ZEROMQ_TOPIC_RESULTS, parts[1:]
+        _data = self._shm.read(_notification)
+        if _data is None:
+            logger.info("Result set {} in shared memory already overwritten".format(_notification.sequence))
+            return TMF8829_ZEROMQ_TOPIC_SHM, []
+        _data = memoryview(_data)
+        _size = ctypes.sizeof(tmf8829ContainerFrameHeader)
+        return TMF8829_ZEROMQ_TOPIC_RESULTS, [ _data[:_size], _data[_size:] ]
+
+    def get_replay(self, since: int = 0, max_sets: int = 0) -> list:
+        """
+        Get the last result sets that the server published, e.g. after connecting during a measurement.
+        Available for all clients.
+        Args:
+            since: only sets with a higher sequence number (see timing["sequence"]), 0 for all
+            max_sets: only the newest max_sets sets, 0 for all
+        Returns:
+            list of result sets as returned by get_result_data, the oldest first
+        """
+        _payload = since.to_bytes(4, 'little') + max_sets.to_bytes(2, 'little')
+        resp = self.send_request(Tmf8829zeroMQRequestMessage(client_id=self._client_id,request_id=Tmf8829zeroMQRequestId.GET_REPLAY,payload=_payload),
+                                 response_timeout=5.0)
+        _data = bytes(resp.payload)
+        _sets = []
+        _offset = 0
+        while _offset < len(_data):
+            _header = tmf8829ContainerFrameHeader.from_buffer_copy(_data, _offset)
+            _size = _header.payload + 8         # payload excludes the first 8 bytes of the header
+            _sets.append(_data[_offset:_offset+_size])
+            _offset += _size
+        return _sets
+
+    def get_stats(self) -> dict:
+        """
+        Get the statistics of the server: counters, rates, lost frames, queue depths and latencies.
+        Available for all clients.
+        Returns:
+            dictionary of the server statistics
+        """
+        resp = self.send_request(Tmf8829zeroMQRequestMessage(client_id=self._client_id,request_id=Tmf8829zeroMQRequestId.GET_STATS))
+        return json.loads(bytes(resp.payload))
 
-        return result_data
+    def _updateTiming(self, header, received: int) -> None:
+        """
+        Update timing and lost_sets from the container header of a received message (protocol version 3 and higher).
+        timing has the keys:
+            sequence: result set sequence number of the server
+            server_s: time from reading the last frame of the set to sending the message on the server
+            transfer_s: time from sending to receiving, needs synchronized clocks if the server is on another host
+            age_s: server_s + transfer_s
+        Args:
+            header: container header
+            received: time.time_ns() when the message was received
+        """
+        if header[4] < 3:                   # protocolVersion
+            return
+        _info = tmf8829ContainerInfo.from_buffer_copy(header, TMF8829_ZEROMQ_CONTAINER_INFO_OFFSET)
+        if self._last_sequence is not None and _info.sequence > self._last_sequence + 1:
+            self.lost_sets += _info.sequence - self._last_sequence - 1
+        if self._last_sequence is None or _info.sequence > self._last_sequence or _info.sequence + 1 < self._last_sequence:
+            self._last_sequence = _info.sequence    # messages of one set have the same number, a lower number is a server restart
+        _server = ( _info.publishNs - _info.acquiredNs ) / 1e9
+        _transfer = ( received - _info.publishTimeNs ) / 1e9
+        self.timing = { "sequence": _info.sequence, "server_s": _server, "transfer_s": _transfer, "age_s": _server + _transfer }
+
+    def set_compression(self, topic: bytes, compression: int) -> bool:
+        """
+        Select the compression of a topic of the publisher port. It applies to all subscribers.
+        Args:
+            topic: TMF8829_ZEROMQ_TOPIC_RESULTS, TMF8829_ZEROMQ_TOPIC_HISTOGRAMS or TMF8829_ZEROMQ_TOPIC_REF_SPAD
+            compression: Tmf8829zeroMQCompression
+        Returns:
+            True: if request has been processed by command server
+            False: else (not the first client that requested)
+        """
+        resp = self.send_request(Tmf8829zeroMQRequestMessage(client_id=self._client_id,request_id=Tmf8829zeroMQRequestId.SET_COMPRESSION,payload=bytes([compression])+topic))
+        return resp.error_code == Tmf8829zeroMQErrorCodes.NO_ERROR and bool(resp.payload[0])
 
     def set_pre_config(self, cmd: bytes) -> bool:
         """
@@ -247,10 +607,15 @@ if __name__ == "__main__":
     from tmf8829_application_defines import *
     from tmf8829_application_common import Tmf8829AppCommon
     from utilities.tmf8829_logger_service import TMF8829Logger as Tmf8829Logger
-    from register_page_converter import RegisterPageConverter as RegConv
+    from tmf8829_config_codec import Tmf8829ConfigCodec
+    from zeromq.tmf8829_zeromq_decode_pool import ResultSetDecoderPool
+    from utilities.tmf8829_capture import TMF8829CaptureWriter
+    import multiprocessing
     import sys
     import os
 
+    multiprocessing.freeze_support()                # the decoder processes of an exe start here
+
     debugMsg = False
     #####################################################
     ## Arguments 
@@ -270,8 +635,12 @@ if __name__ == "__main__":
     #####################################################
     default_client_cfg = {
         "measure_cfg": {},
-        "logging": {"combined_results": True },
-        "record_frames":3
+        "logging": {"combined_results": True,
+                    "stream": False,                    # also stream every record to an .ndjson log file while measuring
+                    "chunk": {"records": 0, "bytes": 0, "seconds": 0},     # rotation to chunk files, 0 = no limit
+                    "capture": False },                 # also write the raw frames to a binary capture file (.cap)
+        "record_frames":3,
+        "decode_workers":0                          # decoder processes, 0 = number of CPUs
     }
     #####################################################
     CONFIG_FILE = "./cfg_client.json"
@@ -349,13 +718,20 @@ if __name__ == "__main__":
 
     # complete the user configuration with the device configuration
     _cfg_bytes = client.get_config()                                        # get configuration as a bytestream from device
-    _cfg_dict = RegConv.readPageToDict(_cfg_bytes, Tmf8829ConfigRegs())     # convert bytestream to dictionary
+    _cfg_dict = Tmf8829ConfigCodec.decode(_cfg_bytes)                        # convert bytestream to dictionary
     Tmf8829Logger.patch_dict( _cfg_dict, cfg["measure_cfg"] )               # external read config overwrites default config
-    _cfg_bytes2 = RegConv.readDictToPage( _cfg_dict, Tmf8829ConfigRegs())   # bytearray
+    _cfg_bytes2 = Tmf8829ConfigCodec.encode( _cfg_dict, _cfg_bytes )       # bytes
     client.set_config( _cfg_bytes2 )                                        # attempt to set configuration 
     _cfg_bytes = client.get_config()                                        # now in case we were not the 1st client, config might not have happened so read it back 
-    _cfg_dict = RegConv.readPageToDict(_cfg_bytes, Tmf8829ConfigRegs())     # convert bytestream to dictionary
+    _cfg_dict = Tmf8829ConfigCodec.decode(_cfg_bytes)                        # convert bytestream to dictionary
    
+    if cfg["logging"].get("stream", False):
+        tmf8829logger.createLogFile("TMF8829_zmq", list(dev_info.deviceSerialNumber.to_bytes(4,byteorder='little')), 
+                                    list(dev_info.fwVersion[1:]), stream=True, index=True)
+    _chunk = cfg["logging"]["chunk"]
+    if _chunk["records"] or _chunk["bytes"] or _chunk["seconds"]:
+        print( "Manifest={}".format(tmf8829logger.startRotation(max_records=_chunk["records"], max_bytes=_chunk["bytes"], 
+                                                                max_seconds=_chunk["seconds"])))
     tmf8829logger.dumpConfiguration( _cfg_dict )
 
     info = {}
@@ -369,78 +745,38 @@ if __name__ == "__main__":
         print("The result frames have the distance in 0.25mm, but will be logged in mm! ")
 
 
+    cnt = 0
+    def writeResultSet(decoded: dict):
+        """Write one decoded result set to the logger, called in receive order."""
+        global cnt
+        if debugMsg:
+            print( ctypes2Dict(tmf8829ContainerFrameHeader.from_buffer_copy(decoded["header"])))
+            print("zmq Result Frames:")
+            for fId, fpMode, fNumber in decoded["result_ids"]:
+                print( "FID={}, FP={}, FNr={}".format(fId, fpMode, fNumber))
+        cnt += 1
+        print( "Set={} #resultFrames={} #histoFrames={} #refFrames={}".format(cnt,decoded["results"],decoded["histograms"],decoded["ref_spad"]))
+        if "measurement" in decoded:
+            tmf8829logger.dumpMeasurement(**decoded["measurement"])
+        else:
+            for frame in decoded["frames"]:
+                tmf8829logger.dumpFrame(frame)
+
+    capture = None
+    if cfg["logging"]["capture"]:
+        capture = TMF8829CaptureWriter(os.path.join(script_location, "TMF8829_UID{}-{}.cap".format(dev_info.deviceSerialNumber,
+                                       time.strftime("%Y-%m-%d-%H-%M-%S"))), config=_cfg_bytes, device_info=info)
+
+    def captureResultSet(data: bytes):
+        """Write the raw frames of a result set to the capture, called in the receiver thread."""
+        capture.writeResultData(memoryview(data)[ctypes.sizeof(tmf8829ContainerFrameHeader):])
+
     if client.start_measurement():
         try:
-            cnt = 0
-            while cnt < cfg["record_frames"]:
-                zmq_result_data = client.get_result_data()
-                zmqheader = tmf8829ContainerFrameHeader.from_buffer_copy(bytearray(zmq_result_data[0:ctypes.sizeof(tmf8829ContainerFrameHeader)]))
-                if debugMsg:
-                    print( ctypes2Dict(zmqheader))
-                    print("zmq Result Frames:")
-                resultFrame, histoFrames, refFrame = Tmf8829AppCommon.getFramesFromMeasurementResult(zmq_result_data[ctypes.sizeof(tmf8829ContainerFrameHeader):])
-                if debugMsg:
-                    for r in resultFrame:
-                            fpMode = r[5]&TMF8829_FPM_MASK  
-                            fId = r[5]&TMF8829_FID_MASK
-                            print( "FID={}, FP={}, FNr={}".format(fId, fpMode, int.from_bytes(bytes=r[5+4:5+4+4],byteorder='little', signed=False)))
-
-                cnt += 1
-                print( "Set={} #resultFrames={} #histoFrames={} #refFrames={}".format(cnt,len(resultFrame),len(histoFrames),len(refFrame)))
-                if cfg["logging"]["combined_results"]:
-
-                    _toMM = False
-
-                    if _cfg_dict["select"] >= 1:
-                        _toMM = True
-
-                    pixelResults = Tmf8829AppCommon.getFullPixelResult(frames=resultFrame, toMM=_toMM, pointCloud=False, distanceToXYZ=True)
-
-                    # log the header of the first result frame
-                    fheader = tmf8829FrameHeader.from_buffer_copy( bytearray(resultFrame[0])[Tmf8829AppCommon.PRE_HEADER_SIZE: \
-                              Tmf8829AppCommon.PRE_HEADER_SIZE+ctypes.sizeof(struct__tmf8829FrameHeader)])
-                    ffooter = tmf8829FrameFooter.from_buffer_copy( bytearray(resultFrame[0])[-ctypes.sizeof(struct__tmf8829FrameFooter):])
-
-                    res_info = {}
-                    res_info["frame_number"] = fheader.fNumber
-                    res_info["temperature"] = fheader.temperature[2]
-                    res_info["systick_t0"] = ffooter.t0Integration
-                    res_info["systick_t1"] = ffooter.t1Integration
-                    res_info["read_time"] = int.from_bytes( resultFrame[0][1:5],byteorder='little',signed=False )
-                    
-                    allframeStatus = 0
-                    for frame in histoFrames:
-                        ffooter = tmf8829FrameFooter.from_buffer_copy( bytearray(frame)[-ctypes.sizeof(struct__tmf8829FrameFooter):])
-                        allframeStatus |= ffooter.frameStatus
-                    for frame in resultFrame:
-                        ffooter = tmf8829FrameFooter.from_buffer_copy( bytearray(frame)[-ctypes.sizeof(struct__tmf8829FrameFooter):])
-                        allframeStatus |= ffooter.frameStatus
-
-                    res_info["warnings"] = allframeStatus & ~TMF8829_FRAME_VALID
-                    
-                    histogramResults = []
-                    refhistogramResults = []
-                    histogramResultsHA = []
-                    refhistogramResultsHA = []     
-                    
-                    if _cfg_dict["histograms"] == 1:
-                        if _cfg_dict["dual_mode"] == 1:
-                            refhistogramResultsHA, histogramResultsHA, \
-                            refhistogramResults, histogramResults = Tmf8829AppCommon.getAllHistogramResultsDualMode(histoFrames)
-                        else:
-                            refhistogramResults, histogramResults = Tmf8829AppCommon.getAllHistogramResults(histoFrames)
-                    
-                    tmf8829logger.dumpMeasurement(pixel_results=pixelResults, \
-                        pixel_histograms=histogramResults, reference_pixel_histograms=refhistogramResults,
-                        pixel_histograms_HA=histogramResultsHA, reference_pixel_histograms_HA=refhistogramResultsHA,
-                        reference_spad_frames=refFrame, measurement_info=res_info)
-                else:
-                    for frame in histoFrames:
-                        tmf8829logger.dumpFrame(frame)
-                    for frame in resultFrame:
-                        tmf8829logger.dumpFrame(frame)
-                    for frame in refFrame:
-                        tmf8829logger.dumpFrame(frame)
+            # receive in a thread, decode in parallel processes, write in order here
+            decoder = ResultSetDecoderPool(client, _cfg_dict, combined=cfg["logging"]["combined_results"], workers=cfg["decode_workers"],
+                                           on_receive=captureResultSet if capture else None)
+            decoder.run(cfg["record_frames"], writeResultSet)
 
         except KeyboardInterrupt:
             pass
@@ -463,7 +799,13 @@ if __name__ == "__main__":
         tmf8829logger.dumpInfo({"Exception": "Stop leave and disconnect from server"})
         print( "Exception: Stop Server !!!!!!")
 
-    tmf8829logger.dumpToJsonFile(compressed=False)
+    tmf8829logger.closeLogFile()
+    if capture:
+        capture.close()
+    if _chunk["records"] or _chunk["bytes"] or _chunk["seconds"]:
+        tmf8829logger.stopRotation()
+    else:
+        tmf8829logger.dumpToJsonFile(compressed=False)
 
     print( "End" )
     time.sleep(2)
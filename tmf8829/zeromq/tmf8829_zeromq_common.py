@@ -7,11 +7,24 @@
 """
 ZeroMQ common functions and classes.
 """
+import atexit
+import ctypes
 import logging
+import lzma
+import os
+import random
+import socket
+import tempfile
+import zlib
 from enum import IntEnum
 from typing import Optional
 from zeromq.tmf8829_host_com_reg import *
 
+try:
+    import lz4.frame as lz4frame                # optional, faster than zlib
+except ImportError:
+    lz4frame = None
+
 logger = logging.getLogger(__name__)
 
 
@@ -21,6 +34,162 @@ class Tmf8829zeroMQProtocolError(Exception):
 class Tmf8829zeroMQRequestError(Exception):
     """Command error."""
 
+TMF8829_ZEROMQ_TOPIC_RESULTS    = b"RES:"      # result frames
+TMF8829_ZEROMQ_TOPIC_HISTOGRAMS = b"HIST:"     # raw histogram frames
+TMF8829_ZEROMQ_TOPIC_REF_SPAD   = b"REFSPAD:"  # reference SPAD frames
+TMF8829_ZEROMQ_TOPIC_DECODED    = b"DECODED:"  # decoded streams, produced by the server
+TMF8829_ZEROMQ_TOPIC_POINT_CLOUD = TMF8829_ZEROMQ_TOPIC_DECODED + b"XYZ:"  # decoded point cloud
+TMF8829_ZEROMQ_TOPIC_SHM       = b"SHM:"      # notifications of result sets in shared memory, see tmf8829_zeromq_shm.py
+TMF8829_ZEROMQ_TOPICS_FRAMES = ( TMF8829_ZEROMQ_TOPIC_HISTOGRAMS, TMF8829_ZEROMQ_TOPIC_REF_SPAD, TMF8829_ZEROMQ_TOPIC_RESULTS )
+"""Topics of the device frames, in the order they are published for one result set"""
+
+def deviceTopicPrefix(index: int) -> bytes:
+    """
+    Topic prefix of a device of a multi device server, e.g. b"DEV1:" + TMF8829_ZEROMQ_TOPIC_RESULTS.
+    Args:
+        index: device index
+    Returns:
+        topic prefix
+    """
+    return b"DEV" + str(index).encode() + b":"
+
+TMF8829_ZEROMQ_CMD_INPROC_ADDR    = "inproc://tmf8829_cmd"        # command socket for a client in the server process
+TMF8829_ZEROMQ_RESULT_INPROC_ADDR = "inproc://tmf8829_result"     # result socket for a client in the server process
+
+def ipcAddress(tcp_address:str) -> str:
+    """
+    The ipc endpoint of a socket for clients on the same host. The path contains the tcp port of the socket, so
+    servers listening on different ports on one host get different socket files.
+    Args:
+        tcp_address: tcp address of the socket, e.g. "tcp://127.0.0.1:5557"
+    Returns:
+        ipc address, e.g. "ipc:///tmp/tmf8829_5557"
+    """
+    return "ipc://" + os.path.join( tempfile.gettempdir(), "tmf8829_" + tcp_address.rsplit(":", 1)[-1] )
+
+def _ipcInUse(address:str) -> bool:
+    """
+    Args:
+        address: ipc address
+    Returns:
+        True if another process listens on the socket file of the address. A stale file of a terminated server is not in use.
+    """
+    _path = address[len("ipc://"):]
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(_path):
+        return False
+    _probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        _probe.connect(_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        _probe.close()
+
+def bindEndpoints(zmq_socket, addresses) -> list:
+    """
+    Bind a socket to one or several endpoints. Endpoints that cannot be bound (e.g. ipc on a host without
+    unix domain sockets, or an ipc socket file another server listens on) are skipped with an error message.
+    Args:
+        zmq_socket: socket to bind
+        addresses: address or list of addresses (tcp://, ipc://, inproc://)
+    Returns:
+        list of the bound addresses
+    """
+    _bound = []
+    for _address in ( [ addresses ] if isinstance(addresses, str) else addresses ):
+        try:
+            if _address.startswith("ipc://") and _ipcInUse(_address):
+                raise RuntimeError("socket file is used by another process")
+            zmq_socket.bind(_address)
+            _bound.append(_address)
+        except Exception as exc:
+            logger.error("Cannot bind {}: {}".format(_address, exc))
+    return _bound
+
+_host_token = None
+
+def _hostTokenFile(token: str) -> str:
+    """Returns: path of the file that marks the host of a server with the token"""
+    return os.path.join(tempfile.gettempdir(), "tmf8829_host_" + token)
+
+def hostToken() -> str:
+    """
+    Random token of the server process. A file named after the token is created in the temporary directory,
+    a client on the same host finds it there. Host names are no proof (e.g. every Raspberry Pi is "raspberrypi").
+    Returns:
+        token as hex string, empty if the file cannot be created
+    """
+    global _host_token
+    if _host_token is None:
+        _host_token = "{:016x}".format(random.getrandbits(64))
+        try:
+            open(_hostTokenFile(_host_token), "w").close()
+            atexit.register(os.remove, _hostTokenFile(_host_token))
+        except OSError as exc:
+            logger.error("Cannot create the host token file: {}".format(exc))
+            _host_token = ""
+    return _host_token
+
+def isSameHost(info: dict) -> bool:
+    """
+    Args:
+        info: endpoint information of the server, see endpointInfo
+    Returns:
+        True if the server runs on the host of the caller (its host token file exists here)
+    """
+    _token = info.get("token")
+    return bool(_token) and os.path.isfile(_hostTokenFile(_token))
+
+def endpointInfo(cmd_addresses: list, result_addresses: list, context) -> dict:
+    """
+    Describe the endpoints of a server for the IDENTIFY response, so that a client can select the best one.
+    Args:
+        cmd_addresses: bound addresses of the command socket
+        result_addresses: bound addresses of the result socket
+        context: zmq context of the server, inproc endpoints are only reachable with the same context
+    Returns:
+        dictionary that can be serialized to json
+    """
+    return { "cmd": list(cmd_addresses), "result": list(result_addresses),
+             "host": socket.gethostname(), "token": hostToken(), "pid": os.getpid(), "context": id(context) }
+
+def endpointRank(address: str, info: dict, context) -> Optional[int]:
+    """
+    Overhead of an endpoint for a client: 0 inproc (same context), 1 ipc (same host), 2 tcp on the loopback
+    interface (same host), 3 tcp. The same host is detected with the host token, see hostToken.
+    Args:
+        address: address advertised by the server
+        info: endpoint information of the server, see endpointInfo
+        context: zmq context of the client
+    Returns:
+        rank, None if the client cannot reach the address
+    """
+    _same_host = isSameHost(info)
+    if address.startswith("inproc://"):
+        return 0 if _same_host and info.get("pid") == os.getpid() and info.get("context") == id(context) else None
+    if address.startswith("ipc://"):
+        return 1 if _same_host and os.path.exists(address[len("ipc://"):]) else None     # connect would not fail without the socket file
+    if "*" in address:                  # wildcard, the client does not know the host address
+        return None
+    if address.startswith("tcp://127.") or address.startswith("tcp://localhost:"):
+        return 2 if _same_host else None
+    return 3
+
+def bestEndpoint(addresses: list, info: dict, context) -> Optional[str]:
+    """
+    Select the endpoint with the lowest overhead that a client can reach, see endpointRank.
+    Args:
+        addresses: addresses advertised by the server
+        info: endpoint information of the server, see endpointInfo
+        context: zmq context of the client
+    Returns:
+        address, None if no address is reachable
+    """
+    _ranked = [ (endpointRank(_a, info, context), _a) for _a in addresses ]
+    _ranked = [ _r for _r in _ranked if _r[0] is not None ]
+    return min(_ranked)[1] if _ranked else None
+
 class Tmf8829zeroMQRequestId(IntEnum):
     """Request command IDs."""
     NONE                  = 0x00
@@ -32,6 +201,11 @@ class Tmf8829zeroMQRequestId(IntEnum):
     GET_CONFIGURATION     = 0x20
     SET_CONFIGURATION     = 0x21
     SET_PRE_CONFIGURATION = 0x24
+    SET_COMPRESSION       = 0x25 # compression of a topic of the publisher port
+    GET_STATS             = 0x26 # server statistics as json
+    GET_REPLAY            = 0x27 # last published result sets
+    SELECT_DEVICE         = 0x28 # device of a multi device server that the following requests are for
+    GET_SHARED_MEMORY     = 0x29 # shared memory ring of the result sets, for clients on the same host
     UPDATE_BINARIES       = 0xA0 # Raspberry Pi Only
 
 class Tmf8829zeroMQErrorCodes(IntEnum):
@@ -42,6 +216,74 @@ class Tmf8829zeroMQErrorCodes(IntEnum):
     UNKNOWN_CMD    = 0xfe  #: Unknown command
     ERROR          = 0xff  #: Error
 
+class tmf8829ContainerInfo(ctypes.LittleEndianStructure):
+    """Content of the info field of the container header, protocol version 3 and higher.
+    The messages of all topics of one result set have the same content."""
+    _pack_ = 1
+    _fields_ = [
+        ('acquiredNs', ctypes.c_uint64),        # time.monotonic_ns() of the server when the last frame of the set was read
+        ('publishNs', ctypes.c_uint64),         # time.monotonic_ns() of the server when the message was sent
+        ('publishTimeNs', ctypes.c_uint64),     # time.time_ns() of the server when the message was sent
+        ('sequence', ctypes.c_uint32),          # result set sequence number of the server
+    ]
+
+TMF8829_ZEROMQ_CONTAINER_INFO_OFFSET = tmf8829ContainerFrameHeader.info.offset
+"""Offset of tmf8829ContainerInfo in the container header"""
+TMF8829_ZEROMQ_PUBLISH_NS_OFFSET = TMF8829_ZEROMQ_CONTAINER_INFO_OFFSET + tmf8829ContainerInfo.publishNs.offset
+"""Offset of publishNs in the container header, publishNs and publishTimeNs are written just before sending"""
+
+class Tmf8829zeroMQCompression(IntEnum):
+    """Compression of the frames of a published message, stored in reserved[0] of the container header."""
+    NONE = 0x00
+    ZLIB = 0x01
+    LZMA = 0x02
+    LZ4  = 0x03  # only if the lz4 package is installed
+
+def compressionAvailable(compression) -> bool:
+    """
+    Check if a compression can be used on this host.
+    Args:
+        compression: Tmf8829zeroMQCompression
+    Returns:
+        True if the codec is available
+    """
+    return compression != Tmf8829zeroMQCompression.LZ4 or lz4frame is not None
+
+def compressFrames(frames, compression) -> bytes:
+    """
+    Compress the concatenation of frames.
+    Args:
+        frames: list of frames
+        compression: Tmf8829zeroMQCompression, not NONE
+    Returns:
+        compressed bytes
+    """
+    _data = b''.join(frames)
+    if compression == Tmf8829zeroMQCompression.ZLIB:
+        return zlib.compress(_data, 1)
+    if compression == Tmf8829zeroMQCompression.LZMA:
+        return lzma.compress(_data, preset=0)
+    if compression == Tmf8829zeroMQCompression.LZ4 and lz4frame is not None:
+        return lz4frame.compress(_data)
+    raise Tmf8829zeroMQProtocolError("Compression {} is not available".format(compression))
+
+def decompressFrames(data, compression) -> bytes:
+    """
+    Decompress the frames of a published message.
+    Args:
+        data: compressed bytes
+        compression: Tmf8829zeroMQCompression of the container header
+    Returns:
+        the concatenation of the frames
+    """
+    if compression == Tmf8829zeroMQCompression.ZLIB:
+        return zlib.decompress(data)
+    if compression == Tmf8829zeroMQCompression.LZMA:
+        return lzma.decompress(data)
+    if compression == Tmf8829zeroMQCompression.LZ4 and lz4frame is not None:
+        return lz4frame.decompress(data)
+    raise Tmf8829zeroMQProtocolError("Compression {} is not available".format(compression))
+
 class Tmf8829zeroMQRequestMessage:
     """
     ZeroMQ request message.
@@ -0,0 +1,127 @@
+# *****************************************************************************
+# * Copyright by ams OSRAM AG                                                 *
+# * All rights are reserved.                                                  *
+# *                                                                           *
+# *FOR FULL LICENSE TEXT SEE LICENSES-MIT.TXT                                 *
+# *****************************************************************************
+"""
+Parallel decoding of the result sets received by the zeroMQ logger client.
+A receiver thread only reads the result sets from the client, a process pool decodes them (pixel results, histograms)
+and the writer gets the decoded sets in the order they were received.
+"""
+import __init__
+import ctypes
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from queue import Empty, Queue
+from threading import Event, Thread
+
+from tmf8829_application_defines import *
+from tmf8829_application_common import Tmf8829AppCommon
+from zeromq.tmf8829_host_com_reg import tmf8829ContainerFrameHeader
+from utilities.tmf8829_logger_service import TMF8829Logger
+
+logger = logging.getLogger(__name__)
+
+
+def decodeResultSet( data: bytes, cfg: dict, combined: bool = True ) -> dict:
+    """Decode one result set as received with ZeroMqClient.get_result_data, runs in a worker process.
+    Args:
+        data: container header followed by the frames
+        cfg: configuration dictionary of the device (select, histograms, dual_mode are used)
+        combined: True to decode pixel results and histograms, False to return only the frames
+    Returns:
+        dictionary with the container header, the frame counts (results, histograms, ref_spad), (frame id, focal plane mode,
+        frame number) of the result frames (result_ids) and either the arguments of TMF8829Logger.dumpMeasurement (measurement)
+        or the list of frames to be dumped (frames)
+    """
+    _size = ctypes.sizeof(tmf8829ContainerFrameHeader)
+    resultFrame, histoFrames, refFrame = Tmf8829AppCommon.getFramesFromMeasurementResult(data[_size:])
+    _decoded = { "header": bytes(data[:_size]), "results": len(resultFrame), "histograms": len(histoFrames), "ref_spad": len(refFrame),
+                 "result_ids": [ ( r[5]&TMF8829_FID_MASK, r[5]&TMF8829_FPM_MASK, int.from_bytes(bytes=r[5+4:5+4+4],byteorder='little', signed=False) )
+                                 for r in resultFrame ] }
+    if not combined:
+        _decoded["frames"] = list(histoFrames) + list(resultFrame) + list(refFrame)
+        return _decoded
+
+    _decoded["measurement"] = TMF8829Logger.measurementFromFrames(resultFrame, histoFrames, refFrame, cfg)
+    return _decoded
+
+
+class ResultSetDecoderPool:
+    """
+    Receive, decode and write result sets in a pipeline:
+    receiver thread (get_result_data) -> process pool (decodeResultSet) -> writer in receive order (caller thread).
+    """
+
+    def __init__(self, client, cfg: dict, combined: bool = True, workers: int = 0, max_pending: int = 0, on_receive=None) -> None:
+        """
+        Args:
+            client: ZeroMqClient, its result socket is only used by the receiver thread while run is active
+            cfg: configuration dictionary of the device
+            combined: decode pixel results and histograms (True) or only split the frames (False)
+            workers: number of decoder processes, 0 for the number of CPUs
+            max_pending: result sets received but not written yet, the receiver waits if there are more. 0 for 4 per worker.
+            on_receive: function called with every received result set in the receiver thread, e.g. to write a capture
+        """
+        self._client = client
+        self._cfg = dict(cfg)
+        self._combined = combined
+        self._workers = workers or os.cpu_count() or 1
+        self._pending = Queue( maxsize=max_pending or 4*self._workers )   # futures in receive order, None = end
+        self._stop = Event()
+        self._on_receive = on_receive
+        self.error = None                                               # exception of the receiver thread
+
+    def _receiverThread(self, executor, nr_sets: int, timeout: float) -> None:
+        """Thread reads nr_sets result sets and hands them to the process pool."""
+        try:
+            for _ in range(nr_sets):
+                if self._stop.is_set():
+                    break
+                _data = self._client.get_result_data(timeout=timeout)
+                if self._stop.is_set():
+                    break                                               # the writer stopped, e.g. a capture may be closed
+                if self._on_receive is not None:
+                    self._on_receive( _data )
+                self._pending.put( executor.submit( decodeResultSet, _data, self._cfg, self._combined ) )
+        except Exception as exc:
+            self.error = exc
+        self._pending.put( None )
+
+    def run(self, nr_sets: int, write, timeout: float = 5.0) -> int:
+        """Receive and decode nr_sets result sets, write is called in receive order from the calling thread.
+        Args:
+            nr_sets: number of result sets
+            write: function called with the dictionary of decodeResultSet
+            timeout: timeout in seconds for each result set
+        Returns:
+            number of written result sets, an exception of the receiver (e.g. TimeoutError) is raised after the sets
+            received before were written
+        """
+        _written = 0
+        self._stop.clear()
+        self.error = None
+        with ProcessPoolExecutor( max_workers=self._workers ) as _executor:
+            _receiver = Thread( target=self._receiverThread, args=(_executor, nr_sets, timeout), name="tmf8829-receiver", daemon=True )
+            _receiver.start()
+            try:
+                while True:
+                    _future = self._pending.get()
+                    if _future is None:
+                        break
+                    write( _future.result() )
+                    _written += 1
+            finally:
+                self._stop.set()
+                while _receiver.is_alive():                             # unblock the receiver if the writer stopped early
+                    try:
+                        _future = self._pending.get( timeout=0.1 )
+                        if _future is not None:
+                            _future.cancel()
+                    except Empty:
+                        pass
+        if self.error is not None:
+            raise self.error
+        return _written
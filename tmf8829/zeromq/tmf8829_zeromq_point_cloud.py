@@ -0,0 +1,135 @@
+# *****************************************************************************
+# * Copyright by ams OSRAM AG                                                 *
+# * All rights are reserved.                                                  *
+# *                                                                           *
+# *FOR FULL LICENSE TEXT SEE LICENSES-MIT.TXT                                 *
+# *****************************************************************************
+"""
+Decoded point cloud stream of the zeroMQ servers.
+The result frames of a result set are decoded once on the server with numpy and published as
+one message with a tmf8829PointCloudHeader and an array of points (POINT_DTYPE), one point per valid peak.
+The points are calculated like Tmf8829AppCommon.getFullPixelResult( distanceToXYZ=True ), but not rounded.
+"""
+import __init__
+import ctypes
+import numpy as np
+
+from tmf8829_application_defines import *
+from tmf8829_application_common import Tmf8829AppCommon
+from tmf8829_config_page import Tmf8829_config_page as Tmf8829ConfigRegs
+
+
+class tmf8829PointCloudHeader(ctypes.LittleEndianStructure):
+    """Header of a point cloud message"""
+    _pack_ = 1
+    _fields_ = [
+        ('fNumber', ctypes.c_uint32),       # frame number of the first result frame
+        ('fpMode', ctypes.c_uint8),         # focal plane mode
+        ('resultFormat', ctypes.c_uint8),   # layout byte of the result frame (number of peaks, signal, ...)
+        ('reserved', ctypes.c_uint16),
+        ('timestamp', ctypes.c_double),     # host time in seconds when the result set was complete
+        ('nrPoints', ctypes.c_uint32),      # number of points that follow
+    ]
+
+POINT_DTYPE = np.dtype( [ ('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('snr', '<f4'), ('signal', '<f4') ] )
+"""One point, x/y/z in the distance unit of the result frames. signal is 0 if the frames do not contain it."""
+
+
+class Tmf8829PointCloudDecoder:
+    """Vectorized decoder of result frames into points. The pixel correction factors are calculated once per focal plane mode."""
+
+    _grids = {}     # fp_mode -> (correction, x factor, y factor) arrays of [rows, columns]
+
+    @staticmethod
+    def _grid( fp_mode:int ):
+        """Return the point cloud correction of all pixels, vectorized Tmf8829AppCommon.zCorrection
+        Args:
+            fp_mode: focal plane mode
+        Returns:
+            tuple of 3 arrays [rows, columns]: correction factor, x factor, y factor
+        """
+        if fp_mode not in Tmf8829PointCloudDecoder._grids:
+            if fp_mode <= Tmf8829AppCommon.FP_MODE_8x8B:
+                _cols, _rows = 8, 8
+            elif fp_mode == Tmf8829AppCommon.FP_MODE_16x16:
+                _cols, _rows = 16, 16
+            elif fp_mode <= Tmf8829AppCommon.FP_MODE_32x32s:
+                _cols, _rows = 32, 32
+            else:
+                _cols, _rows = 48, 32
+            _x = ( np.arange(_cols) - _cols/2 + 0.5 ) / ( _cols * 3.0 / 4.0 )
+            _y = ( np.arange(_rows) - _rows/2 + 0.5 ) / _rows
+            _xx, _yy = np.meshgrid( _x, _y )
+            Tmf8829PointCloudDecoder._grids[fp_mode] = ( np.sqrt( 1 + _xx*_xx + _yy*_yy ), _xx, _yy )
+        return Tmf8829PointCloudDecoder._grids[fp_mode]
+
+    @staticmethod
+    def decode( frames, timestamp:float = 0.0 ):
+        """Decode the result frames of one result set
+        Args:
+            frames: list of result frames (pre-header + frame), sub-frame 0 and 1 for 32x32 and 48x32 mode
+            timestamp: host time of the result set
+        Returns:
+            tuple(tmf8829PointCloudHeader, numpy array of POINT_DTYPE)
+        """
+        _hsize = ctypes.sizeof(struct__tmf8829FrameHeader)
+        _first = tmf8829FrameHeader.from_buffer_copy( bytes(frames[0][Tmf8829AppCommon.PRE_HEADER_SIZE:Tmf8829AppCommon.PRE_HEADER_SIZE+_hsize]) )
+        _fp_mode = _first.id & TMF8829_FPM_MASK
+        _format = _first.layout
+        _fmt = Tmf8829ConfigRegs.TMF8829_CFG_RESULT_FORMAT
+        _nr_peaks = _format & _fmt._nr_peaks.mask
+        _use_signal = (_format & _fmt._signal_strength.mask) == _fmt._signal_strength.mask
+        _use_noise = (_format & _fmt._noise_strength.mask) == _fmt._noise_strength.mask
+        _use_xtalk = (_format & _fmt._xtalk.mask) == _fmt._xtalk.mask
+        _pixel_size = Tmf8829AppCommon.pixelResultSize(_format)
+        _corr, _xf, _yf = Tmf8829PointCloudDecoder._grid(_fp_mode)
+        _rows, _cols = _corr.shape
+
+        _pixels = np.zeros( (_rows, _cols, _pixel_size), dtype=np.uint8 )     # rows without a sub-frame stay 0 = no peak
+        _frame_rows = Tmf8829AppCommon.resultsPerFrame(_fp_mode) // _cols
+        for _frame in frames:
+            _data = np.frombuffer( _frame, dtype=np.uint8, count=_frame_rows*_cols*_pixel_size, offset=Tmf8829AppCommon.PRE_HEADER_SIZE+_hsize )
+            _data = _data.reshape( _frame_rows, _cols, _pixel_size )
+            if _frame_rows == _rows:
+                _pixels[:] = _data
+            else:                                           # sub-frames hold every other row
+                _sub = ( _frame[Tmf8829AppCommon.PRE_HEADER_SIZE+1] >> Tmf8829AppCommon.RESULT_FRAME_SUBIDX_SHIFT ) & 1
+                _pixels[_sub::2] = _data
+
+        _peak_size = 5 if _use_signal else 3
+        _idx = 2 * _use_noise + 2 * _use_xtalk
+        _peaks = _pixels[:, :, _idx:_idx+_nr_peaks*_peak_size].reshape( _rows, _cols, _nr_peaks, _peak_size ).astype(np.float32)
+        _distance = _peaks[..., 0] + _peaks[..., 1] * 256
+        _valid = _distance > 0
+        _z = _distance / _corr[:, :, None]
+        _points = np.empty( np.count_nonzero(_valid), dtype=POINT_DTYPE )
+        _points['x'] = ( _z * _xf[:, :, None] )[_valid]
+        _points['y'] = ( _z * _yf[:, :, None] )[_valid]
+        _points['z'] = _z[_valid]
+        _points['snr'] = _peaks[..., 2][_valid]
+        _points['signal'] = ( _peaks[..., 3] + _peaks[..., 4] * 256 )[_valid] if _use_signal else 0
+
+        _header = tmf8829PointCloudHeader( fNumber=_first.fNumber, fpMode=_fp_mode, resultFormat=_format, timestamp=timestamp, nrPoints=len(_points) )
+        return _header, _points
+
+    @staticmethod
+    def toParts( header:tmf8829PointCloudHeader, points ) -> list:
+        """Return the message parts of a point cloud
+        Args:
+            header: point cloud header
+            points: numpy array of POINT_DTYPE
+        Returns:
+            list of header bytes and points buffer
+        """
+        return [ bytes(header), memoryview(points).cast('B') ]
+
+    @staticmethod
+    def fromParts( parts ):
+        """Return header and points of a received point cloud message, the points are not copied
+        Args:
+            parts: list of the header part and the points part
+        Returns:
+            tuple(tmf8829PointCloudHeader, numpy array of POINT_DTYPE)
+        """
+        _header = tmf8829PointCloudHeader.from_buffer_copy( bytes(parts[0]) )
+        return _header, np.frombuffer( parts[1], dtype=POINT_DTYPE, count=_header.nrPoints )
@@ -0,0 +1,206 @@
+# *****************************************************************************
+# * Copyright by ams OSRAM AG                                                 *
+# * All rights are reserved.                                                  *
+# *                                                                           *
+# *FOR FULL LICENSE TEXT SEE LICENSES-MIT.TXT                                 *
+# *****************************************************************************
+"""
+Reassembly of single device frames into the result sets that are published by the zeroMQ servers.
+
+One result set of a measurement is, in device order:
+    - the histogram frames (only if raw histograms are enabled, 2/8/12 and twice as many in dual mode)
+    - the result frame sub-frame 0, and sub-frame 1 for 32x32 and 48x32 mode,
+      each optionally followed by its reference SPAD frame
+"""
+import __init__
+import logging
+import time
+from enum import IntEnum
+
+from tmf8829_application_defines import *
+from tmf8829_application_common import Tmf8829AppCommon
+
+logger = logging.getLogger(__name__)
+
+
+class ReassemblyPolicy(IntEnum):
+    """When is a result set published"""
+    STRICT       = 0    # only complete result sets (all histograms and all result sub-frames)
+    BEST_EFFORT  = 1    # incomplete result sets are published with the frames that arrived
+    RESULTS_ONLY = 2    # result frames are published as soon as all sub-frames are there,
+                        # histograms are published as an own set when all of them arrived
+
+
+class ResultSetAssembler:
+    """
+    Collects the frames of one result set. Result sub-frames are stored in a slot per sub-frame index,
+    histograms in arrival order. A set is closed when all result sub-frames are there, when a frame arrives
+    that cannot belong to the set anymore, or by a timeout (see flush).
+    Missing frames are counted per kind in lost, received frames that are not published in discarded,
+    result sets that are not published in incomplete_sets.
+    """
+
+    KINDS = ( "results", "histograms", "ref_spad", "dropped" )
+    """Counter names, dropped = frames the server lost before they reached the assembler"""
+
+    _KIND_OF_FID = { TMF8829_FID_RESULTS: "results", TMF8829_FID_HISTOGRAMS: "histograms", TMF8829_FID_REF_SPAD_SCAN: "ref_spad" }
+
+    def __init__(self, policy:ReassemblyPolicy = ReassemblyPolicy.STRICT, timeout:float = 1.0 ) -> None:
+        """
+        Args:
+            policy: when result sets are published
+            timeout: an open result set without new frames for this time in seconds is closed by flush
+        """
+        self.policy = policy
+        self.timeout = timeout
+        self.lost = dict.fromkeys( self.KINDS, 0 )
+        self.discarded = dict.fromkeys( self.KINDS, 0 )
+        self.incomplete_sets = 0
+        self.last_acquired = None                   # time.monotonic() of the first frame of the last result set given back
+        self.last_completed = None                  # time.monotonic() of the last frame of the last result set given back
+        self.configure( Tmf8829AppCommon.FP_MODE_8x8A, 0 )
+
+    def configure(self, fp_mode:int, histograms:int, dual_mode:int = 0 ) -> None:
+        """Set the expected content of a result set for the next measurement, clears the counters.
+        Args:
+            fp_mode: focal plane mode
+            histograms: raw histograms are dumped
+            dual_mode: dual mode is enabled
+        """
+        self._nr_subs = 2 if fp_mode > Tmf8829AppCommon.FP_MODE_16x16 else 1
+        self._nr_hists = Tmf8829AppCommon.numberOfFrameReadsPerMeasurement( fp_mode, histograms, dualMode=dual_mode ) - self._nr_subs
+        self._check_fnumber = not histograms    # without histograms the result frames have consecutive frame numbers
+        self._last_fnumber = None
+        self.resetCounters()
+        self.discard()
+
+    def resetCounters(self) -> None:
+        """Clear the lost and discarded counters."""
+        for _kind in self.KINDS:
+            self.lost[_kind] = 0
+            self.discarded[_kind] = 0
+        self.incomplete_sets = 0
+
+    def pendingFrames(self) -> int:
+        """Returns: number of frames in the open result set"""
+        return sum( len(_r) for _r in self._results if _r is not None ) + sum( len(_h) for _h in self._hists )
+
+    def lostTotal(self) -> int:
+        """Returns: number of lost frames of all kinds"""
+        return sum( self.lost.values() )
+
+    def countDropped(self, nr_frames:int ) -> None:
+        """Count frames that the server lost before they reached the assembler (e.g. a full queue).
+        Args:
+            nr_frames: number of lost frames
+        """
+        self.lost["dropped"] += nr_frames
+
+    def discard(self) -> None:
+        """Forget the open result set without publishing or counting it."""
+        self._results = [None] * self._nr_subs      # per sub-frame index: list of frames (result + ref spad)
+        self._result_fnumbers = [None] * self._nr_subs
+        self._hists = []                            # list of frames
+        self._hists_published = 0                   # histograms already published on their own (RESULTS_ONLY)
+        self._first_time = None
+        self._last_time = None
+
+    def add(self, frames:list, fid:int, sub:int, fnumber:int, now:float = None ) -> list:
+        """Add the frames of one device read.
+        Args:
+            frames: list of frames, the result/histogram frame optionally followed by its reference SPAD frame
+            fid: frame id of the first frame
+            sub: result sub-frame index or histogram layout
+            fnumber: frame number of the first frame
+            now: time of the read, defaults to time.monotonic()
+        Returns:
+            list of result sets to be published, each a list of frames
+        """
+        _out = []
+        _now = time.monotonic() if now is None else now
+        _kind = fid & TMF8829_FID_MASK
+        if _kind == TMF8829_FID_HISTOGRAMS:
+            if any( _r is not None for _r in self._results ) or len(self._hists) + self._hists_published >= self._nr_hists:
+                self._close( _out )                 # histograms of the next set
+            self._open( _now )
+            self._hists.append( frames )
+            if self.policy == ReassemblyPolicy.RESULTS_ONLY and len(self._hists) == self._nr_hists:
+                _out.append( [ _f for _h in self._hists for _f in _h ] )
+                self.last_acquired = self._first_time
+                self.last_completed = self._last_time
+                self._hists_published = len(self._hists)
+                self._hists = []
+        elif _kind == TMF8829_FID_RESULTS:
+            if self._check_fnumber:                 # missing result frames are counted from the frame number gaps
+                if self._last_fnumber is not None:
+                    _gap = (fnumber - self._last_fnumber - 1) & 0xFFFFFFFF
+                    if 0 < _gap < 0x80000000:
+                        logger.info( "missing {} result frame(s) fnumber={}, expected={}".format(_gap, fnumber, self._last_fnumber+1))
+                        self.lost["results"] += _gap
+                self._last_fnumber = fnumber
+            _sub = sub if sub < self._nr_subs else 0
+            if ( self._results[_sub] is not None                                                    # sub-frame again
+                 or any( _r is not None for _r in self._results[_sub+1:] )                          # sub-frame of the next set
+                 or ( _sub > 0 and self._results[_sub-1] is not None and self._result_fnumbers[_sub-1] != fnumber - 1 ) ):
+                self._close( _out )
+            self._open( _now )
+            self._results[_sub] = frames
+            self._result_fnumbers[_sub] = fnumber
+            if all( _r is not None for _r in self._results ):
+                self._close( _out )
+        else:
+            logger.info( "Frame id {} is not part of a result set".format(fid))
+        return _out
+
+    def flush(self, now:float = None ) -> list:
+        """Close the open result set if no frame was added for timeout seconds.
+        Args:
+            now: current time, defaults to time.monotonic()
+        Returns:
+            list of result sets to be published, each a list of frames
+        """
+        _out = []
+        if self._last_time is not None and (time.monotonic() if now is None else now) - self._last_time > self.timeout:
+            self._close( _out )
+        return _out
+
+    def _open(self, now:float ) -> None:
+        """Remember the time of the first and the last frame of the open result set."""
+        if self._last_time is None:
+            self._first_time = now
+        self._last_time = now
+
+    def _close(self, out:list ) -> None:
+        """Close the open result set, append it to out if the policy publishes it, count missing and discarded frames."""
+        if self._last_time is None:
+            return                                  # nothing open
+        _results_complete = all( _r is not None for _r in self._results )
+        _hists_complete = len(self._hists) + self._hists_published == self._nr_hists
+        _hists = [ _f for _h in self._hists for _f in _h ]
+        _results = [ _f for _r in self._results if _r is not None for _f in _r ]
+        if not self._check_fnumber:
+            self.lost["results"] += sum( 1 for _r in self._results if _r is None )
+        self.lost["histograms"] += self._nr_hists - len(self._hists) - self._hists_published
+        if self.policy == ReassemblyPolicy.BEST_EFFORT:
+            _publish, _drop = _hists + _results, []
+        elif self.policy == ReassemblyPolicy.RESULTS_ONLY:
+            _publish, _drop = (_results, _hists) if _results_complete else ([], _hists + _results)
+        elif _results_complete and _hists_complete:
+            _publish, _drop = _hists + _results, []
+        else:
+            _publish, _drop = [], _hists + _results
+        for _frame in _drop:
+            self.discarded[ self._frameKind(_frame) ] += 1
+        if _publish:
+            out.append( _publish )
+            self.last_acquired = self._first_time
+            self.last_completed = self._last_time
+        elif _drop:
+            self.incomplete_sets += 1
+            logger.info( "Incomplete result set discarded, {} frame(s)".format(len(_drop)))
+        self.discard()
+
+    @staticmethod
+    def _frameKind( frame ) -> str:
+        """Returns: counter name of the frame kind"""
+        return ResultSetAssembler._KIND_OF_FID.get( frame[Tmf8829AppCommon.PRE_HEADER_SIZE] & TMF8829_FID_MASK, "dropped" )
@@ -0,0 +1,81 @@
+# *****************************************************************************
+# * Copyright by ams OSRAM AG                                                 *
+# * All rights are reserved.                                                  *
+# *                                                                           *
+# *FOR FULL LICENSE TEXT SEE LICENSES-MIT.TXT                                 *
+# *****************************************************************************
+"""
+Replay buffer of the zeroMQ servers. The last published result sets are kept, a client that connects
+during a measurement reads them with the request GET_REPLAY.
+"""
+from collections import deque
+from threading import Lock
+
+
+class ReplayBuffer:
+    """Ring buffer of result sets, bounded by the number of sets and by the number of bytes."""
+
+    def __init__(self, max_sets:int = 16, max_bytes:int = 8*1024*1024 ) -> None:
+        """
+        Args:
+            max_sets: maximum number of result sets, 0 disables the buffer
+            max_bytes: maximum number of bytes of all result sets (headers and frames)
+        """
+        self._lock = Lock()
+        self._sets = deque()            # (sequence, container header, list of frames, size)
+        self._bytes = 0
+        self.resize( max_sets, max_bytes )
+
+    def resize(self, max_sets:int, max_bytes:int ) -> None:
+        """Change the limits, the oldest result sets are removed if needed.
+        Args:
+            max_sets: maximum number of result sets, 0 disables the buffer
+            max_bytes: maximum number of bytes of all result sets
+        """
+        with self._lock:
+            self.max_sets = max_sets
+            self.max_bytes = max_bytes
+            self._trim()
+
+    def _trim(self) -> None:
+        """Remove the oldest sets until the limits are met. Called with the lock held."""
+        while self._sets and ( len(self._sets) > self.max_sets or self._bytes > self.max_bytes ):
+            self._bytes -= self._sets.popleft()[3]
+
+    def add(self, sequence:int, header, frames:list ) -> None:
+        """Keep a result set. The frames are not copied, they must not be modified afterwards.
+        Args:
+            sequence: result set sequence number
+            header: container header of the whole set
+            frames: list of frames
+        """
+        if self.max_sets == 0:
+            return
+        _size = len(header) + sum( len(_frame) for _frame in frames )
+        with self._lock:
+            self._sets.append( (sequence, header, frames, _size) )
+            self._bytes += _size
+            self._trim()
+
+    def clear(self) -> None:
+        """Remove all result sets."""
+        with self._lock:
+            self._sets.clear()
+            self._bytes = 0
+
+    def get(self, since:int = 0, max_sets:int = 0 ) -> list:
+        """Return the kept result sets, the oldest first.
+        Args:
+            since: only sets with a higher sequence number, 0 for all
+            max_sets: only the newest max_sets sets, 0 for all
+        Returns:
+            list of (sequence, container header, list of frames)
+        """
+        with self._lock:
+            _sets = [ (_seq, _header, _frames) for _seq, _header, _frames, _size in self._sets if _seq > since ]
+        if max_sets:
+            _sets = _sets[-max_sets:]
+        return _sets
+
+    def __len__(self) -> int:
+        return len(self._sets)
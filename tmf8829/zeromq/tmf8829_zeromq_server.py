@@ -31,7 +31,7 @@ class ZeroMqEVMServer(ZeroMqServer):
     to allow to configure the device.
     The data socket provides unidirectional measurement results and optional histograms.
     """
-    VERSION = 0x0004
+    VERSION = 0x0007
     """Version 
     - 1 First zeromq server release version
     - 2 Second zeromq server release version
@@ -39,6 +39,9 @@ class ZeroMqEVMServer(ZeroMqServer):
     - 3 Dual mode support
     -   EVM Version 2.2.5 Set wakeup with startup  
     - 4 for standby timed mode: check in stop measurement if device is Wakeup
+    - 5 set configuration writes only the changed registers of the config page
+    - 6 result sets are built by the ResultSetAssembler of the server core
+    - 7 frame reads are counted in the statistics
     """
 
     APPLICATION_ID = 0x01
@@ -52,6 +55,7 @@ class ZeroMqEVMServer(ZeroMqServer):
         self._use_spi = use_spi
         self.hostType = TMF8829_ZEROMQ_HOST_H5_BOARD 
         self._hex_file = hex_file
+        self._config_page = None        # last configuration page read from/written to the device, None if unknown
 
 
     # publisher socket == result frame handling -------------------------------------
@@ -63,43 +67,34 @@ class ZeroMqEVMServer(ZeroMqServer):
         """
         if self._meas_running:
             _readFrame, _readRefFrame = self.app.readFramesIfAvailable()
+            if _readFrame:
+                self.stats.countBus( len(_readFrame) + (len(_readRefFrame) if _readRefFrame else 0), 2 if _readRefFrame else 1 )
             result, fid, sub_idx, fnumber = self._readSingleResult(_readFrame, _readRefFrame) 
-            if self._best_effort_results:
-                result = self._bestEffortResults(result, fid, sub_idx, fnumber, self.app.cfg_histograms )
-            else:   # only send complete result sets
-                result = self._removeIncompleteResults(result, fid, sub_idx, fnumber, self.app.cfg_histograms)
-            if result:
-                self._result += result
-                self._nr_subframes += 1
-                if self._nr_subframes == self.nr_results:                   # zeroMQ packet is complete (all results + histograms)
-                    res_to_send = self._buildResultSet( self._result )
-                    self._result_socket.send(bytes(res_to_send))
-                    logger.debug("Result frame sent.")
-                    #print( "{} sent".format(fnumber))
-                    self._newFrame()
+            self._assembleResult(result, fid, sub_idx, fnumber)
     
 
     # service routines to configure and communicate with the TMF8829 --------------------------------------
 
     def writeConfigurationPage(self, config_data: bytearray) -> int:
         """Read the config page from the device change it and write it back.
+        If the device content of the config page is known, only the changed registers are written.
         Args:
             config_data (bytearray): page to be written
         Returns:
             int - status of write
         """
         self.app.sendCommand( Tmf8829AppRegs.TMF8829_CMD_STAT._cmd_stat._CMD_LOAD_CONFIG_PAGE ) # load the config page.
-        val = self.app.hal.tx([Tmf8829ConfigRegs.TMF8829_CFG_PERIOD_MS_LSB.addr],config_data)  # Now write the data via I2C.
+        if self._config_page is not None and len(config_data) == len(self._config_page):
+            for _addr, _data in Tmf8829ConfigCodec.writeDiff( self._config_page, config_data ):    # only the changed registers
+                self.app.hal.tx([_addr],_data)
+        else:
+            self.app.hal.tx([Tmf8829ConfigRegs.TMF8829_CFG_PERIOD_MS_LSB.addr],config_data)  # Now write the data via I2C.
         resp = self.app.sendCommand( Tmf8829AppRegs.TMF8829_CMD_STAT._cmd_stat._CMD_WRITE_PAGE )
-        self.app.cfg_fpMode = (config_data[Tmf8829ConfigRegs.TMF8829_CFG_FP_MODE.addr-Tmf8829ConfigRegs.TMF8829_CFG_PERIOD_MS_LSB.addr]
-                          & Tmf8829ConfigRegs.TMF8829_CFG_FP_MODE._fp_mode.mask) >> Tmf8829ConfigRegs.TMF8829_CFG_FP_MODE._fp_mode.shift
-        self.app.cfg_resultFormat = config_data[Tmf8829ConfigRegs.TMF8829_CFG_RESULT_FORMAT.addr - Tmf8829ConfigRegs.TMF8829_CFG_PERIOD_MS_LSB.addr]
-        self.app.cfg_histograms = (config_data[Tmf8829ConfigRegs.TMF8829_CFG_DUMP_HISTOGRAMS.addr-Tmf8829ConfigRegs.TMF8829_CFG_PERIOD_MS_LSB.addr] \
-                              & Tmf8829ConfigRegs.TMF8829_CFG_DUMP_HISTOGRAMS._histograms.mask) >> Tmf8829ConfigRegs.TMF8829_CFG_DUMP_HISTOGRAMS._histograms.shift
-        self.app.cfg_refFrame = (config_data[Tmf8829ConfigRegs.TMF8829_CFG_REF_SPAD_FRAME.addr-Tmf8829ConfigRegs.TMF8829_CFG_PERIOD_MS_LSB.addr]
-                            & Tmf8829ConfigRegs.TMF8829_CFG_REF_SPAD_FRAME._publish.mask) >> Tmf8829ConfigRegs.TMF8829_CFG_REF_SPAD_FRAME._publish.shift
-        self.app.cfg_dualMode = (config_data[Tmf8829ConfigRegs.TMF8829_CFG_ENABLE_DUAL_MODE.addr-Tmf8829ConfigRegs.TMF8829_CFG_PERIOD_MS_LSB.addr]
-                            & Tmf8829ConfigRegs.TMF8829_CFG_ENABLE_DUAL_MODE._dual_mode.mask) >> Tmf8829ConfigRegs.TMF8829_CFG_ENABLE_DUAL_MODE._dual_mode.shift
+        if resp[0] == Tmf8829AppRegs.TMF8829_CMD_STAT._cmd_stat._STAT_OK and len(config_data) == Tmf8829ConfigCodec.PAGE_SIZE:
+            self._config_page = bytes(config_data)
+        else:
+            self._config_page = None        # device content unknown, next write is a full page write
+        self.app.updateCfgFromPage( config_data )
         return resp[0]   # status only
 
     def _reset_device(self) -> None:
@@ -117,6 +112,7 @@ class ZeroMqEVMServer(ZeroMqServer):
         """
         Open the device connection.
         """
+        self._config_page = None
         if not self.app.open( speed=self._speed):
             raise Exception("ERROR no communication, exiting") 
         self.app.disable()
@@ -164,10 +160,10 @@ class ZeroMqEVMServer(ZeroMqServer):
                 self.app.sendCommand( cmd=precmd )
 
             _cfg_bytes = self.get_configuration()                                       # get configuration as a bytestream from device
-            _cfg_dict = RegConv.readPageToDict(_cfg_bytes, Tmf8829ConfigRegs())         # convert bytestream to dictionary
+            _cfg_dict = Tmf8829ConfigCodec.decode(_cfg_bytes)                           # convert bytestream to dictionary
             if "measure_cfg" in self.cfg_dict:
                 Tmf8829Logger.patch_dict( _cfg_dict, self.cfg_dict["measure_cfg"] )    # external read config overwrites default config
-                _cfg_bytes2 = RegConv.readDictToPage( _cfg_dict, Tmf8829ConfigRegs())   # bytearray
+                _cfg_bytes2 = Tmf8829ConfigCodec.encode( _cfg_dict, _cfg_bytes )        # bytes
                 self.set_configuration( _cfg_bytes2 )
 
     def _close_communication_to_device(self) -> None: 
@@ -185,13 +181,7 @@ class ZeroMqEVMServer(ZeroMqServer):
         Start measurement.
         """
         logger.debug("Enter Start measurement")
-        self.nr_results = self.app.numberOfFrameReadsPerMeasurement(fpMode=self.app.cfg_fpMode, \
-                                                                    rawHistograms=self.app.cfg_histograms, \
-                                                                    dualMode= self.app.cfg_dualMode)
-        self._nr_subframes = 0
-        self._result = bytearray()
-        self._res_fnumber = -1        
-        self.lost_results = 0
+        self._assembler.configure(fp_mode=self.app.cfg_fpMode, histograms=self.app.cfg_histograms, dual_mode=self.app.cfg_dualMode)
         resp = self.app.startMeasure()
         if resp[0] <= Tmf8829AppRegs.TMF8829_CMD_STAT._cmd_stat._STAT_ACCEPTED:
             logger.info( "Start measurement" )
@@ -212,11 +202,10 @@ class ZeroMqEVMServer(ZeroMqServer):
         else:
             raise Tmf8829zeroMQRequestError("Failed to stop measurement")
         self._meas_running = False
-        self._nr_subframes = 0
-        self._result = bytearray()
+        self._assembler.discard()
         logger.info("{} Result processing stopped.".format(time.time()))
-        logger.info("Number lost result frames are at least {}".format(self.lost_results))
-        self.lost_results = 0
+        logger.info("Number lost frames are at least {} {}".format(self.lost_results, self._assembler.lost))
+        self._assembler.resetCounters()
         return self._meas_running
 
     def get_configuration(self) -> bytes:
@@ -227,6 +216,7 @@ class ZeroMqEVMServer(ZeroMqServer):
         """
         logger.debug("Get Device configuration")
         config_data = self.app.loadConfig()
+        self._config_page = bytes(config_data)
         return config_data
 
     def set_configuration(self, configPagebytes:bytes) -> None:
@@ -238,7 +228,7 @@ class ZeroMqEVMServer(ZeroMqServer):
             CommandError: Get Configuration failed
         """
         logger.debug("Set Device configuration")
-        print( RegConv.readPageToDict(configPagebytes,Tmf8829ConfigRegs()))
+        print( Tmf8829ConfigCodec.decode(configPagebytes))
         resp = self.writeConfigurationPage(configPagebytes)
         if resp != Tmf8829AppRegs.TMF8829_CMD_STAT._cmd_stat._STAT_OK:
             raise Tmf8829zeroMQRequestError("Failed to set Configuration")
@@ -252,7 +242,7 @@ class ZeroMqEVMServer(ZeroMqServer):
             CommandError: Get Configuration failed
         """
         logger.debug("Set Device Pre configuration")
-                    
+        self._config_page = None        # pre configuration changes the config page in the device
         resp = self.app.sendCommand(cmd= int(cmd[0]))
         if resp[0] != Tmf8829AppRegs.TMF8829_CMD_STAT._cmd_stat._STAT_OK:
             raise Tmf8829zeroMQRequestError("Failed to set Pre Configuration command")
@@ -293,7 +283,18 @@ if __name__ == "__main__":
         
     server = ZeroMqEVMServer( use_spi=True, cfg_dict=cfg_dict,hex_file=HEX_FILE)
 
-    server.start()
+    for _arg in sys.argv:
+        if _arg.startswith("--sndhwm="):                            # high water mark of the result socket
+            server.set_send_hwm( int(_arg.split("=")[1]) )
+    server.set_point_cloud_stream( "--point-cloud" in sys.argv )
+    if "--shared-memory" in sys.argv:
+        server.set_shared_memory( 8 )
+    if "--compress-histograms" in sys.argv:
+        server.set_compression( TMF8829_ZEROMQ_TOPIC_HISTOGRAMS, Tmf8829zeroMQCompression.LZ4 if compressionAvailable(Tmf8829zeroMQCompression.LZ4) else Tmf8829zeroMQCompression.ZLIB )
+    _ipc = "--ipc" in sys.argv                                      # additional endpoints for clients on this host
+    server.start( cmd_addr=[TMF8829_ZEROMQ_CMD_SERVER_ADDR] + ([ipcAddress(TMF8829_ZEROMQ_CMD_SERVER_ADDR)] if _ipc else []),
+                  result_addr=[TMF8829_ZEROMQ_RESULT_SERVER_ADDR] + ([ipcAddress(TMF8829_ZEROMQ_RESULT_SERVER_ADDR)] if _ipc else []),
+                  threaded="--threaded" in sys.argv )
 
     try:
         while True:
@@ -6,12 +6,22 @@
 # *****************************************************************************
 """
 ZeroMQ server for the tmf8829 arduino driver
+
+The driver sends result frames either as ASCII lines "#Obj ... b0,b1,b2,..." with decimal bytes, or as
+binary frames:
+    2 bytes  sync 0xA5 0x5A (cannot be the start of an ASCII line)
+    2 bytes  payload length, little endian
+    n bytes  payload = result or histogram frame
+    4 bytes  crc32 of the payload, little endian
+Both formats are accepted at any time, so older firmware keeps working.
 """
 from tmf8829_zeromq_server_core import *
+import zlib
+import numpy as np
 from serial import Serial
 from serial.tools import list_ports
 from enum import Enum
-from queue import Empty, Queue
+from queue import Empty, Full, Queue
 from threading import Thread
 from typing import  List
 from time import sleep
@@ -58,6 +68,13 @@ class ResultId:
     DISTANCE = b"#Obj"
     ERROR    = b"#Err"
 
+BINARY_FRAME_SYNC        = b'\xA5\x5A'
+BINARY_FRAME_HEADER_SIZE = 4            # sync + payload length
+BINARY_FRAME_CRC_SIZE    = 4
+SERIAL_READ_SIZE         = 0x10000      # reusable receive buffer of the reader thread
+FRAME_QUEUE_SIZE         = 16           # frames buffered between reader thread and publisher, oldest are dropped
+FRAME_WAIT_TIMEOUT       = 0.01         # maximum wait in seconds for a new frame in _process_results
+
 class ZeroMqArduinoServer(ZeroMqServer):
     """
     The server provides a command and a data socket. The command socket is bi-directional
@@ -65,10 +82,13 @@ class ZeroMqArduinoServer(ZeroMqServer):
     The data socket provides unidirectional measurement results and optional histograms.
     Server for TMF8829 Arduino Driver.
     """
-    VERSION = 0x0001
+    VERSION = 0x0004
     """Version 
     - 1 First zeromq server release version
-    -
+    - 2 binary framed results, frames are queued instead of overwritten
+    - 3 result sets are built by the ResultSetAssembler of the server core
+    - 4 serial counters in the statistics
+        bounded frame queue, dropped frames are counted as lost results
     """
     APPLICATION_ID = 0x01
     BOOTLOADER_ID = 0x80
@@ -84,7 +104,11 @@ class ZeroMqArduinoServer(ZeroMqServer):
         self.fpMode = 0
         self.rawHistograms = 0
         self.hostType = TMF8829_ZEROMQ_HOST_ARDUINO_BOARD
-        self._result_object = bytearray()
+        self._frames = Queue(maxsize=FRAME_QUEUE_SIZE) # frames decoded by the reader thread
+        self.dropped_frames = 0             # frames dropped because the queue was full, written by the reader thread only
+        self._dropped_frames_counted = 0    # part of dropped_frames already added to lost_results
+        self.crc_errors = 0                 # binary frames dropped because of a wrong checksum
+        self.line_errors = 0                # ASCII result lines dropped because they could not be converted
 
     @staticmethod
     def print_connected_com_ports():
@@ -115,6 +139,19 @@ class ZeroMqArduinoServer(ZeroMqServer):
             
         return dl
     
+    def get_stats(self) -> dict:
+        """
+        Return the statistics of the server including the serial link counters.
+        Returns:
+            dictionary that can be serialized to json
+        """
+        _stats = super().get_stats()
+        _stats["crc_errors"] = self.crc_errors
+        _stats["line_errors"] = self.line_errors
+        _stats["dropped_frames"] = self.dropped_frames
+        _stats["queue_depth"]["frames"] = self._frames.qsize()
+        return _stats
+
     def _clear_queue(self, queue: Queue) -> None:
         """
         Discard all queue items.
@@ -128,29 +165,110 @@ class ZeroMqArduinoServer(ZeroMqServer):
             except Empty:
                 break
 
+    @staticmethod
+    def _parse_ascii_frame(line: bytes) -> bytes:
+        """
+        Convert a result line with comma separated decimal bytes into the frame. The numbers are converted
+        by numpy in one call, not byte by byte. Empty fields are skipped.
+
+        Args:
+            line: "#Obj ... b0,b1,b2,..."
+
+        Returns:
+            the frame bytes
+
+        Raises:
+            ValueError, OverflowError: a field is no number from 0 to 255
+        """
+        _fields = line.split()[-1].split(b',')
+        if b'' in _fields:
+            _fields = [ _field for _field in _fields if _field ]
+        return np.array( _fields, dtype=np.uint8 ).tobytes()
+
+    def _queue_frame(self, frame: bytes) -> None:
+        """
+        Hand a frame over to the publisher. If the queue is full the oldest frame is dropped and counted.
+
+        Args:
+            frame: the frame bytes
+        """
+        while True:
+            try:
+                self._frames.put_nowait(frame)
+                return
+            except Full:
+                try:
+                    self._frames.get_nowait()
+                    self.dropped_frames += 1
+                except Empty:
+                    pass
+
+    def _process_line(self, line: bytes) -> None:
+        """
+        Process one ASCII line from the serial port.
+
+        Args:
+            line: stripped line
+        """
+        if line:
+            # logger.debug("->: %s", line)
+            if line.startswith(ResultId.CONFIG):
+                self._cmd_resp_lines.put(line)
+            elif line.startswith(ResultId.DISTANCE):
+                try:
+                    _frame = self._parse_ascii_frame(line)
+                except (ValueError, OverflowError) as exc:  # one bad line must not stop the reader thread
+                    self.line_errors += 1
+                    logger.error("Result line dropped: {}".format(exc))
+                    return
+                self._queue_frame( _frame )
+            elif line.startswith(ResultId.ERROR):
+                self._cmd_resp_lines.put(line)
+            elif line.startswith(b'#'):
+                pass
+            else:
+                self._cmd_resp_lines.put(line)
+
     def _process_input_data(self):
-        """Read data from the serial port and process them."""
+        """Read data from the serial port and process them. ASCII lines and binary frames can be mixed."""
+        _buffer = bytearray(SERIAL_READ_SIZE)
+        _view = memoryview(_buffer)
+        _rx = bytearray()
         try:
             while not self._abort:
-                line = self._com.readline().strip()
-                if line:
-                    # logger.debug("->: %s", line)
-                    if line.startswith(ResultId.CONFIG):
-                        self._cmd_resp_lines.put(line)
-                    elif line.startswith(ResultId.DISTANCE):
-                        values = line.split()[-1].split(b',')
-                        result_driver = []
-                        for val in values:
-                            if val != b'':
-                                result_driver.append(int(val,base=10))
-                        self._result_object = bytearray(result_driver)
-                        #logger.debug(" _process_input_data: {}".format(len(self._result_object)))
-                    elif line.startswith(ResultId.ERROR):
-                        self._cmd_resp_lines.put(line)
-                    elif line.startswith(b'#'):
-                        pass
+                _size = self._com.readinto( _view[:max(1, min(self._com.in_waiting, SERIAL_READ_SIZE))] )
+                if not _size:
+                    continue
+                self.stats.countBus( _size )
+                _rx += _view[:_size]
+                _pos = 0
+                while _pos < len(_rx):
+                    if _rx.startswith(BINARY_FRAME_SYNC, _pos):
+                        if len(_rx) - _pos < BINARY_FRAME_HEADER_SIZE:
+                            break
+                        _start = _pos + BINARY_FRAME_HEADER_SIZE
+                        _end = _start + int.from_bytes(_rx[_pos+2:_start], byteorder='little', signed=False)
+                        if len(_rx) < _end + BINARY_FRAME_CRC_SIZE:
+                            break                                       # wait for the rest of the frame
+                        _frame = bytes(_rx[_start:_end])
+                        if zlib.crc32(_frame) == int.from_bytes(_rx[_end:_end+BINARY_FRAME_CRC_SIZE], byteorder='little', signed=False):
+                            self._queue_frame(_frame)
+                            _pos = _end + BINARY_FRAME_CRC_SIZE
+                        else:
+                            self.crc_errors += 1
+                            logger.error("Binary frame with wrong checksum dropped")
+                            _pos += len(BINARY_FRAME_SYNC)              # re-synchronize after the sync bytes
                     else:
-                        self._cmd_resp_lines.put(line)
+                        _eol = _rx.find(b'\n', _pos)
+                        _sync = _rx.find(BINARY_FRAME_SYNC, _pos, len(_rx) if _eol < 0 else _eol)
+                        if _sync >= 0:
+                            _pos = _sync                                # ASCII lines never contain the sync, skip garbage
+                        elif _eol < 0:
+                            break                                       # wait for the rest of the line
+                        else:
+                            self._process_line( bytes(_rx[_pos:_eol]).strip() )
+                            _pos = _eol + 1
+                del _rx[:_pos]
 
         except Exception as exc:
             logger.error(exc)
@@ -204,27 +322,35 @@ class ZeroMqArduinoServer(ZeroMqServer):
         result frames and adds this result to the internally stored result structure. As soon as 
         all result frames for one measurement are available an zeroMQ result-frame is published.
         """
-        if (self._meas_running) and ( len(self._result_object) >= 1 ):
+        _timeout = FRAME_WAIT_TIMEOUT                   # wake up as soon as the first frame is there
+        while self._meas_running:
+            try:
+                frame = self._frames.get(timeout=_timeout)
+            except Empty:
+                break
+            _timeout = 0                                # then take all that are queued
+            self._reassemble(frame)
 
-            frame = self._result_object
+    def _reassemble(self, frame: bytes) -> None:
+        """
+        Add one frame to the result set assembler. Frames dropped by the reader thread are counted
+        as dropped and the set collected so far is discarded.
 
-            result, fid, sub_idx, fnumber = self._readSingleResult(frame, None) 
+        Args:
+            frame: the frame bytes
+        """
+        _dropped = self.dropped_frames - self._dropped_frames_counted
+        if _dropped:
+            logger.info("{} frame(s) dropped, frame queue full".format(_dropped))
+            self._dropped_frames_counted += _dropped
+            self._assembler.discard()
+            self._assembler.countDropped(_dropped)
 
-            logger.debug("frame number: {} with len {}".format(fnumber, len(self._result_object)))
-            self._result_object = bytearray()
+        result, fid, sub_idx, fnumber = self._readSingleResult(frame, None) 
 
-            result = self._removeIncompleteResults(result, fid, sub_idx, fnumber, self.rawHistograms)
+        logger.debug("frame number: {} with len {}".format(fnumber, len(frame)))
 
-            if result:
-                self._result += result
-                self._nr_subframes += 1
-                #logger.debug("one subset _nr_subset {} nr_results {}".format(self._nr_subframes,self.nr_results ))
-                # zeroMQ packet is complete (all results + histograms)
-                if self._nr_subframes == self.nr_results:  
-                    res_to_send = self._buildResultSet( self._result )
-                    self._result_socket.send(bytes(res_to_send))
-                    logger.debug("Result Set send")
-                    self._newFrame()
+        self._assembleResult(result, fid, sub_idx, fnumber)
 
     # service routines to configure and communicate with the TMF8829 
     def _open_communication_to_device(self) -> None:
@@ -295,13 +421,9 @@ class ZeroMqArduinoServer(ZeroMqServer):
         """
 
         logger.debug("Enter Start measurement")
-        self.nr_results = Tmf8829AppCommon.numberOfFrameReadsPerMeasurement(self.fpMode,self.rawHistograms)
-        logger.debug(" {} frames for a complete result set".format(self.nr_results))
-        self._nr_subframes = 0
-        self._result = bytearray()
-        self._result_object = bytearray()
-        self._res_fnumber = -1
-        self.lost_results = 0
+        self._assembler.configure(fp_mode=self.fpMode, histograms=self.rawHistograms)
+        self._clear_queue(self._frames)
+        self._dropped_frames_counted = self.dropped_frames
         
         try:
             self._send_command(Commands.START_MEAS)
@@ -329,17 +451,16 @@ class ZeroMqArduinoServer(ZeroMqServer):
             state = FwStates.UNKNOWN.value
 
         self._meas_running = False
-        self._nr_subframes = 0
-        self._result = bytearray()
-        self.lost_results = 0
+        self._assembler.discard()
 
         if state == FwStates.STOPPED.value:
           logger.info("{} Result processing stopped.".format(time.time()))
-          logger.info("Number lost result frames are at least {}".format(self.lost_results))
+          logger.info("Number lost frames are at least {} {}".format(self.lost_results, self._assembler.lost))
         else:
             logger.info("Stop the measurement FAILED. Re-open com!!!")
             self._reopen_communication_to_device
 
+        self._assembler.resetCounters()
         return self._meas_running
 
     def get_configuration(self) -> bytes:
@@ -364,7 +485,7 @@ class ZeroMqArduinoServer(ZeroMqServer):
                     configuration.append(int(val,base=16))
             
             if len(configuration) >=1:
-                _cfg_dict = RegConv.readPageToDict(bytes(configuration),Tmf8829ConfigRegs())
+                _cfg_dict = Tmf8829ConfigCodec.decode(configuration)
                 logger.info( _cfg_dict)
                 self.fpMode =_cfg_dict["fp_mode"]
                 self.rawHistograms =_cfg_dict["histograms"]
@@ -396,7 +517,7 @@ class ZeroMqArduinoServer(ZeroMqServer):
                 else:
                     pass
                 
-            _cfg_dict = RegConv.readPageToDict(bytes(configuration),Tmf8829ConfigRegs())
+            _cfg_dict = Tmf8829ConfigCodec.decode(configuration)
             logger.info( _cfg_dict)
             self.fpMode =_cfg_dict["fp_mode"]
             self.rawHistograms =_cfg_dict["histograms"]
@@ -437,6 +558,7 @@ class ZeroMqArduinoServer(ZeroMqServer):
 #####################################################################################
 
 if __name__ == "__main__":
+    import sys
 
     BAUDRATE=2000000
 
@@ -454,7 +576,17 @@ if __name__ == "__main__":
 
     if len(com_port) >= 1: 
         server = ZeroMqArduinoServer(port= com_port[0], cmd_poll_interval = 0.01, baudrate=BAUDRATE)
-        server.start(cmd_addr= TMF8829_ZEROMQ_CMD_SERVER_ADDR, result_addr=TMF8829_ZEROMQ_RESULT_SERVER_ADDR)
+        for _arg in sys.argv:
+            if _arg.startswith("--sndhwm="):                            # high water mark of the result socket
+                server.set_send_hwm( int(_arg.split("=")[1]) )
+        server.set_point_cloud_stream( "--point-cloud" in sys.argv )
+        if "--shared-memory" in sys.argv:
+            server.set_shared_memory( 8 )
+        if "--compress-histograms" in sys.argv:
+            server.set_compression( TMF8829_ZEROMQ_TOPIC_HISTOGRAMS, Tmf8829zeroMQCompression.LZ4 if compressionAvailable(Tmf8829zeroMQCompression.LZ4) else Tmf8829zeroMQCompression.ZLIB )
+        _ipc = "--ipc" in sys.argv                                  # additional endpoints for clients on this host
+        server.start(cmd_addr= [TMF8829_ZEROMQ_CMD_SERVER_ADDR] + ([ipcAddress(TMF8829_ZEROMQ_CMD_SERVER_ADDR)] if _ipc else []),
+                     result_addr=[TMF8829_ZEROMQ_RESULT_SERVER_ADDR] + ([ipcAddress(TMF8829_ZEROMQ_RESULT_SERVER_ADDR)] if _ipc else []), threaded="--threaded" in sys.argv)
         try:
             while True:
                 server.process()
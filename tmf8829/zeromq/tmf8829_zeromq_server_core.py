@@ -8,12 +8,16 @@
 ZeroMQ server.
 """
 import __init__
+import json
 import logging
 import time
 import pathlib
 import ctypes
 import random
 import zmq
+from queue import Empty, Full, Queue
+from threading import Thread, Event
+from concurrent.futures import Future
 
 from tmf8829_application_defines import *
 from tmf8829_application_registers import Tmf8829_application_registers as Tmf8829AppRegs
@@ -23,8 +27,12 @@ from tmf8829_config_page import Tmf8829_config_page as Tmf8829ConfigRegs
 
 from tmf8829_application_common import Tmf8829AppCommon
 from register_page_converter import RegisterPageConverter as RegConv
+from tmf8829_config_codec import Tmf8829ConfigCodec
 
 from zeromq.tmf8829_zeromq_common import *
+from zeromq.tmf8829_zeromq_reassembly import ReassemblyPolicy, ResultSetAssembler
+from zeromq.tmf8829_zeromq_stats import ServerStatistics
+from zeromq.tmf8829_zeromq_replay import ReplayBuffer
 
 LOG_FORMAT = '%(asctime)s %(message)s'
 logging.basicConfig(level=logging.DEBUG,format=LOG_FORMAT)
@@ -34,18 +42,34 @@ class ZeroMqServer:
     """
     The Base class for a zeroMq-Server. provides a command and a data socket.
     """
-    VERSION = 0x0003
+    VERSION = 0x0010
     """Version 
     - 1 First zeromq server release version
     - 2 Second zeromq server release version
         SET_PRE_CONFIGURATION added
     - 3 Third zeromq server release version
         EVM Version reported
+    - 4 result sets are published as multipart messages (container header + frames) without copies
+    - 5 threaded mode: acquisition, publisher and command handling run in separate threads
+    - 6 one reassembly engine (ResultSetAssembler) for all servers, lost frames counted per kind
+    - 7 results, histograms and reference SPAD frames are published on separate topics
+    - 8 optional decoded point cloud stream, decoded by a worker thread
+    - 9 optional compression per topic (SET_COMPRESSION)
+    - 10 statistics (GET_STATS)
+    - 11 protocol version 3: acquisition and publish time, set sequence number in the container header
+    - 12 replay buffer of the last result sets (GET_REPLAY)
+    - 13 SELECT_DEVICE and topic prefix, a server can be one device of a ZeroMqMultiServer
+    - 14 optional shared memory ring of the result sets for clients on the same host (GET_SHARED_MEMORY)
+    - 15 several endpoints (tcp, ipc, inproc) per socket, advertised in the IDENTIFY response
+    - 16 set_send_hwm, high water mark of the result socket
     """
 
     APPLICATION_ID = 0x01
     BOOTLOADER_ID = 0x80
 
+    DECODE_QUEUE_SIZE = 4
+    """Result sets waiting for the point cloud decoder, further sets are not decoded"""
+
     def __init__(self, use_spi=True, spi_mode=0, cmd_poll_interval=1.0) -> None:
         self._context = zmq.Context()
         if use_spi:
@@ -56,16 +80,31 @@ class ZeroMqServer:
         self._cmd_socket = self._context.socket(zmq.REP)
         self._result_socket = self._context.socket(zmq.PUB)
         self._meas_running = False
-        self.lost_results = 0  
-        self._best_effort_results = False
+        self._assembler = ResultSetAssembler()                  # frames -> result sets, counts lost frames
+        self._compression = {}                                  # topic -> Tmf8829zeroMQCompression
+        self.stats = ServerStatistics()
+        self._replay = ReplayBuffer()                           # last published result sets for late joining clients
+        self.topic_prefix = b""                                 # prepended to all topics, set by a ZeroMqMultiServer
+        self._shm = None                                        # SharedMemoryRing of the result sets, if enabled
+        self.endpoints = None                                   # bound endpoints, see endpointInfo, reported by identify
         self._1st_client_id = TMF8829_ZEROMQ_CLIENT_NOT_IDENTIFIED
         self._cnt = 0
+        self._held_histograms = (0, [])                         # (sequence, frames) of histograms published before their results
         self._cmd_poll_interval = cmd_poll_interval             # poll every xxx milliseconds for a new command
         self._last_cmd_poll = time.time() - cmd_poll_interval   # force a first poll
-        self._newFrame()
-        self._last_fnumber = 0
-        self.nr_results = 0
-        self._nr_subframes = 0
+
+        self._threaded = False
+        self._threads = []
+        self._acquisition_thread = None
+        self._control_queue = Queue()                           # (future, function, args) executed by the acquisition thread
+        self._publish_queue = Queue()                           # complete result sets for the publisher thread
+        self._threads_stop = Event()
+        self._thread_error = None
+
+        self._decode_thread = None
+        self._decode_queue = None                               # (result frames, time) for the point cloud decoder
+        self._decoded_queue = Queue()                           # decoded messages, published by the acquisition loop
+        self.decode_dropped = 0                                 # result sets not decoded, decoder too slow
 
         random.seed()
         
@@ -132,6 +171,19 @@ class ZeroMqServer:
                     if self._meas_running:  _p = b'\x01'    # measure status
                     else:                   _p = b'\x00'
                     resp = Tmf8829zeroMQResponseMessage(client_id=_client_id,error_code=_error_code,payload=_p)
+                elif int(Tmf8829zeroMQRequestId.GET_STATS) == request.request_id:
+                    _stats = json.dumps( self.get_stats() ).encode()    # statistics are available for all clients
+                    resp = Tmf8829zeroMQResponseMessage(client_id=_client_id,error_code=_error_code, payload=_stats)
+                elif int(Tmf8829zeroMQRequestId.SELECT_DEVICE) == request.request_id:
+                    if request.payload[0] != 0:                         # a single device server has only device 0
+                        raise Tmf8829zeroMQRequestError("Device {} does not exist".format(request.payload[0]))
+                    resp = Tmf8829zeroMQResponseMessage(client_id=_client_id,error_code=_error_code, payload=b"\x01" + self.topic_prefix)
+                elif int(Tmf8829zeroMQRequestId.GET_SHARED_MEMORY) == request.request_id:
+                    resp = Tmf8829zeroMQResponseMessage(client_id=_client_id,error_code=_error_code, payload=self.get_shared_memory())
+                elif int(Tmf8829zeroMQRequestId.GET_REPLAY) == request.request_id:
+                    _since = int.from_bytes( request.payload[0:4], byteorder="little", signed=False )
+                    _max_sets = int.from_bytes( request.payload[4:6], byteorder="little", signed=False )
+                    resp = Tmf8829zeroMQResponseMessage(client_id=_client_id,error_code=_error_code, payload=self.get_replay(_since, _max_sets))
                 elif int(Tmf8829zeroMQRequestId.GET_CONFIGURATION) == request.request_id:
                     cfg = self.get_configuration()                      # read of configuration is possible for all clients!!!!!
                     if _client_id != self._1st_client_id: 
@@ -149,6 +201,12 @@ class ZeroMqServer:
                         resp = Tmf8829zeroMQResponseMessage(client_id=_client_id,error_code=_error_code,payload=b"\x01")
                     else:
                         resp = Tmf8829zeroMQResponseMessage(client_id=_client_id,error_code=Tmf8829zeroMQErrorCodes.NOT_CFG_CLIENT,payload=b"\x00")
+                elif int(Tmf8829zeroMQRequestId.SET_COMPRESSION) == request.request_id:
+                    if _client_id == self._1st_client_id:
+                        self.set_compression(bytes(request.payload[1:]), request.payload[0])
+                        resp = Tmf8829zeroMQResponseMessage(client_id=_client_id,error_code=_error_code,payload=b"\x01")
+                    else:
+                        resp = Tmf8829zeroMQResponseMessage(client_id=_client_id,error_code=Tmf8829zeroMQErrorCodes.NOT_CFG_CLIENT,payload=b"\x00")
                 elif int(Tmf8829zeroMQRequestId.UPDATE_BINARIES) == request.request_id:
                     if _client_id == self._1st_client_id:
                         self.update_target_binaries(zip_blob=request.payload)
@@ -167,91 +225,99 @@ class ZeroMqServer:
 
     # publisher socket == result frame handling -------------------------------------
 
-    def _newFrame(self):
-        """Function to reset internal structure for a new zeroMQ frame (result frames + histogram frames)"""
-        self._result = bytearray()                              
-        self._nr_subframes = 0
-        self._res_fnumber = -1
-        self._subs = [None]*2
-        self._subs_fnumber = [None]*2
+    def set_reassembly_policy(self, policy: ReassemblyPolicy, timeout: float = 1.0) -> None:
+        """
+        Select when result sets are published.
+        Args:
+            policy: STRICT (complete sets only), BEST_EFFORT or RESULTS_ONLY (histograms are published separately)
+            timeout: an incomplete result set is closed after this time without new frames
+        """
+        self._assembler.policy = policy
+        self._assembler.timeout = timeout
+
+    @property
+    def lost_results(self) -> int:
+        """Number of frames lost since the start of the measurement, all kinds (see self._assembler.lost)"""
+        return self._assembler.lostTotal()
 
-    def _removeIncompleteResults(self,result, fid, sub_idx, fnumber, raw_histograms):
-        """Function checks if the result data is complete (this is only meaningful for non-blocking mode
-            and for 32x32 or 48x32 modes where there are 2 result frames).
-            In all other cases the results are always single frames and are complete.
+    def _assembleResult(self, result, fid, sub_idx, fnumber):
+        """Add the frames of one read to the open result set and publish all result sets that are complete.
+        Args:
+            result: list of frames as returned by _readSingleResult
+            fid: frame ID
+            sub_idx: sub-frame number or histogram layout
+            fnumber: frame number
         """
         if result:
-            
-            if raw_histograms == 0:            # not in blocking mode -> in blocking mode no frames can get lost
-                if (fid & TMF8829_FID_MASK) == TMF8829_FID_RESULTS:
-                    if sub_idx == 0:                    # just store the frame number
-                        if self._res_fnumber != -1:     # duplicate result[0] without intermediate result[1] read
-                            print( "WARNING missing sub-frame 1 in result, fnumber={}, expected={}".format(fnumber, self._last_fnumber+1))
-                            self.lost_results += 1      # we missed one or more frame  
-                            self._newFrame()            # discard all previous results stored,
-                        elif (fnumber != self._last_fnumber + 1): # count missing frames for 8x8 and 16x16 modes
-                            print( "missing frame(s) fnumber={}, expected={}".format(fnumber, self._last_fnumber+1))
-                            self.lost_results += 1      # we missed one or more frame
-                        self._res_fnumber = fnumber     # replace with this newly read sub-frame 0
-                    elif sub_idx == 1:
-                        if self._res_fnumber == -1 or self._res_fnumber != fnumber-1:
-                            print( "WARNING missing sub-frame 1 and sub-frame 0 in result, fnumber={}, expected={}".format(fnumber, self._last_fnumber+1))
-                            self._result = bytearray()  # discard all previous results stored
-                            self.lost_results += 2      # we missed one or more frames  
-                            self._newFrame()            # discard all previous results stored
-                            result = None               # need to start collecting result frames again
-            elif raw_histograms:
-                if (fid & TMF8829_FID_MASK) == TMF8829_FID_RESULTS:
-                    fpMode = fid & TMF8829_FPM_MASK
-                    if (sub_idx == 0) and (fpMode <= Tmf8829AppCommon.FP_MODE_16x16):
-                        if self._nr_subframes != (self.nr_results-1): # if nr_of_subframes not correct, frame(s) is (are) lost
-                            print ("lost frame") 
-                            self._result = bytearray()  # discard all previous results stored
-                            self.lost_results += 1      # we missed one or more frames  
-                            self._newFrame()            # discard all previous results stored
-                            result = None               # need to start collecting result frames again
-                    elif sub_idx == 1:
-                        if self._nr_subframes != (self.nr_results-1): # if nr_of_subframes not correct, frame(s) is (are) lost
-                            print ("lost frame")
-                            self._result = bytearray()  # discard all previous results stored
-                            self.lost_results += 1      # we missed one or more frames  
-                            self._newFrame()            # discard all previous results stored
-                            result = None               # need to start collecting result frames again
-
-
-            self._last_fnumber = fnumber
-
-        return result                         
-
-    def _bestEffortResults(self, result, fid, sub_idx, fnumber, raw_histograms):
-        """Function checks if the result data is complete (this is only meaningful for non-blocking mode
-            and for 32x32 or 48x32 modes where there are 2 result frames).
-            In all other cases the results are always single frames and are complete.
+            for _set in self._assembler.add(result, fid, sub_idx, fnumber):
+                self._publishResultSet( _set, self._assembler.last_acquired, self._assembler.last_completed )
+
+    def _flushResults(self):
+        """Close a result set that did not get new frames for the timeout of the assembler,
+        publish the messages of the point cloud decoder."""
+        for _set in self._assembler.flush():
+            self._publishResultSet( _set, self._assembler.last_acquired, self._assembler.last_completed )
+        while True:
+            try:
+                self._publishMessage( self._decoded_queue.get_nowait() )
+            except Empty:
+                break
+
+    # decoded point cloud stream ------------------------------------------------------------------------
+
+    def set_point_cloud_stream(self, enable: bool) -> None:
         """
-        if result:
-            if raw_histograms == 0:            # not in blocking mode -> in blocking mode no frames can get lost
-                if (fid & TMF8829_FID_MASK) == TMF8829_FID_RESULTS:
-                    if self.nr_results == 2:
-                        if self._subs[sub_idx] != None:
-                            print( "WARNING FNumber={} is missing missing sub[{}], one frame is lost".format(self._subs_fnumber[sub_idx],1-sub_idx))
-                            self.lost_results += 1      # we missed one or more frame  
-                        self._subs[sub_idx] = result            # keep a copy
-                        self._subs_fnumber[sub_idx] = fnumber   # keep track which frame this is from
-                        result = None                           # do not give back if there is only 1 sub-frame
-                        if self._subs[0] != None and self._subs[1] != None:
-                            self._nr_subframes += 1             # internally combine the 2 sub-frames so we need to add one here
-                            result = self._subs[0] + self._subs[1]  # give back both at once.
-                            #print( "Result Sub[0].FNumber={} Sub[1].FNumber={}".format(self._subs_fnumber[0], self._subs_fnumber[1]))
-        return result                         
-
+        Enable the decoded point cloud stream (topic TMF8829_ZEROMQ_TOPIC_POINT_CLOUD). The result frames are
+        decoded once by a worker thread, so subscribers need not decode them. Needs numpy.
+        Args:
+            enable: True to start the decoder thread, False to stop it
+        """
+        if enable and self._decode_thread is None:
+            from zeromq.tmf8829_zeromq_point_cloud import Tmf8829PointCloudDecoder
+            self._decode_queue = Queue( maxsize=self.DECODE_QUEUE_SIZE )
+            self._decode_thread = Thread( target=self._decoderThread, args=(Tmf8829PointCloudDecoder, self._decode_queue),
+                                          name="tmf8829-decoder", daemon=True )
+            self._decode_thread.start()
+        elif not enable and self._decode_thread is not None:
+            self._decode_queue.put( None )
+            self._decode_thread.join()
+            self._decode_thread = None
+            self._decode_queue = None
+
+    def _decodeResultSet(self, frames):
+        """Hand the result frames of a set to the decoder thread, if the point cloud stream is enabled.
+        Args:
+            frames: list of result frames
+        """
+        if self._decode_queue is not None:
+            try:
+                self._decode_queue.put_nowait( (frames, time.time()) )
+            except Full:
+                self.decode_dropped += 1
+
+    def _decoderThread(self, decoder, frame_queue):
+        """Thread decodes result frames into point clouds, the messages are published by the acquisition loop.
+        Args:
+            decoder: Tmf8829PointCloudDecoder
+            frame_queue: queue of (result frames, time), None stops the thread
+        """
+        while True:
+            _item = frame_queue.get()
+            if _item is None:
+                return
+            try:
+                _header, _points = decoder.decode( *_item )
+            except Exception as exc:
+                logger.error("Point cloud decoding failed: {}".format(exc))
+                continue
+            self._decoded_queue.put( [ TMF8829_ZEROMQ_TOPIC_POINT_CLOUD ] + decoder.toParts( _header, _points ) )
 
-    
     def _readSingleResult(self, _readFrame, _readRefFrame):
         """Attempt to read in a result frame or (ref-result + result frame)
         Returns:
             list-of-frames, frame-ID, sub-frame-number, frame-number 
         """
-        _result = bytearray()
+        _result = []
         _sub = 0
         _fid = 0
         _fnumber = 0
@@ -268,46 +334,356 @@ class ZeroMqServer:
                 _sub = _header.layout
             
             _fnumber = _header.fNumber
-            _result += bytearray(_res_frame)
+            _result.append(_res_frame)                                          # own copy, is published without copying again
+            self.stats.countFrames( len(_res_frame) )
             #print( "Time={}, fnumber={}, sub={}".format(time.time(),_fnumber,_sub))
             if _readRefFrame:                                                    # ref frames + main result frame
-                _result += bytearray(_readRefFrame)                                     
+                _result.append(bytearray(_readRefFrame))
+                self.stats.countFrames( len(_readRefFrame) )
         return _result, _fid, _sub, _fnumber
 
-    def _buildResultSet(self, result ):
-        """ Function adds the zeroMQ header to the result frame """
+    _TOPIC_OF_FID = { TMF8829_FID_RESULTS: TMF8829_ZEROMQ_TOPIC_RESULTS,
+                      TMF8829_FID_HISTOGRAMS: TMF8829_ZEROMQ_TOPIC_HISTOGRAMS,
+                      TMF8829_FID_REF_SPAD_SCAN: TMF8829_ZEROMQ_TOPIC_REF_SPAD }
+
+    def _splitResultSet(self, result ):
+        """ Function sorts the frames of a result set by topic
+        Args:
+            result: list of frames
+        Returns:
+            list of (topic, list of frames) in the order of TMF8829_ZEROMQ_TOPICS_FRAMES, only topics with frames
+        """
+        _frames = { _topic: [] for _topic in TMF8829_ZEROMQ_TOPICS_FRAMES }
+        for _frame in result:
+            _frames[ self._TOPIC_OF_FID.get( _frame[Tmf8829AppCommon.PRE_HEADER_SIZE] & TMF8829_FID_MASK, TMF8829_ZEROMQ_TOPIC_RESULTS ) ].append( _frame )
+        return [ (_topic, _frames[_topic]) for _topic in TMF8829_ZEROMQ_TOPICS_FRAMES if _frames[_topic] ]
+
+    def set_compression(self, topic: bytes, compression: int) -> None:
+        """
+        Select the compression of the messages of a topic, the client decompresses them transparently.
+        Args:
+            topic: TMF8829_ZEROMQ_TOPIC_RESULTS, TMF8829_ZEROMQ_TOPIC_HISTOGRAMS or TMF8829_ZEROMQ_TOPIC_REF_SPAD
+            compression: Tmf8829zeroMQCompression
+        """
+        compression = Tmf8829zeroMQCompression(compression)
+        if topic not in TMF8829_ZEROMQ_TOPICS_FRAMES:
+            raise Tmf8829zeroMQRequestError("Topic {} cannot be compressed".format(topic))
+        if not compressionAvailable(compression):
+            raise Tmf8829zeroMQRequestError("Compression {} is not available".format(compression.name))
+        logger.info("Compression of topic {} is {}".format(topic, compression.name))
+        self._compression[topic] = compression
+
+    def _containerHeader(self, result, sequence = 0, completed = None ):
+        """ Function returns the zeroMQ container header for result frames
+        Args:
+            result: list of frames
+            sequence: result set sequence number
+            completed: time.monotonic() when the last frame of the set was read, defaults to now
+        Returns:
+            tmf8829ContainerFrameHeader
+        """
         resheader = tmf8829ContainerFrameHeader()
         containerframe_size =  ctypes.sizeof(resheader)
         containerframe_payload = containerframe_size - 8 # remove Payload of Frame excluding previous 8 Bytes and payload Bytes
         resheader.magicNumber = TMF8829_ZEROMQ_PROTOCOL_MAGIC_NUMBER
         resheader.protocolVersion = TMF8829_ZEROMQ_PROTOCOL_VERSION
-        resheader.payload = containerframe_payload + len(result)
+        resheader.payload = containerframe_payload + sum( len(_frame) for _frame in result )
         resheader.hostType = self.hostType
         resheader.deviceSerialNumber = self.deviceSerialNumber
         resheader.correctionFactor = self.correctionFactor
-        result = bytearray(resheader) + result
-        self._cnt += 1
+        _info = tmf8829ContainerInfo.from_buffer( resheader.info )
+        _info.acquiredNs = int( ( time.monotonic() if completed is None else completed ) * 1e9 )
+        _info.sequence = sequence & 0xFFFFFFFF
+        return resheader
+
+    def _buildResultSet(self, result, topic = TMF8829_ZEROMQ_TOPIC_RESULTS, sequence = 0, completed = None ):
+        """ Function adds the topic and the zeroMQ header to the result frames. If the topic is compressed the frames
+        are compressed into one part and the compression is stored in reserved[0] of the header.
+        Args:
+            result: list of frames
+            topic: topic of the message
+            sequence: result set sequence number
+            completed: time.monotonic() when the last frame of the set was read, defaults to now
+        Returns:
+            list of message parts, the topic, the container header and the frames (or the compressed frames)
+        """
+        resheader = self._containerHeader( result, sequence, completed )
         #print( "{} Complete sets".format(self._cnt) )
-        return result
+        _compression = self._compression.get( topic, Tmf8829zeroMQCompression.NONE )
+        if _compression != Tmf8829zeroMQCompression.NONE:
+            resheader.reserved[0] = _compression
+            return [ topic, bytearray(resheader), compressFrames( result, _compression ) ]
+        return [ topic, bytearray(resheader) ] + result
+
+    def _publishedHeader(self, result, sequence, completed = None ) -> bytes:
+        """ Function returns the container header of a result set with the publish time of now, for the replay buffer
+        and the shared memory ring.
+        Args:
+            result: list of frames
+            sequence: result set sequence number
+            completed: time.monotonic() when the last frame of the set was read, defaults to now
+        """
+        _header = self._containerHeader( result, sequence, completed )
+        _info = tmf8829ContainerInfo.from_buffer( _header.info )
+        _info.publishNs = time.monotonic_ns()
+        _info.publishTimeNs = time.time_ns()
+        return bytes(_header)
+
+    def _publishResultSet(self, result, acquired = None, completed = None ):
+        """ Function publishes the result frames as one multipart message per topic (histograms, reference SPAD,
+        results), so subscribers filter at the socket. The frames are handed over to zeroMQ without copying,
+        so they must not be modified afterwards. In threaded mode the messages are queued for the publisher thread.
+        Args:
+            result: list of frames
+            acquired: time.monotonic() when the first frame was read, defaults to now
+            completed: time.monotonic() when the last frame was read, defaults to now
+        """
+        _messages = self._splitResultSet( result )
+        _has_results = any( _topic == TMF8829_ZEROMQ_TOPIC_RESULTS for _topic, _frames in _messages )
+        if _has_results:
+            self._cnt += 1
+            _sequence = self._cnt
+        else:
+            _sequence = self._cnt + 1           # histograms published on their own (RESULTS_ONLY) get the number of their results
+        if self._replay.max_sets or self._shm is not None:
+            # one replay entry and ring slot per set: histograms published on their own are stored with their results
+            _held_sequence, _held = self._held_histograms
+            if not _has_results:
+                self._held_histograms = ( _sequence, result )
+            else:
+                self._held_histograms = ( 0, [] )
+                _set = ( _held if _held_sequence == _sequence else [] ) + result
+                _header = self._publishedHeader( _set, _sequence, completed )
+                self._replay.add( _sequence, _header, _set )
+            if _has_results and self._shm is not None:
+                _notification = self._shm.write( _sequence, [ _header ] + _set )
+                self._publishMessage( [ TMF8829_ZEROMQ_TOPIC_SHM, bytes(_notification) ]
+                                      + ( [] if _notification.length else [ _header ] + _set ) )    # too big for a slot: inline
+        for _idx, (_topic, _frames) in enumerate( _messages ):
+            _last = _idx == len(_messages) - 1
+            self._publishMessage( self._buildResultSet( _frames, _topic, _sequence, completed ), ( acquired or time.monotonic() ) if _last else None )
+            if _topic == TMF8829_ZEROMQ_TOPIC_RESULTS:
+                self._decodeResultSet( _frames )
+
+    def _publishMessage(self, parts, acquired = None ):
+        """ Function sends one multipart message on the publisher socket, or queues it in threaded mode.
+        Args:
+            parts: list of message parts, the first one is the topic
+            acquired: for the last message of a result set the time when its first frame was read, else None
+        """
+        if self._threaded:
+            self._publish_queue.put( (parts, acquired) )
+        else:
+            self._sendMessage( parts, acquired )
+
+    def _sendMessage(self, parts, acquired = None ):
+        """ Function writes the publish time into the container header of frame messages, prepends the topic prefix
+        and sends the message.
+        Args:
+            parts: list of message parts, the first one is the topic
+            acquired: for the last message of a result set the time when its first frame was read, else None
+        """
+        if parts[0] in TMF8829_ZEROMQ_TOPICS_FRAMES:
+            parts[1][TMF8829_ZEROMQ_PUBLISH_NS_OFFSET:TMF8829_ZEROMQ_PUBLISH_NS_OFFSET+16] = \
+                time.monotonic_ns().to_bytes(8, 'little') + time.time_ns().to_bytes(8, 'little')
+        if self.topic_prefix:
+            parts[0] = self.topic_prefix + parts[0]
+        self._result_socket.send_multipart( parts, copy=False )
+        if acquired is not None:
+            self.stats.countPublished( acquired )
+
+    def set_send_hwm(self, hwm: int) -> None:
+        """
+        Set the high water mark (SNDHWM) of the result socket: messages queued per subscriber before further ones are
+        dropped for this subscriber. A result set is up to three messages. Call it before start, it applies to
+        subscribers that connect afterwards.
+        Args:
+            hwm: number of messages, 0 for no limit
+        """
+        self._result_socket.setsockopt(zmq.SNDHWM, hwm)
+
+    def set_shared_memory(self, slots: int, slot_size: int = 1024*1024) -> None:
+        """
+        Enable the shared memory ring for clients on the same host. Every result set is written once into the ring,
+        the topic TMF8829_ZEROMQ_TOPIC_SHM carries only a notification. The frame topics are published as before.
+        Args:
+            slots: number of result sets in the ring, 0 disables the ring
+            slot_size: bytes per slot, bigger result sets are sent inline with the notification
+        """
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+        if slots:
+            from zeromq.tmf8829_zeromq_shm import SharedMemoryRing
+            self._shm = SharedMemoryRing.create( slots, slot_size )
+            logger.info("Shared memory {} with {} slots of {} bytes".format(self._shm.name, slots, slot_size))
+
+    def get_shared_memory(self) -> bytes:
+        """
+        Return the description of the shared memory ring for GET_SHARED_MEMORY.
+        Returns:
+            token (uint64), slots (uint32), slot size (uint32) and the utf-8 name, empty if the ring is disabled
+        """
+        if self._shm is None:
+            return b''
+        return self._shm.token.to_bytes(8, 'little') + self._shm.slots.to_bytes(4, 'little') \
+            + self._shm.slot_size.to_bytes(4, 'little') + self._shm.name.encode()
+
+    def set_replay_buffer(self, max_sets: int, max_bytes: int = 8*1024*1024) -> None:
+        """
+        Set the size of the replay buffer, that keeps the last published result sets for GET_REPLAY.
+        Args:
+            max_sets: maximum number of result sets, 0 disables the buffer
+            max_bytes: maximum number of bytes of all result sets
+        """
+        self._replay.resize( max_sets, max_bytes )
+
+    def get_replay(self, since: int = 0, max_sets: int = 0) -> bytes:
+        """
+        Return the result sets of the replay buffer.
+        Args:
+            since: only sets with a higher sequence number, 0 for all
+            max_sets: only the newest max_sets sets, 0 for all
+        Returns:
+            concatenation of the result sets (container header of the whole set followed by its frames), the oldest first
+        """
+        return b''.join( _part for _seq, _header, _frames in self._replay.get( since, max_sets ) for _part in [ _header ] + _frames )
+
+    def get_stats(self) -> dict:
+        """
+        Return the statistics of the server, servers add their own counters.
+        Returns:
+            dictionary that can be serialized to json
+        """
+        _stats = self.stats.snapshot()
+        _stats["measuring"] = self._meas_running
+        _stats["lost_frames"] = dict( self._assembler.lost )
+        _stats["discarded_frames"] = dict( self._assembler.discarded )
+        _stats["incomplete_sets"] = self._assembler.incomplete_sets
+        _stats["decode_dropped"] = self.decode_dropped
+        _stats["queue_depth"] = { "reassembly": self._assembler.pendingFrames(),
+                                  "publish": self._publish_queue.qsize(),
+                                  "decode": self._decode_queue.qsize() if self._decode_queue is not None else 0,
+                                  "replay": len(self._replay) }
+        return _stats
+
+    # threaded mode -------------------------------------------------------------------------------------
+
+    def _control(self, function, *args):
+        """Thread-safe control channel: execute function on the acquisition thread (between two frame reads)
+        and wait for its return value. Exceptions are raised in the calling thread.
+        Args:
+            function: function to be called with args
+        Returns:
+            return value of function
+        """
+        if not self._threaded:
+            return function(*args)
+        if self._threads_stop.is_set():
+            raise Exception("Acquisition thread is not running")
+        _future = Future()
+        self._control_queue.put( (_future, function, args) )
+        return _future.result()
+
+    def _acquisitionThread(self):
+        """Thread reads the device and queues complete result sets, it executes the requests of the control channel."""
+        try:
+            while not self._threads_stop.is_set():
+                try:
+                    _future, _function, _args = self._control_queue.get( block=not self._meas_running, timeout=0.1 )
+                    if _future.set_running_or_notify_cancel():
+                        try:
+                            _future.set_result( _function(*_args) )
+                        except Exception as exc:
+                            _future.set_exception( exc )
+                except Empty:
+                    pass
+                if self._meas_running:
+                    self._process_results()
+                    self._flushResults()
+        except Exception as exc:
+            logger.error("Acquisition thread stopped: {}".format(exc))
+            self._thread_error = exc
+            self._threads_stop.set()
+        while not self._control_queue.empty():          # nobody will execute them anymore
+            _future, _function, _args = self._control_queue.get()
+            _future.set_exception( Exception("Acquisition thread is not running") )
+
+    def _publisherThread(self):
+        """Thread sends the queued result sets on the PUB socket."""
+        while not (self._threads_stop.is_set() and self._publish_queue.empty()):
+            try:
+                _parts, _acquired = self._publish_queue.get( timeout=0.1 )
+            except Empty:
+                continue
+            self._sendMessage( _parts, _acquired )
+
+    def _commandThread(self):
+        """Thread receives the requests on the command socket, they are executed by the acquisition thread."""
+        while not self._threads_stop.is_set():
+            if self._cmd_socket.poll(timeout=100) != 0:
+                request = Tmf8829zeroMQRequestMessage(client_id=TMF8829_ZEROMQ_CLIENT_NOT_IDENTIFIED,buffer=self._cmd_socket.recv())
+                _received = time.time()
+                logger.debug("Received: %s", request)
+                try:
+                    response = self._control( self._process_CMD_request, request )
+                except Exception as exc:
+                    logger.error(exc)
+                    response = Tmf8829zeroMQResponseMessage(client_id=request.client_id,error_code=Tmf8829zeroMQErrorCodes.ERROR)
+                logger.debug("Sending : %s", response)
+                self._cmd_socket.send(response.to_buffer())
+                self.stats.countCommand( time.time() - _received )
+
+    def _startThreads(self, command_thread = True):
+        """Start the acquisition, publisher and command thread.
+        Args:
+            command_thread: False if the requests are received by someone else (ZeroMqMultiServer) and handed over with _control
+        """
+        self._threaded = True
+        self._threads_stop.clear()
+        self._thread_error = None
+        self._acquisition_thread = Thread( target=self._acquisitionThread, name="tmf8829-acquisition", daemon=True )
+        self._threads = [ self._acquisition_thread,
+                          Thread( target=self._publisherThread, name="tmf8829-publisher", daemon=True ) ]
+        if command_thread:
+            self._threads.append( Thread( target=self._commandThread, name="tmf8829-command", daemon=True ) )
+        for _thread in self._threads:
+            _thread.start()
+
+    def _stopThreads(self):
+        """Stop and join all threads, the server is in non-threaded mode afterwards."""
+        self._threads_stop.set()
+        for _thread in self._threads:
+            _thread.join()
+        self._threads = []
+        self._acquisition_thread = None
+        self._threaded = False
 
     # server start and server stop and server process --------------------------------------------------
 
-    def start(self,cmd_addr: str = TMF8829_ZEROMQ_CMD_SERVER_ADDR,result_addr: str = TMF8829_ZEROMQ_RESULT_SERVER_ADDR) -> None:
+    def start(self,cmd_addr = TMF8829_ZEROMQ_CMD_SERVER_ADDR,result_addr = TMF8829_ZEROMQ_RESULT_SERVER_ADDR, threaded: bool = False) -> None:
         """
         Start the server
         Args:
-            cmd_addr: Address for the command socket.
-            result_addr: Address for the result socket.
+            cmd_addr: Address or list of addresses for the command socket, e.g. tcp plus its ipcAddress.
+            result_addr: Address or list of addresses for the result socket.
+            threaded: True to read the device, publish results and handle commands in separate threads.
+                Commands are then handled immediately and executed between two frame reads.
         """
         logger.info("Server started.")
         self._open_communication_to_device()
-        self._cmd_socket.bind(cmd_addr)
-        self._result_socket.bind(result_addr)
+        self.endpoints = endpointInfo( bindEndpoints( self._cmd_socket, cmd_addr ), bindEndpoints( self._result_socket, result_addr ), self._context )
+        if threaded:
+            self._startThreads()
 
     def stop(self) -> None:
         """
         Stop the server.
         """
+        if self._threaded:
+            self._stopThreads()
+        self.set_point_cloud_stream( False )
+        self.set_shared_memory( 0 )
         self._close_communication_to_device()
         self._cmd_socket.close()
         self._result_socket.close()
@@ -315,18 +691,30 @@ class ZeroMqServer:
         logger.info("Server stopped")
 
     def process(self):
-        """Function checks on both sockets if there are things to be done. """
+        """Function checks on both sockets if there are things to be done.
+        In threaded mode the threads do the work, the function only waits and reports a stopped acquisition thread."""
+        if self._threaded:
+            if self._threads_stop.wait( timeout=0.1 ) and self._thread_error:
+                raise self._thread_error
+            return
         _time = time.time()
         if (not self._meas_running) or ((self._last_cmd_poll + self._cmd_poll_interval) < _time): # when not running poll faster for commands
             if self._cmd_socket.poll(timeout=1) != 0:     # events queued within our time limit
-                request = Tmf8829zeroMQRequestMessage(client_id=TMF8829_ZEROMQ_CLIENT_NOT_IDENTIFIED,buffer=self._cmd_socket.recv())
-                logger.debug("Received: %s", request)
-                response = self._process_CMD_request(request)
-                logger.debug("Sending : %s", response)
-                self._cmd_socket.send(response.to_buffer())
+                self._handleCommand()
 
         if self._meas_running:
             self._process_results()
+            self._flushResults()
+
+    def _handleCommand(self):
+        """Receive one request from the command socket, process it and send the response."""
+        request = Tmf8829zeroMQRequestMessage(client_id=TMF8829_ZEROMQ_CLIENT_NOT_IDENTIFIED,buffer=self._cmd_socket.recv())
+        _received = time.time()
+        logger.debug("Received: %s", request)
+        response = self._process_CMD_request(request)
+        logger.debug("Sending : %s", response)
+        self._cmd_socket.send(response.to_buffer())
+        self.stats.countCommand( time.time() - _received )
 
 
     # service routines to configure and communicate with the TMF8829 --------------------------------------
@@ -361,6 +749,8 @@ class ZeroMqServer:
             _dev_info.evmVersion[_] = int.from_bytes(bytes=bytes(self.evm_version[_], "utf-8"),byteorder='little',signed=False)
         _buffer = ctypes.create_string_buffer(ctypes.sizeof(tmf8829ZmqDeviceInfo))
         ctypes.memmove(_buffer,ctypes.byref(_dev_info),ctypes.sizeof(tmf8829ZmqDeviceInfo))
+        if self.endpoints:                                                                      # old clients ignore the appended endpoints
+            return _buffer.raw + json.dumps( self.endpoints ).encode()
         return _buffer.raw
 
     def power_device(self, on_off: bool) -> bool:
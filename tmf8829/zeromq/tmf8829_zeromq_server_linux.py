@@ -15,6 +15,7 @@ from pathlib import Path
 
 import shutil
 import subprocess
+import select
 
 UPDATE_FOLDER = "/tmp/tmf8829/update"
 
@@ -40,14 +41,62 @@ TMF8829_FRAME_ID_HISTOGRAM = 0xBB
 
 ### Helper Functions ###
 
-def read_from_misc_device(device_path):
-    try:
-        with open(device_path, 'rb') as device_file:
-            data = device_file.read(PAGE_SIZE * 64)
-            return data
-    except IOError as e:
-        print(f"Error reading from device: {e}")
-        return None
+class MiscDevice:
+    """
+    The misc device of the driver, it stays open while the server runs. Reads go into one reusable buffer.
+    """
+
+    def __init__(self, device_path:str, size:int=PAGE_SIZE * 64) -> None:
+        self._device_path = device_path
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._file = None
+        self._poll = select.poll()
+
+    def open(self) -> None:
+        """Open the device, does nothing if it is already open."""
+        if self._file is None:
+            self._file = open(self._device_path, 'rb', buffering=0)
+            self._poll.register(self._file.fileno(), select.POLLIN)
+
+    def close(self) -> None:
+        """Close the device, does nothing if it is not open."""
+        if self._file is not None:
+            self._poll.unregister(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._file is not None
+
+    def fileno(self) -> int:
+        """File descriptor of the open device, to register it e.g. with a zmq.Poller."""
+        return self._file.fileno()
+
+    def read(self) -> memoryview:
+        """Read all available data of the driver.
+        Returns:
+            memoryview into the reusable buffer, only valid until the next read. Empty if there is no data
+            or the device is not open.
+        """
+        if self._file is None:
+            return self._view[:0]
+        try:
+            _size = self._file.readinto(self._buffer)
+        except IOError as e:
+            print(f"Error reading from device: {e}")
+            _size = 0
+        return self._view[:_size or 0]
+
+    def wait(self, timeout:int) -> bool:
+        """Wait until the driver has data to read.
+        Args:
+            timeout: maximum time to wait in milliseconds
+        Returns:
+            True if data is available, False on timeout
+        """
+        return len(self._poll.poll(timeout)) > 0
 
 ### ZMQ Server Class ###
 
@@ -58,20 +107,32 @@ class ZeroMqLinuxServer(ZeroMqServer):
     The data socket provides unidirectional measurement results and optional histograms.
     Server for TMF8829 Linux Driver.
     """
-    VERSION = 0x0001
+    VERSION = 0x0004
     """Version 
     - 1 First zeromq server release version
-    -
+    - 2 misc device stays open, poll based reading into a reusable buffer
+        result sets are built by the ResultSetAssembler of the server core
+    - 3 device reads are counted in the statistics
+    - 4 driver path and misc device can be selected, for several devices in a ZeroMqMultiServer
     """
     APPLICATION_ID = 0x01
     BOOTLOADER_ID = 0x80
 
-    def __init__(self, cmd_poll_interval=1.0) -> None:
+    def __init__(self, cmd_poll_interval=1.0, driver_path=DRIVER_PATH, misc_device=MISC_DEVICE) -> None:
+        """
+        Args:
+            cmd_poll_interval: poll interval of the command socket while measuring
+            driver_path: sysfs folder of the driver attributes of the device
+            misc_device: misc device of the driver that the results are read from
+        """
         super().__init__(cmd_poll_interval=cmd_poll_interval)
+        self._driver_path = driver_path
         self.fpMode = 0
         self.rawHistograms = 0
         self.dualMode = 0
         self.hostType = TMF8829_ZEROMQ_HOST_RASPBERRY_BOARD 
+        self._device = MiscDevice(misc_device)
+        self._poller = None                 # command socket + misc device, used while measuring in non-threaded mode
 
 
     def _process_results(self):
@@ -79,19 +140,20 @@ class ZeroMqLinuxServer(ZeroMqServer):
         result frames and adds this result to the internally stored result structure. As soon as 
         all result frames for one measurement are available an zeroMQ result-frame is published.
         """
-        result_driver = read_from_misc_device(MISC_DEVICE)
+        data = self._device.read()
+        if len(data):
+            self.stats.countBus( len(data) )
 
-        result_length = len(result_driver)
-        if result_length == 0:
-            time.sleep(0.001)
+        if len(data) == 0:
+            if self._device.wait(timeout=10):   # readable but nothing read: driver without poll support, do not spin
+                time.sleep(0.001)
         else:
-            data = list(result_driver)
-
-            while (len(data) >= 8):
-                driver_header = data[0:8]
+            offset = 0
+            while (len(data) - offset >= 8):
+                driver_header = data[offset:offset+8]
                 payload = driver_header[6] + driver_header[7] * 256
-                frame = data[8:8+payload]
-                data = data[8+payload:] # next frame if available
+                frame = data[offset+8:offset+8+payload]
+                offset += 8+payload # next frame if available
                 
                 #logger.debug("Header: {} Payload: {}".format( driver_header, payload ))
 
@@ -103,17 +165,20 @@ class ZeroMqLinuxServer(ZeroMqServer):
                 if (fid & TMF8829_FID_MASK)  == TMF8829_FID_RESULTS:
                     self.correctionFactor = driver_header[2] + driver_header[3] * 256
 
-                result = self._removeIncompleteResults(result, fid, sub_idx, fnumber, self.rawHistograms)
-
-                if result:
-                    self._result += result
-                    self._nr_subframes += 1
-                    if (self._nr_subframes == self.nr_results) and ((fid & TMF8829_FID_MASK)  == TMF8829_FID_RESULTS): # zeroMQ packet is complete (correct frame number and last frame is result frame)
-                        res_to_send = self._buildResultSet( self._result )
-                        self._result_socket.send(bytes(res_to_send))
-                        self._newFrame()
-                else:
-                    logger.debug("Missing result frame.")
+                self._assembleResult(result, fid, sub_idx, fnumber)
+
+    def process(self):
+        """Function waits on the command socket and the misc device at the same time while measuring,
+        it wakes up as soon as there is a command or new data."""
+        if self._threaded or not self._meas_running or self._poller is None:     # poller is None while the device is closed
+            return super().process()
+        _events = dict(self._poller.poll(timeout=100))
+        if self._cmd_socket in _events:
+            self._handleCommand()
+        if self._meas_running and self._device.fileno() in _events:
+            self._process_results()
+        if self._meas_running:
+            self._flushResults()
 
     # service routines to configure and communicate with the TMF8829 --------------------------------------
     def _open_communication_to_device(self) -> None:
@@ -121,8 +186,12 @@ class ZeroMqLinuxServer(ZeroMqServer):
         Open the device connection.
         """
         logger.info( "Open communication with device")
+        self._device.open()
+        self._poller = zmq.Poller()
+        self._poller.register(self._cmd_socket, zmq.POLLIN)
+        self._poller.register(self._device.fileno(), zmq.POLLIN)
 
-        with open(DRIVER_PATH+PROGRAM_VERSION, encoding="utf-8") as f:
+        with open(self._driver_path+PROGRAM_VERSION, encoding="utf-8") as f:
             values = f.read().strip().split()
 
         version = [ int(value, base=16) for value in values]
@@ -145,7 +214,10 @@ class ZeroMqLinuxServer(ZeroMqServer):
         """
         logger.info("Close device connection.")
         
-        self.stop_measurement()
+        if self._meas_running and self._device.is_open:
+            self.stop_measurement()
+        self._poller = None
+        self._device.close()
         
 
     # ---- zeroMQ communication commands/response handling --------------------------------
@@ -155,17 +227,12 @@ class ZeroMqLinuxServer(ZeroMqServer):
         """
 
         logger.debug("Enter Start measurement")
-        self.nr_results = Tmf8829AppCommon.numberOfFrameReadsPerMeasurement(self.fpMode,self.rawHistograms,dualMode=self.dualMode)
-        logger.info(" {} frames for a complete result set".format(self.nr_results))
-        self._nr_subframes = 0
-        self._result = bytearray()
-        self._res_fnumber = -1
-        self.lost_results = 0
+        self._assembler.configure(fp_mode=self.fpMode, histograms=self.rawHistograms, dual_mode=self.dualMode)
         
-        result = read_from_misc_device(MISC_DEVICE)
+        result = self._device.read()
         logger.debug("Clear not send data: {}".format(len(result)))
 
-        with open(DRIVER_PATH+START_MEASUREMENT, mode="w", encoding="utf-8") as f:
+        with open(self._driver_path+START_MEASUREMENT, mode="w", encoding="utf-8") as f:
             values = f.write("1")
         
         self._meas_running = True
@@ -179,18 +246,17 @@ class ZeroMqLinuxServer(ZeroMqServer):
 
         logger.debug("Stop measurement")
 
-        with open(DRIVER_PATH+START_MEASUREMENT, mode="w", encoding="utf-8") as f:
+        with open(self._driver_path+START_MEASUREMENT, mode="w", encoding="utf-8") as f:
             values = f.write("0")
         
-        result = read_from_misc_device(MISC_DEVICE)
+        result = self._device.read()
         logger.debug("Clear not send data: {}".format(len(result)))
 
         self._meas_running = False
-        self._nr_subframes = 0
-        self._result = bytearray()
+        self._assembler.discard()
         logger.info("{} Result processing stopped.".format(time.time()))
-        logger.info("Number lost result frames are at least {}".format(self.lost_results))
-        self.lost_results = 0
+        logger.info("Number lost frames are at least {} {}".format(self.lost_results, self._assembler.lost))
+        self._assembler.resetCounters()
 
         return self._meas_running
 
@@ -203,12 +269,12 @@ class ZeroMqLinuxServer(ZeroMqServer):
 
         logger.debug("Get Device configuration")
 
-        with open(DRIVER_PATH+CONFIG_CUSTOM, encoding="utf-8") as f:
+        with open(self._driver_path+CONFIG_CUSTOM, encoding="utf-8") as f:
             values = f.read().strip().split()
         
         configuration = [ int(value, base=16) for value in values]
         
-        _cfg_dict = RegConv.readPageToDict(bytes(configuration),Tmf8829ConfigRegs())
+        _cfg_dict = Tmf8829ConfigCodec.decode(configuration)
 
         logger.info( _cfg_dict)
         self.fpMode =_cfg_dict["fp_mode"]
@@ -228,7 +294,7 @@ class ZeroMqLinuxServer(ZeroMqServer):
         
         logger.debug("Set Device configuration")
         
-        _cfg_dict = RegConv.readPageToDict(bytes(configuration),Tmf8829ConfigRegs())
+        _cfg_dict = Tmf8829ConfigCodec.decode(configuration)
         logger.info( _cfg_dict)
         self.fpMode =_cfg_dict["fp_mode"]
         self.rawHistograms =_cfg_dict["histograms"]
@@ -236,7 +302,7 @@ class ZeroMqLinuxServer(ZeroMqServer):
 
         values = " ".join(hex(e) for e in bytes(configuration))
         
-        with open(DRIVER_PATH+CONFIG_CUSTOM, mode="w", encoding="utf-8") as f:
+        with open(self._driver_path+CONFIG_CUSTOM, mode="w", encoding="utf-8") as f:
             values = f.write(values)
 
     def set_pre_config_cmd(self, cmd:bytes) -> None:
@@ -254,7 +320,7 @@ class ZeroMqLinuxServer(ZeroMqServer):
         logger.debug("Num:" + values)
 
 
-        with open(DRIVER_PATH+CONFIG_MODE, mode="w", encoding="utf-8") as f:
+        with open(self._driver_path+CONFIG_MODE, mode="w", encoding="utf-8") as f:
             values = f.write(values)
 
 
@@ -266,7 +332,7 @@ class ZeroMqLinuxServer(ZeroMqServer):
             regs
         """
 
-        with open(DRIVER_PATH+SERIAL_NUMBER, encoding="utf-8") as f:
+        with open(self._driver_path+SERIAL_NUMBER, encoding="utf-8") as f:
             value = f.read()
         
         serial_number = int(value,base=16)
@@ -315,11 +381,22 @@ class ZeroMqLinuxServer(ZeroMqServer):
 
 if __name__ == "__main__":
     import pathlib
+    import sys
 
     logging.basicConfig(level=logging.DEBUG,format='%(levelname)s %(name)s.%(funcName)s:%(lineno)d %(message)s')
 
     server = ZeroMqLinuxServer(cmd_poll_interval = 0.0001)
-    server.start(cmd_addr= TMF8829_ZEROMQ_CMD_LINUX_SERVER_ADDR, result_addr=TMF8829_ZEROMQ_RESULT_LINUX_SERVER_ADDR)
+    for _arg in sys.argv:
+        if _arg.startswith("--sndhwm="):                            # high water mark of the result socket
+            server.set_send_hwm( int(_arg.split("=")[1]) )
+    server.set_point_cloud_stream( "--point-cloud" in sys.argv )
+    if "--shared-memory" in sys.argv:
+        server.set_shared_memory( 8 )
+    if "--compress-histograms" in sys.argv:
+        server.set_compression( TMF8829_ZEROMQ_TOPIC_HISTOGRAMS, Tmf8829zeroMQCompression.LZ4 if compressionAvailable(Tmf8829zeroMQCompression.LZ4) else Tmf8829zeroMQCompression.ZLIB )
+    _ipc = "--ipc" in sys.argv                                      # additional endpoints for clients on this host
+    server.start(cmd_addr= [TMF8829_ZEROMQ_CMD_LINUX_SERVER_ADDR] + ([ipcAddress(TMF8829_ZEROMQ_CMD_LINUX_SERVER_ADDR)] if _ipc else []),
+                 result_addr=[TMF8829_ZEROMQ_RESULT_LINUX_SERVER_ADDR] + ([ipcAddress(TMF8829_ZEROMQ_RESULT_LINUX_SERVER_ADDR)] if _ipc else []), threaded="--threaded" in sys.argv)
 
     try:
         while True:
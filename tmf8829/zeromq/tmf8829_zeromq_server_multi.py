@@ -0,0 +1,187 @@
+# *****************************************************************************
+# * Copyright by ams OSRAM AG                                                 *
+# * All rights are reserved.                                                  *
+# *                                                                           *
+# *FOR FULL LICENSE TEXT SEE LICENSES-MIT.TXT                                 *
+# *****************************************************************************
+"""
+ZeroMQ server for several TMF8829 devices behind one command and one result socket.
+
+Every device is a ZeroMqServer (e.g. ZeroMqLinuxServer with its own misc device) that runs in threaded mode with
+its own acquisition thread, so all devices are read concurrently. The requests of a client go to the device it
+selected with SELECT_DEVICE (device 0 by default), each device has its own configuration client.
+The messages of device n are published with the topic prefix deviceTopicPrefix(n), e.g. b"DEV1:RES:".
+"""
+from tmf8829_zeromq_server_core import *
+
+
+class _DevicePublisher:
+    """Stands in for the PUB socket of a device server, the messages are sent by the publisher thread of the multi server."""
+
+    def __init__(self, publish_queue: Queue) -> None:
+        self._publish_queue = publish_queue
+
+    def send_multipart(self, parts, copy=False) -> None:
+        self._publish_queue.put( parts )
+
+    def close(self) -> None:
+        pass
+
+
+class ZeroMqMultiServer:
+    """
+    Several device servers behind one command and one result socket.
+    """
+    VERSION = 0x0003
+    """Version
+    - 1 First multi device server version
+    - 2 several endpoints per socket, advertised to the clients of all devices
+    - 3 set_send_hwm
+    """
+
+    def __init__(self, devices: list) -> None:
+        """
+        Args:
+            devices: list of ZeroMqServer objects, not started. The index in the list is the device index.
+        """
+        self._context = zmq.Context()
+        self._cmd_socket = self._context.socket(zmq.REP)
+        self._result_socket = self._context.socket(zmq.PUB)
+        self._publish_queue = Queue()                           # messages of all devices
+        self._stop = Event()
+        self._publisher = None
+        self._selected = {}                                     # client id -> device index
+        self.devices = devices
+        for _idx, _device in enumerate( self.devices ):
+            _device.topic_prefix = deviceTopicPrefix( _idx )
+            _device._result_socket.close()                      # never bound, the multi server publishes
+            _device._result_socket = _DevicePublisher( self._publish_queue )
+
+    def _process_CMD_request(self, request: Tmf8829zeroMQRequestMessage) -> Tmf8829zeroMQResponseMessage:
+        """ Function handles SELECT_DEVICE and hands all other requests to the device that the client selected.
+        The request is executed by the acquisition thread of the device.
+        """
+        _device = self._selected.get( request.client_id, 0 )
+        if int(Tmf8829zeroMQRequestId.SELECT_DEVICE) == request.request_id and request.client_id != TMF8829_ZEROMQ_CLIENT_NOT_IDENTIFIED:
+            logger.info("rcv {}".format(request.__str__()))
+            if len(request.payload) and request.payload[0] < len(self.devices):
+                _device = request.payload[0]
+                self._selected[request.client_id] = _device
+                resp = Tmf8829zeroMQResponseMessage(client_id=request.client_id,
+                                                    payload=bytes([len(self.devices)]) + self.devices[_device].topic_prefix)
+            else:
+                logger.error("Device {} does not exist".format(list(request.payload[0:1])))
+                resp = Tmf8829zeroMQResponseMessage(client_id=request.client_id,error_code=Tmf8829zeroMQErrorCodes.ERROR)
+            logger.info("send {}".format(resp.__str__()))
+            return resp
+        if int(Tmf8829zeroMQRequestId.LEAVE) == request.request_id:
+            self._selected.pop( request.client_id, None )
+        try:
+            return self.devices[_device]._control( self.devices[_device]._process_CMD_request, request )
+        except Exception as exc:
+            logger.error(exc)
+            return Tmf8829zeroMQResponseMessage(client_id=request.client_id,error_code=Tmf8829zeroMQErrorCodes.ERROR)
+
+    def _publisherThread(self):
+        """Thread sends the messages of all devices on the PUB socket."""
+        while not (self._stop.is_set() and self._publish_queue.empty()):
+            try:
+                _parts = self._publish_queue.get( timeout=0.1 )
+            except Empty:
+                continue
+            self._result_socket.send_multipart( _parts, copy=False )
+
+    def set_send_hwm(self, hwm: int) -> None:
+        """
+        Set the high water mark (SNDHWM) of the result socket, see ZeroMqServer.set_send_hwm.
+        Args:
+            hwm: number of messages, 0 for no limit
+        """
+        self._result_socket.setsockopt(zmq.SNDHWM, hwm)
+
+    def start(self,cmd_addr = TMF8829_ZEROMQ_CMD_SERVER_ADDR,result_addr = TMF8829_ZEROMQ_RESULT_SERVER_ADDR) -> None:
+        """
+        Open all devices, start their acquisition threads and bind the sockets.
+        Args:
+            cmd_addr: Address or list of addresses for the command socket.
+            result_addr: Address or list of addresses for the result socket.
+        """
+        for _device in self.devices:
+            _device._open_communication_to_device()
+        _endpoints = endpointInfo( bindEndpoints( self._cmd_socket, cmd_addr ), bindEndpoints( self._result_socket, result_addr ), self._context )
+        for _device in self.devices:
+            _device.endpoints = _endpoints
+        self._stop.clear()
+        self._publisher = Thread( target=self._publisherThread, name="tmf8829-multi-publisher", daemon=True )
+        self._publisher.start()
+        for _device in self.devices:
+            _device._startThreads( command_thread=False )
+        logger.info("Multi device server started with {} devices.".format(len(self.devices)))
+
+    def stop(self) -> None:
+        """
+        Stop all devices and the server.
+        """
+        for _device in self.devices:
+            _device.stop()
+        self._stop.set()
+        if self._publisher is not None:
+            self._publisher.join()
+            self._publisher = None
+        self._cmd_socket.close()
+        self._result_socket.close()
+        self._context.term()
+        logger.info("Multi device server stopped")
+
+    def process(self):
+        """Function handles one request of the command socket, the devices are read by their own threads.
+        A device whose acquisition thread stopped raises its error."""
+        for _device in self.devices:
+            if _device._thread_error is not None:
+                raise _device._thread_error
+        if self._cmd_socket.poll(timeout=100) != 0:
+            request = Tmf8829zeroMQRequestMessage(client_id=TMF8829_ZEROMQ_CLIENT_NOT_IDENTIFIED,buffer=self._cmd_socket.recv())
+            _received = time.time()
+            _device = self._selected.get( request.client_id, 0 )       # before the request, LEAVE drops the selection
+            response = self._process_CMD_request(request)
+            if int(Tmf8829zeroMQRequestId.SELECT_DEVICE) == request.request_id:
+                _device = self._selected.get( request.client_id, _device ) # the device the client selected now
+            self._cmd_socket.send(response.to_buffer())
+            self.devices[_device].stats.countCommand( time.time() - _received )
+
+
+#####################################################################################
+### ZERO MQ SERVER - MAIN                                                         ###
+#####################################################################################
+
+if __name__ == "__main__":
+    import sys
+    from tmf8829_zeromq_server_linux import ZeroMqLinuxServer
+
+    logging.basicConfig(level=logging.DEBUG,format='%(levelname)s %(name)s.%(funcName)s:%(lineno)d %(message)s')
+
+    # one argument per device: <misc device>,<driver path>, e.g. /dev/tof_tmf8829,/sys/class/i2c-adapter/i2c-0/0-0041/
+    _devices = [ _arg.split(",") for _arg in sys.argv[1:] if not _arg.startswith("--") ]
+    if not _devices:
+        print("Usage: tmf8829_zeromq_server_multi.py <misc device>,<driver path> [<misc device>,<driver path> ...] [--point-cloud] [--shared-memory] [--ipc] [--sndhwm=<n>]")
+        exit(0)
+
+    server = ZeroMqMultiServer( [ ZeroMqLinuxServer( misc_device=_misc, driver_path=_path ) for _misc, _path in _devices ] )
+    for _arg in sys.argv:
+        if _arg.startswith("--sndhwm="):                            # high water mark of the result socket
+            server.set_send_hwm( int(_arg.split("=")[1]) )
+    for _device in server.devices:                                  # before start, the acquisition threads use these
+        _device.set_point_cloud_stream( "--point-cloud" in sys.argv )
+        if "--shared-memory" in sys.argv:
+            _device.set_shared_memory( 8 )
+    _ipc = "--ipc" in sys.argv                                      # additional endpoints for clients on this host
+    server.start( cmd_addr= [TMF8829_ZEROMQ_CMD_LINUX_SERVER_ADDR] + ([ipcAddress(TMF8829_ZEROMQ_CMD_LINUX_SERVER_ADDR)] if _ipc else []),
+                  result_addr=[TMF8829_ZEROMQ_RESULT_LINUX_SERVER_ADDR] + ([ipcAddress(TMF8829_ZEROMQ_RESULT_LINUX_SERVER_ADDR)] if _ipc else []) )
+
+    try:
+        while True:
+            server.process()
+    except KeyboardInterrupt:
+        pass
+
+    server.stop()
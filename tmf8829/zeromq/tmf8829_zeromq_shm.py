@@ -0,0 +1,176 @@
+# *****************************************************************************
+# * Copyright by ams OSRAM AG                                                 *
+# * All rights are reserved.                                                  *
+# *                                                                           *
+# *FOR FULL LICENSE TEXT SEE LICENSES-MIT.TXT                                 *
+# *****************************************************************************
+"""
+Shared memory transport of the zeroMQ servers for clients on the same host.
+The server writes every result set once into a slot of a ring in shared memory and publishes only a small
+notification (topic TMF8829_ZEROMQ_TOPIC_SHM) with slot, sequence and length. The client copies the slot and checks
+the sequence number of the slot again afterwards, a set that the server overwrote during the copy is discarded.
+
+Layout of the shared memory: tmf8829ShmRingHeader, then slots slots of slotSize bytes. Each slot is a tmf8829ShmSlotHeader
+followed by the result set (container header of the whole set and its frames).
+"""
+import ctypes
+import random
+import sys
+from multiprocessing import shared_memory
+
+TMF8829_SHM_MAGIC_NUMBER = 0x53384D54       # "TM8S"
+
+
+class tmf8829ShmRingHeader(ctypes.LittleEndianStructure):
+    """Header of the shared memory"""
+    _pack_ = 1
+    _fields_ = [
+        ('magicNumber', ctypes.c_uint32),
+        ('slots', ctypes.c_uint32),         # number of slots
+        ('slotSize', ctypes.c_uint32),      # bytes per slot including the slot header
+        ('reserved', ctypes.c_uint32),
+        ('token', ctypes.c_uint64),         # random number, also reported by GET_SHARED_MEMORY to detect the same host
+    ]
+
+class tmf8829ShmSlotHeader(ctypes.LittleEndianStructure):
+    """Header of a slot, sequence is 0 while the slot is written"""
+    _pack_ = 1
+    _fields_ = [
+        ('sequence', ctypes.c_uint32),      # result set sequence number
+        ('length', ctypes.c_uint32),        # bytes of the result set
+    ]
+
+class tmf8829ShmNotification(ctypes.LittleEndianStructure):
+    """Message part after the topic TMF8829_ZEROMQ_TOPIC_SHM. A result set that does not fit into a slot has length 0,
+    the container header and the frames follow as further message parts."""
+    _pack_ = 1
+    _fields_ = [
+        ('slot', ctypes.c_uint32),
+        ('sequence', ctypes.c_uint32),
+        ('length', ctypes.c_uint32),
+    ]
+
+_RING_HEADER_SIZE = ctypes.sizeof(tmf8829ShmRingHeader)
+_SLOT_HEADER_SIZE = ctypes.sizeof(tmf8829ShmSlotHeader)
+
+
+class SharedMemoryRing:
+    """Ring of result sets in shared memory, created by the server (create) and attached by clients (attach)."""
+
+    _created = set()                                # names of the rings created by this process
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool) -> None:
+        self._shm = shm
+        self._owner = owner
+        self._header = tmf8829ShmRingHeader.from_buffer_copy( shm.buf[0:_RING_HEADER_SIZE] )
+        self._next = 0                              # next slot to write
+        if self._header.magicNumber != TMF8829_SHM_MAGIC_NUMBER:
+            self.close()
+            raise ValueError("Shared memory {} is no tmf8829 ring".format(shm.name))
+
+    @classmethod
+    def create(cls, slots: int = 8, slot_size: int = 1024*1024):
+        """Create a new ring with a unique name.
+        Args:
+            slots: number of result sets the ring holds
+            slot_size: bytes per slot, result sets that are bigger are not written into the ring
+        Returns:
+            SharedMemoryRing
+        """
+        _shm = shared_memory.SharedMemory( name="tmf8829_{:08x}".format(random.getrandbits(32)), create=True,
+                                           size=_RING_HEADER_SIZE + slots * slot_size )
+        _header = tmf8829ShmRingHeader( magicNumber=TMF8829_SHM_MAGIC_NUMBER, slots=slots, slotSize=slot_size,
+                                        token=random.getrandbits(64) )
+        _shm.buf[0:_RING_HEADER_SIZE] = bytes(_header)
+        cls._created.add( _shm.name )
+        return cls( _shm, owner=True )
+
+    @classmethod
+    def attach(cls, name: str):
+        """Attach to the ring of a server on this host.
+        Args:
+            name: name of the shared memory
+        Returns:
+            SharedMemoryRing
+        Raises:
+            FileNotFoundError: no shared memory with this name on this host
+        """
+        if sys.version_info >= (3, 13):
+            _shm = shared_memory.SharedMemory( name=name, track=False )
+        else:
+            _shm = shared_memory.SharedMemory( name=name )
+            if name not in cls._created:        # the resource tracker would remove the memory of the server at exit
+                try:
+                    from multiprocessing import resource_tracker
+                    resource_tracker.unregister( _shm._name, "shared_memory" )
+                except Exception:
+                    pass
+        return cls( _shm, owner=False )
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def token(self) -> int:
+        return self._header.token
+
+    @property
+    def slots(self) -> int:
+        return self._header.slots
+
+    @property
+    def slot_size(self) -> int:
+        return self._header.slotSize
+
+    def _offset(self, slot: int) -> int:
+        return _RING_HEADER_SIZE + slot * self._header.slotSize
+
+    def write(self, sequence: int, parts: list) -> tmf8829ShmNotification:
+        """Write a result set into the next slot.
+        Args:
+            sequence: result set sequence number, not 0
+            parts: container header and frames
+        Returns:
+            notification for the clients, length is 0 if the set does not fit into a slot
+        """
+        _length = sum( len(_part) for _part in parts )
+        if _length + _SLOT_HEADER_SIZE > self._header.slotSize:
+            return tmf8829ShmNotification( slot=0, sequence=sequence, length=0 )
+        _slot = self._next
+        self._next = ( self._next + 1 ) % self._header.slots
+        _offset = self._offset(_slot)
+        _buf = self._shm.buf
+        _buf[_offset:_offset+_SLOT_HEADER_SIZE] = bytes(_SLOT_HEADER_SIZE)     # sequence 0 = slot is written
+        _pos = _offset + _SLOT_HEADER_SIZE
+        for _part in parts:
+            _buf[_pos:_pos+len(_part)] = _part
+            _pos += len(_part)
+        _buf[_offset:_offset+_SLOT_HEADER_SIZE] = bytes( tmf8829ShmSlotHeader( sequence=sequence, length=_length ) )
+        return tmf8829ShmNotification( slot=_slot, sequence=sequence, length=_length )
+
+    def valid(self, slot: int, sequence: int) -> bool:
+        """Returns: True if the slot still holds the result set with the sequence number"""
+        return tmf8829ShmSlotHeader.from_buffer_copy( self._shm.buf, self._offset(slot) ).sequence == sequence
+
+    def read(self, notification: tmf8829ShmNotification):
+        """Copy the result set of a notification. The server writes the slot again after slots-1 further result sets,
+        so the slot is checked before and after the copy (see valid).
+        Args:
+            notification: notification received with the topic TMF8829_ZEROMQ_TOPIC_SHM
+        Returns:
+            bytes of the result set (container header and frames), None if the slot was overwritten before or during the copy
+        """
+        if not self.valid( notification.slot, notification.sequence ):
+            return None
+        _offset = self._offset( notification.slot ) + _SLOT_HEADER_SIZE
+        _data = bytes( self._shm.buf[_offset:_offset+notification.length] )
+        if not self.valid( notification.slot, notification.sequence ):
+            return None                             # torn: the server wrote the slot while it was copied
+        return _data
+
+    def close(self) -> None:
+        """Detach from the shared memory, the server also removes it."""
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
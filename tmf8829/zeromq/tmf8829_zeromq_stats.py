@@ -0,0 +1,107 @@
+# *****************************************************************************
+# * Copyright by ams OSRAM AG                                                 *
+# * All rights are reserved.                                                  *
+# *                                                                           *
+# *FOR FULL LICENSE TEXT SEE LICENSES-MIT.TXT                                 *
+# *****************************************************************************
+"""
+Runtime statistics of the zeroMQ servers, reported with the request GET_STATS.
+"""
+import time
+from collections import deque
+from threading import Lock
+
+
+class ServerStatistics:
+    """
+    Counters of a zeroMQ server. The counters are totals since the start of the server, the rates are
+    calculated over the last RATE_WINDOW seconds, the latencies over the last LATENCY_SAMPLES events.
+    The functions can be called from different threads.
+    """
+
+    RATE_WINDOW = 10.0
+    """Seconds that the rates are averaged over"""
+    LATENCY_SAMPLES = 1000
+    """Number of latencies kept for mean and p99"""
+
+    _RATE_COUNTERS = ( "sets_published", "frames_read", "bytes_read", "bus_transactions", "bus_bytes" )
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._start = time.time()
+        self.counters = dict.fromkeys( self._RATE_COUNTERS + ("commands",), 0 )
+        self._samples = deque( maxlen=int(self.RATE_WINDOW)+1 )        # (time, counters) about once per second
+        self._publish_latency = deque( maxlen=self.LATENCY_SAMPLES )
+        self._command_latency = deque( maxlen=self.LATENCY_SAMPLES )
+        self._sample( self._start )
+
+    def _sample(self, now:float ) -> None:
+        """Keep the counters for the rate calculation, at most once per second. Called with the lock held."""
+        if not self._samples or now - self._samples[-1][0] >= 1.0:
+            self._samples.append( (now, dict(self.counters)) )
+
+    def countFrames(self, nr_bytes:int ) -> None:
+        """Count one frame read from the device.
+        Args:
+            nr_bytes: size of the frame
+        """
+        with self._lock:
+            self.counters["frames_read"] += 1
+            self.counters["bytes_read"] += nr_bytes
+
+    def countBus(self, nr_bytes:int, transactions:int = 1 ) -> None:
+        """Count transfers on the device bus (I2C/SPI/serial).
+        Args:
+            nr_bytes: transferred bytes
+            transactions: number of transfers
+        """
+        with self._lock:
+            self.counters["bus_transactions"] += transactions
+            self.counters["bus_bytes"] += nr_bytes
+
+    def countPublished(self, acquired:float ) -> None:
+        """Count one published result set.
+        Args:
+            acquired: time.monotonic() when the first frame of the set was read
+        """
+        _latency = time.monotonic() - acquired
+        with self._lock:
+            self.counters["sets_published"] += 1
+            self._publish_latency.append( _latency )
+            self._sample( time.time() )
+
+    def countCommand(self, duration:float ) -> None:
+        """Count one handled command.
+        Args:
+            duration: time from receiving the request to sending the response in seconds
+        """
+        with self._lock:
+            self.counters["commands"] += 1
+            self._command_latency.append( duration )
+
+    @staticmethod
+    def _latency( samples ) -> dict:
+        """Returns: dictionary with mean and p99 in milliseconds of the samples, None without samples"""
+        if not samples:
+            return { "mean_ms": None, "p99_ms": None, "samples": 0 }
+        _sorted = sorted( samples )
+        return { "mean_ms": 1000.0 * sum(_sorted) / len(_sorted),
+                 "p99_ms": 1000.0 * _sorted[ min( len(_sorted)-1, int(0.99*len(_sorted)) ) ],
+                 "samples": len(_sorted) }
+
+    def snapshot(self) -> dict:
+        """Return the counters, rates and latencies
+        Returns:
+            dictionary that can be serialized to json
+        """
+        _now = time.time()
+        with self._lock:
+            self._sample( _now )
+            _t0, _c0 = self._samples[0]
+            _dt = max( _now - _t0, 1e-6 )
+            _stats = { "uptime_s": _now - self._start,
+                       "counters": dict(self.counters),
+                       "rates_per_s": { _name: (self.counters[_name] - _c0[_name]) / _dt for _name in self._RATE_COUNTERS },
+                       "acquisition_to_publish": self._latency( self._publish_latency ),
+                       "command_handling": self._latency( self._command_latency ) }
+        return _stats